@@ -44,7 +44,9 @@ def parseArgs() -> argparse.Namespace:
 	groupApps.add_argument('--remote-configuration', action='store_true', dest='remoteconfigenabled', default=None, help='enable http remote configuration endpoint')
 	groupApps.add_argument('--no-remote-configuration', action='store_false', dest='remoteconfigenabled', default=None, help='disable http remote configuration endpoint')
 
+	parser.add_argument('--db-backend', action='store', dest='dbbackend', default=None, choices=[ 'tinydb', 'sqlite' ], type=str.lower, help='specify the DB´s backend')
 	parser.add_argument('--db-reset', action='store_true', dest='dbreset', default=None, help='reset the DB when starting the CSE')
+	parser.add_argument('--db-restore', action='store', dest='dbrestorefile', default=None, metavar='<filename>', help='restore the DB from a backup file when starting the CSE')
 	parser.add_argument('--db-storage', action='store', dest='dbstoragemode', default=None, choices=[ 'memory', 'disk' ], type=str.lower, help='specify the DB´s storage mode')
 	parser.add_argument('--log-level', action='store', dest='loglevel', default=None, choices=[ 'info', 'error', 'warn', 'debug', 'off'], type=str.lower, help='set the log level, or turn logging off')
 	parser.add_argument('--import-directory', action='store', dest='importdirectory', default=None, metavar='<directory>', help='specify the import directory')
@@ -13,6 +13,7 @@ from typing import Any, Dict
 from Constants import Constants as C
 from Types import CSEType
 from rich.console import Console
+from helpers import Codecs
 
 
 class Configuration(object):
@@ -34,7 +35,9 @@ class Configuration(object):
 		argsLoglevel			= args.loglevel if args is not None and 'loglevel' in args else None
 		argsDBReset				= args.dbreset if args is not None and 'dbreset' in args else False
 		argsDBStorageMode		= args.dbstoragemode if args is not None and 'dbstoragemode' in args else None
+		argsDBBackend			= args.dbbackend if args is not None and 'dbbackend' in args else None
 		argsImportDirectory		= args.importdirectory if args is not None and 'importdirectory' in args else None
+		argsDBRestoreFile		= args.dbrestorefile if args is not None and 'dbrestorefile' in args else None
 		argsAppsEnabled			= args.appsenabled if args is not None and 'appsenabled' in args else None
 		argsRemoteCSEEnabled	= args.remotecseenabled if args is not None and 'remotecseenabled' in args else None
 		argsValidationEnabled	= args.validationenabled if args is not None and 'validationenabled' in args else None
@@ -79,10 +82,23 @@ class Configuration(object):
 				#	Database
 				#
 
+				'db.backend'						: config.get('database', 'backend', 					fallback='tinydb'),
 				'db.path'							: config.get('database', 'path', 						fallback=C.defaultDataDirectory),
 				'db.inMemory'						: config.getboolean('database', 'inMemory', 			fallback=False),
+				'db.journal'						: config.getboolean('database', 'journal', 				fallback=False),
+				'db.codec'							: config.get('database', 'codec', 						fallback='json'),
+				'db.compression'					: config.get('database', 'compression', 				fallback='none'),
+				'db.fsync'							: config.getboolean('database', 'fsync', 				fallback=False),
+				'db.snapshotInterval'				: config.getint('database', 'snapshotInterval', 		fallback=300),
 				'db.cacheSize'						: config.getint('database', 'cacheSize', 				fallback=0),		# Default: no caching
+				'db.resourceCacheSize'				: config.getint('database', 'resourceCacheSize', 		fallback=1000),
+				'db.writeBehindInterval'			: config.getfloat('database', 'writeBehindInterval', 	fallback=0.0),		# Default: write-through
+				'db.writeBehindOperations'			: config.getint('database', 'writeBehindOperations', 	fallback=100),
 				'db.resetOnStartup' 				: config.getboolean('database', 'resetOnStartup',		fallback=False),
+				'db.backupInterval'					: config.getint('database', 'backupInterval', 			fallback=0),		# Default: no backups
+				'db.compactionInterval'				: config.getint('database', 'compactionInterval', 		fallback=0),
+				'db.compactionThreshold'			: config.getfloat('database', 'compactionThreshold', 	fallback=0.25),
+				'db.restoreFile'					: None,		# Only set from the command line
 
 				#
 				#	Logging
@@ -115,6 +131,8 @@ class Configuration(object):
 				'cse.enableTransitRequests'			: config.getboolean('cse', 'enableTransitRequests',		fallback=True),
 				'cse.enableValidation'				: config.getboolean('cse', 'enableValidation', 			fallback=True),
 				'cse.sortDiscoveredResources'		: config.getboolean('cse', 'sortDiscoveredResources',	fallback=True),
+				'cse.parallelDiscoveryThreshold'	: config.getint('cse', 'parallelDiscoveryThreshold',	fallback=0),		# Number of resources, 0 = disabled
+				'cse.parallelDiscoveryWorkers'		: config.getint('cse', 'parallelDiscoveryWorkers',		fallback=4),
 				'cse.checkExpirationsInterval'		: config.getint('cse', 'checkExpirationsInterval',		fallback=60),		# Seconds
 				'cse.flexBlockingPreference'		: config.get('cse', 'flexBlockingPreference',			fallback='blocking'),
 
@@ -273,10 +291,18 @@ class Configuration(object):
 		if argsDBReset is True:
 			Configuration._configuration['db.resetOnStartup'] = True
 
+		# Override DB backend from command line
+		if argsDBBackend is not None:
+			Configuration._configuration['db.backend'] = argsDBBackend
+
 		# Override DB storage mode from command line
 		if argsDBStorageMode is not None:
 			Configuration._configuration['db.inMemory'] = argsDBStorageMode == 'memory'
 
+		# Restore the DB from a backup file given on the command line
+		if argsDBRestoreFile is not None:
+			Configuration._configuration['db.restoreFile'] = argsDBRestoreFile
+
 		# Override import directory from command line
 		if argsImportDirectory is not None:
 			Configuration._configuration['cse.resourcesPath'] = argsImportDirectory
@@ -376,6 +402,49 @@ class Configuration(object):
 			console.print('[red]Configuration Error: [cse.resource.sub]:batchNotifyDuration must be > 0')
 			return False
 
+		# Check database backend
+		Configuration._configuration['db.backend'] = Configuration._configuration['db.backend'].lower()
+		if Configuration._configuration['db.backend'] not in ['tinydb', 'sqlite']:
+			console.print('[red]Configuration Error: [database]:backend must be "tinydb" or "sqlite"')
+			return False
+		Configuration._configuration['db.codec'] = Configuration._configuration['db.codec'].lower()
+		if Configuration._configuration['db.codec'] not in Codecs.formats:
+			console.print('[red]Configuration Error: [database]:codec must be "json", "msgpack" or "cbor"')
+			return False
+		if not Codecs.isAvailable(Configuration._configuration['db.codec']):
+			console.print('[red]Configuration Error: [database]:codec "%s" requires the package "%s"' % (Configuration._configuration['db.codec'], Codecs.packageFor(Configuration._configuration['db.codec'])))
+			return False
+		Configuration._configuration['db.compression'] = Configuration._configuration['db.compression'].lower()
+		if Configuration._configuration['db.compression'] not in Codecs.compressions:
+			console.print('[red]Configuration Error: [database]:compression must be "none" or "zlib"')
+			return False
+		if Configuration._configuration['db.snapshotInterval'] < 1:
+			console.print('[red]Configuration Error: [database]:snapshotInterval must be > 0')
+			return False
+		if Configuration._configuration['db.writeBehindInterval'] < 0.0:
+			console.print('[red]Configuration Error: [database]:writeBehindInterval must be >= 0')
+			return False
+		if Configuration._configuration['db.writeBehindOperations'] < 1:
+			console.print('[red]Configuration Error: [database]:writeBehindOperations must be > 0')
+			return False
+		if Configuration._configuration['db.backupInterval'] < 0:
+			console.print('[red]Configuration Error: [database]:backupInterval must be >= 0')
+			return False
+		if Configuration._configuration['db.compactionInterval'] < 0:
+			console.print('[red]Configuration Error: [database]:compactionInterval must be >= 0')
+			return False
+		if not 0.0 <= Configuration._configuration['db.compactionThreshold'] <= 1.0:
+			console.print('[red]Configuration Error: [database]:compactionThreshold must be between 0.0 and 1.0')
+			return False
+
+		# Check parallel discovery
+		if Configuration._configuration['cse.parallelDiscoveryThreshold'] < 0:
+			console.print('[red]Configuration Error: [cse]:parallelDiscoveryThreshold must be >= 0')
+			return False
+		if Configuration._configuration['cse.parallelDiscoveryWorkers'] < 1:
+			console.print('[red]Configuration Error: [cse]:parallelDiscoveryWorkers must be > 0')
+			return False
+
 		# Check flexBlocking value
 		Configuration._configuration['cse.flexBlockingPreference'] = Configuration._configuration['cse.flexBlockingPreference'].lower()
 		if Configuration._configuration['cse.flexBlockingPreference'] not in ['blocking', 'nonblocking']:
@@ -9,8 +9,10 @@
 
 import sys, traceback, re, json
 import isodate
+from itertools import islice
+from concurrent.futures import Future, ThreadPoolExecutor
 from flask import Request
-from typing import Any, List, Tuple, Union, Dict
+from typing import Any, Callable, List, Tuple, Union, Dict, Set, Iterator
 from Logging import Logging
 from Configuration import Configuration
 from Constants import Constants as C
@@ -21,6 +23,7 @@ from Types import ResponseType
 from Types import Permission
 from Types import Operation
 from Types import DesiredIdentifierResultType
+from Types import DiscoveryPlan
 from Types import ResultContentType as RCN
 from Types import ResponseCode as RC
 from Types import Result
@@ -32,16 +35,113 @@ import CSE, Utils
 from resources.Resource import Resource
 
 
+class DiscoveryFilter(object):
+	"""	The filter criteria of a discovery request, compiled once per request. Each 
+		criterion becomes a check of a single resource. The checks are ordered so that
+		cheap and selective checks come first. For AND the matching stops at the first
+		failed check, for OR at the first successful check.
+	"""
+
+	# Timestamp conditions: condition -> (attribute, is lower limit)
+	timestampConditions = {	'cra' : ('ct', True),  'crb' : ('ct', False),
+							'ms'  : ('lt', True),  'us'  : ('lt', False),
+							'exa' : ('et', True),  'exb' : ('et', False) }
+
+	# Conditions that are not supported: labelsQuery, childAttribute, parentAttribute.
+	# Discovery requests with them are rejected.
+	unsupportedConditions = [ 'lbq', 'catr', 'patr' ]
+
+	def __init__(self, fo:int, conditions:dict=None, attributes:dict=None) -> None:
+		self.fo = fo
+		self.checks:List[Callable[[Resource], bool]] = []
+		conditions = conditions if conditions is not None else {}
+
+		# Types. Multiple occurences of ty are always OR'ed
+		if (tys := conditions.get('ty')) is not None:
+			types = frozenset([ int(ty) for ty in tys if ty.isdigit() and str(int(ty)) == ty ])
+			self.checks.append(lambda r: r.json.get('ty') in types)
+
+		# ContentFormats of CIN. Multiple occurences of cty are always OR'ed
+		if (ctys := conditions.get('cty')) is not None:
+			contentFormats = frozenset(ctys)
+			self.checks.append(lambda r: r.json.get('ty') == T.CIN and r.json.get('cnf') in contentFormats)
+
+		# Content sizes of CIN and FCNT
+		if (sza := conditions.get('sza')) is not None:
+			sizeAbove = int(sza)
+			self.checks.append(lambda r: r.json.get('ty') in [ T.CIN, T.FCNT ] and (cs := r.json.get('cs')) is not None and cs >= sizeAbove)
+		if (szb := conditions.get('szb')) is not None:
+			sizeBelow = int(szb)
+			self.checks.append(lambda r: r.json.get('ty') in [ T.CIN, T.FCNT ] and (cs := r.json.get('cs')) is not None and cs < sizeBelow)
+
+		# Labels. Multiple occurences of lbl are always OR'ed
+		if (lbls := conditions.get('lbl')) is not None:
+			labels = frozenset(lbls)
+			self.checks.append(lambda r: (lbl := r.json.get('lbl')) is not None and not labels.isdisjoint(lbl))
+
+		# Timestamps. They are compared in their string representation
+		for name, (attribute, isLower) in self.timestampConditions.items():
+			if (value := conditions.get(name)) is not None:
+				self.checks.append(self._timestampCheck(attribute, value, isLower))
+
+		# StateTags, also compared as strings
+		if (sts := conditions.get('sts')) is not None:
+			self.checks.append(lambda r: (st := r.json.get('st')) is not None and str(st) > sts)
+		if (stb := conditions.get('stb')) is not None:
+			self.checks.append(lambda r: (st := r.json.get('st')) is not None and str(st) < stb)
+
+		# Attributes. Exact values first, because wildcards are matched by regular expressions
+		if attributes is not None:
+			for name, value in sorted(attributes.items(), key=lambda item: '*' in item[1]):
+				self.checks.append(self._attributeCheck(name, value))
+
+
+	def match(self, r:Resource) -> bool:
+		""" Match the filter to a resource. """
+		if self.fo == FilterOperation.AND:		# all checks must match
+			for check in self.checks:
+				if not check(r):
+					return False
+			return True
+		if self.fo == FilterOperation.OR:		# any check must match
+			for check in self.checks:
+				if check(r):
+					return True
+		return False
+
+
+	def _timestampCheck(self, attribute:str, value:str, isLower:bool) -> Callable[[Resource], bool]:
+		if isLower:
+			return lambda r: (ts := r.json.get(attribute)) is not None and ts > value
+		return lambda r: (ts := r.json.get(attribute)) is not None and ts < value
+
+
+	def _attributeCheck(self, name:str, value:str) -> Callable[[Resource], bool]:
+		if '*' in value:
+			pattern = re.compile(value.replace('*', '.*'))
+			return lambda r: (rval := r[name]) is not None and pattern.match(str(rval)) is not None
+		value = str(value)
+		return lambda r: (rval := r[name]) is not None and str(rval) == value
+
+
 class Dispatcher(object):
 
 	def __init__(self) -> None:
 		self.csi 				= Configuration.get('cse.csi')
 		self.csiSlash 			= '%s/' % self.csi
 		self.csiSlashLen 		= len(self.csiSlash)
+		self.parallelDiscoveryThreshold = Configuration.get('cse.parallelDiscoveryThreshold')
+
+		# Worker threads for parallel discovery, if enabled
+		self.discoveryPool:ThreadPoolExecutor = None
+		if self.parallelDiscoveryThreshold > 0:
+			self.discoveryPool = ThreadPoolExecutor(max_workers=Configuration.get('cse.parallelDiscoveryWorkers'), thread_name_prefix='discovery')
 		Logging.log('Dispatcher initialized')
 
 
 	def shutdown(self) -> bool:
+		if self.discoveryPool is not None:
+			self.discoveryPool.shutdown(wait=False)
 		Logging.log('Dispatcher shut down')
 		return True
 
@@ -113,11 +213,8 @@ class Dispatcher(object):
 		if (res := self.discoverResources(id, originator, request.args.handling, request.args.fo, request.args.conditions, request.args.attributes, permission=permission)).lst is None:	# not found?
 			return res.errorResult()
 
-		# check and filter by ACP. After this allowedResources only contains the resources that are allowed
-		allowedResources = []
-		for r in res.lst:
-			if CSE.security.hasAccess(originator, r, permission):
-				allowedResources.append(r)
+		# The discovered resources are already checked and filtered by ACP
+		allowedResources = res.lst
 
 		#
 		#	Handle more sophisticated RCN
@@ -196,35 +293,29 @@ class Dispatcher(object):
 				return Result(rsc=RC.notFound, dbg=res.dbg)
 			rootResource = res.resource
 
-		# get all direct children
-		dcrs = self.directChildResources(id)
-
-		# Slice the page (offset and limit)
+		# Offset and limit of the page of discovered resources
 		offset = handling['ofst'] if 'ofst' in handling else 1			# default: 1 (first resource
-		limit = handling['lim'] if 'lim' in handling else sys.maxsize	# default: system max size or "maxint"
-		dcrs = dcrs[offset-1:offset-1+limit]							# now dcrs only contains the desired child resources for ofst and lim
+		limit = handling['lim'] if 'lim' in handling else None			# default: no limit
 
 		# Get level
 		level = handling['lvl'] if 'lvl' in handling else sys.maxsize	# default: system max size or "maxint"
 
-		# a bit of optimization. This length stays the same.
-		allLen = len(attributes) if attributes is not None else 0
-		if conditions is not None:
-			allLen += ( len(conditions) +
-			  (len(conditions.get('ty'))-1 if 'ty' in conditions else 0) +		# -1 : compensate for len(conditions) in line 1
-			  (len(conditions.get('cty'))-1 if 'cty' in conditions else 0) +		# -1 : compensate for len(conditions) in line 1 
-			  (len(conditions.get('lbl'))-1 if 'lbl' in conditions else 0) 		# -1 : compensate for len(conditions) in line 1 
-			)
-
-		# allLen = ((len(conditions) if conditions is not None else 0) +
-		#   (len(attributes) if attributes is not None else 0) +
-		#   (len(conditions.get('ty'))-1 if conditions is not None and 'ty' in conditions else 0) +		# -1 : compensate for len(conditions) in line 1
-		#   (len(conditions.get('cty'))-1 if conditions is not None else 0) +		# -1 : compensate for len(conditions) in line 1 
-		#   (len(conditions.get('lbl'))-1 if conditions is not None else 0) 		# -1 : compensate for len(conditions) in line 1 
-		# )
-
-		# Discover the resources
-		discoveredResources = self._discoverResources(rootResource, originator, level, fo, allLen, dcrs=dcrs, conditions=conditions, attributes=attributes, permission=permission)
+		# Compile the filter criteria once for all resources
+		if len(unsupported := [ name for name in DiscoveryFilter.unsupportedConditions if name in (conditions or {}) ]) > 0:
+			return Result(rsc=RC.notImplemented, dbg='unsupported filter criteria: %s' % ', '.join(unsupported))
+		discoveryFilter = DiscoveryFilter(fo, conditions, attributes)
+
+		# Plan the discovery and discover the resources. Only as many resources are 
+		# checked as are needed for the requested page.
+		plan = self._planDiscovery(rootResource.ri, fo, conditions, attributes, limit)
+		Logging.logDebug('Discovery plan: %s' % plan)
+		if plan.strategy == 'index':
+			resources = self._discoverCandidates(rootResource, originator, level, discoveryFilter, plan.candidates, permission=permission)
+		elif plan.strategy == 'parallel':
+			resources = self._discoverResourcesParallel(rootResource, originator, level, discoveryFilter, permission=permission)
+		else:
+			resources = self._discoverResources(rootResource, originator, level, discoveryFilter, permission=permission)
+		discoveredResources = list(islice(resources, offset-1, offset-1+limit if limit is not None else None))
 
 		# NOTE: this list contains all results in the order they could be found while
 		#		walking the resource tree.
@@ -245,18 +336,16 @@ class Dispatcher(object):
 		return Result(lst=discoveredResources)
 
 
-	def _discoverResources(self, rootResource:Resource, originator:str, level:int, fo:int, allLen:int, dcrs:list=None, conditions:dict=None, attributes:dict=None, permission:Permission=Permission.DISCOVERY) -> List[Resource]:
+	def _discoverResources(self, rootResource:Resource, originator:str, level:int, discoveryFilter:DiscoveryFilter, permission:Permission=Permission.DISCOVERY) -> Iterator[Resource]:
+		"""	Walk the resource tree below *rootResource* depth-first and yield the resources 
+			that match the filter and that the originator has access to. The tree is walked
+			only as far as the caller iterates.
+		"""
 		if rootResource is None or level == 0:		# no resource or level == 0
-			return []
-
-		# get all direct children, if not provided
-		if dcrs is None:
-			if len(dcrs := self.directChildResources(rootResource.ri)) == 0:
-				return []
+			return
 
-		# Filter and add those left to the result
-		discoveredResources = []
-		for r in dcrs:
+		# get all direct children
+		for r in CSE.storage.iterDirectChildResources(rootResource.ri):
 
 			# Exclude virtual resources
 			if Utils.isVirtualResource(r):
@@ -264,116 +353,137 @@ class Dispatcher(object):
 
 			# check permissions and filter. Only then add a resource
 			# First match then access. bc if no match then we don't need to check permissions (with all the overhead)
-			if self._matchResource(r, conditions, attributes, fo, allLen) and CSE.security.hasAccess(originator, r, permission):
-				discoveredResources.append(r)
+			if discoveryFilter.match(r) and CSE.security.hasAccess(originator, r, permission):
+				yield r
 
 			# Iterate recursively over all (not only the filtered) direct child resources
-			discoveredResources.extend(self._discoverResources(r, originator, level-1, fo, allLen, conditions=conditions, attributes=attributes))
+			yield from self._discoverResources(r, originator, level-1, discoveryFilter, permission=permission)
 
-		return discoveredResources
 
+	def _discoverResourcesParallel(self, rootResource:Resource, originator:str, level:int, discoveryFilter:DiscoveryFilter, permission:Permission=Permission.DISCOVERY) -> Iterator[Resource]:
+		"""	Yield the same resources as _discoverResources(), in the same order. But the 
+			subtrees below the direct child resources of *rootResource* that contain at
+			least *cse.parallelDiscoveryThreshold* resources are discovered concurrently
+			by the discovery workers, while the smaller subtrees are walked here.
+		"""
+		if rootResource is None or level == 0:		# no resource or level == 0
+			return
+		children = [ r for r in CSE.storage.iterDirectChildResources(rootResource.ri) if not Utils.isVirtualResource(r) ]
+
+		# Start the discovery of the large subtrees first
+		subtrees:Dict[str, Future] = {}
+		if level > 1:
+			for r in children:
+				if CSE.storage.countDescendantResources(r.ri) >= self.parallelDiscoveryThreshold:
+					subtrees[r.ri] = self.discoveryPool.submit(list, self._discoverResources(r, originator, level-1, discoveryFilter, permission=permission))
+
+		# Merge the results in the order of the tree walk
+		for r in children:
+			if discoveryFilter.match(r) and CSE.security.hasAccess(originator, r, permission):
+				yield r
+			if (subtree := subtrees.get(r.ri)) is not None:
+				yield from subtree.result()
+			else:
+				yield from self._discoverResources(r, originator, level-1, discoveryFilter, permission=permission)
 
-	def _matchResource(self, r : Resource, conditions : dict, attributes : dict, fo : int, allLen : int) -> bool:	
-		""" Match a filter to a resource. """
 
-		# TODO: Implement a couple of optimizations. Can we determine earlier that a match will fail?
+	def _discoverCandidates(self, rootResource:Resource, originator:str, level:int, discoveryFilter:DiscoveryFilter, candidates:Set[str], permission:Permission=Permission.DISCOVERY) -> Iterator[Resource]:
+		"""	Yield the candidates below *rootResource* that match the filter and that the
+			originator has access to, in the same order as _discoverResources() would.
+			Only the candidates are retrieved, the resource tree is not walked.
+		"""
+		rootSrn = '%s/' % rootResource[Resource._srn]
+		for ri in self._orderCandidates(rootResource.ri, candidates, level):
+			if (r := CSE.storage.retrieveResource(ri=ri).resource) is None:		# removed in the meantime
+				continue
+			if Utils.isVirtualResource(r) or not r[Resource._srn].startswith(rootSrn):
+				continue
+			if discoveryFilter.match(r) and CSE.security.hasAccess(originator, r, permission):
+				yield r
 
-		ty = r.ty
 
-		# get the parent resource
-		#
-		#	TODO when determines how the parentAttribute is actually encoded
-		#
-		# pr = None
-		# if (pi := r.get('pi')) is not None:
-		# 	pr = storage.retrieveResource(ri=pi)
-
-		# The matching works like this: go through all the conditions, compare them, and
-		# increment 'found' when matching. For fo=AND found must equal all conditions.
-		# For fo=OR found must be > 0.
-		found = 0
-
-		# check conditions
-		if conditions is not None:
-
-			# Types
-			# Multiple occurences of ty is always OR'ed. Therefore we add the count of
-			# ty's to found (to indicate that the whole set matches)
-			if (tys := conditions.get('ty')) is not None:
-				found += len(tys) if str(ty) in tys else 0
-			if (ct := r.ct) is not None:
-				found += 1 if (c_crb := conditions.get('crb')) is not None and (ct < c_crb) else 0
-				found += 1 if (c_cra := conditions.get('cra')) is not None and (ct > c_cra) else 0
-
-			if (lt := r.lt) is not None:
-				found += 1 if (c_ms := conditions.get('ms')) is not None and (lt > c_ms) else 0
-				found += 1 if (c_us := conditions.get('us')) is not None and (lt < c_us) else 0
-
-			if (st := r.st) is not None:
-				found += 1 if (c_sts := conditions.get('sts')) is not None and (str(st) > c_sts) else 0
-				found += 1 if (c_stb := conditions.get('stb')) is not None and (str(st) < c_stb) else 0
-
-			if (et := r.et) is not None:
-				found += 1 if (c_exb := conditions.get('exb')) is not None and (et < c_exb) else 0
-				found += 1 if (c_exa := conditions.get('exa')) is not None and (et > c_exa) else 0
-
-			# Check labels similar to types
-			rlbl = r.lbl
-			if rlbl is not None and (lbls := conditions.get('lbl')) is not None:
-				for l in lbls:
-					if l in rlbl:
-						found += len(lbls)
-						break
-			# special handling of label-list
-			# if (lbl := r.lbl) is not None and (c_lbl := conditions.get('lbl')) is not None:
-			# 	lbla = c_lbl.split()
-			# 	fnd = 0
-			# 	for l in lbla:
-			# 		fnd += 1 if l in lbl else 0
-			# 	found += 1 if (fo == 1 and fnd == len(lbl)) or (fo == 2 and fnd > 0) else 0	# fo==or -> find any label
-				#	# TODO labelsQuery
-
-
-			if ty in [ T.CIN, T.FCNT ]:	# special handling for CIN, FCNT
-				if (cs := r.cs) is not None:
-					found += 1 if (sza := conditions.get('sza')) is not None and (int(cs) >= int(sza)) else 0
-					found += 1 if (szb := conditions.get('szb')) is not None and (int(cs) < int(szb)) else 0
-
-			# ContentFormats
-			# Multiple occurences of cnf is always OR'ed. Therefore we add the count of
-			# cnf's to found (to indicate that the whole set matches)
-			# Similar to types.
-			if ty in [ T.CIN ]:	# special handling for CIN
-				if (cnfs := conditions.get('cty')) is not None:
-					found += len(cnfs) if r.cnf in cnfs else 0
-
-			# TODO childLabels
-			# TODO parentLabels
-			# TODO childResourceType
-			# TODO parentResourceType
-
-
-			# Attributes:
-			if attributes is not None:
-				for name in attributes:
-					val = attributes[name]
-					if '*' in val:
-						val = val.replace('*', '.*')
-						found += 1 if (rval := r[name]) is not None and re.match(val, str(rval)) else 0
-					else:
-						found += 1 if (rval := r[name]) is not None and str(val) == str(rval) else 0
-
-			# TODO childAttribute
-			# TODO parentAttribute
-
-
-		# Test whether the OR or AND criteria is fullfilled
-		if not ((fo == FilterOperation.OR  and found > 0) or 		# OR and found something
-				(fo == FilterOperation.AND and allLen == found)		# AND and found everything
-			   ): 
-			return False
+	def _orderCandidates(self, rootRI:str, candidates:Set[str], level:int) -> List[str]:
+		"""	Return the resourceIDs of the candidates that are at most *level* levels below 
+			*rootRI*, ordered like a depth-first walk of the resource tree. Child resources
+			are walked in the order of their creation. Only the in-memory indexes are used.
+		"""
+		paths:Dict[str, Tuple[Tuple[str, str], ...]] = { rootRI : () }	# ri -> ((ct, ri) of each ancestor below rootRI and of the resource)
+		outside:Set[str] = set()											# resources that are not below rootRI
+		result = []
+		for ri in candidates:
+			ancestors = []
+			pi = ri
+			while pi is not None and pi not in paths and pi not in outside:
+				ancestors.append(pi)
+				pi = CSE.storage.parentResourceID(pi)
+			if pi is None or pi in outside:
+				outside.update(ancestors)
+				continue
+			path = paths[pi]
+			for ancestor in reversed(ancestors):
+				path = path + ((CSE.storage.creationTime(ancestor) or '', ancestor), )
+				paths[ancestor] = path
+			if 0 < len(paths[ri]) <= level:
+				result.append(ri)
+		result.sort(key=paths.__getitem__)
+		return result
 
-		return True
+
+	def _planDiscovery(self, rootRI:str, fo:int, conditions:dict, attributes:dict, limit:int=None) -> DiscoveryPlan:
+		"""	Choose how to discover the resources below *rootRI* for a filter. When the 
+			indexes resolve a selective condition, and there are fewer candidates than
+			resources below *rootRI*, then only the candidates are checked. Otherwise the
+			resource tree is walked. Without a *limit* the whole tree must be walked, so
+			large subtrees are walked in parallel, if enabled.
+		"""
+		if (candidates := self._indexedCandidates(fo, conditions, attributes)) is not None:
+			# The candidates are collected from the whole resource tree. For a small subtree
+			# walking it is cheaper than retrieving and ordering all the candidates.
+			if len(candidates) < CSE.storage.countDescendantResources(rootRI):
+				return DiscoveryPlan(strategy='index', candidates=candidates)
+		if limit is None and self.discoveryPool is not None:
+			return DiscoveryPlan(strategy='parallel')
+		return DiscoveryPlan(strategy='walk')
+
+
+	def _indexedCandidates(self, fo:int, conditions:dict, attributes:dict) -> Set[str]:
+		"""	Return the resourceIDs of all resources that may match the filter conditions.
+			The set is determined from the storage indexes for ty, lbl and the timestamp
+			conditions. It contains all matching resources, but the filter must still be 
+			applied to each. Return None if the indexes cannot be used for the conditions.
+		"""
+		sets:List[Set[str]] = []
+		unindexed = 0
+		for name, value in (attributes or {}).items():
+			if '*' in value:		# wildcards must be matched against each resource
+				unindexed += 1
+			elif name == 'ri':
+				sets.append({ value })
+			elif name == 'ty' and value.isdigit():
+				sets.append(CSE.storage.resourceIDsForTypes([ int(value) ]))
+			else:
+				unindexed += 1
+		for name, value in (conditions or {}).items():
+			if name == 'ty':
+				sets.append(CSE.storage.resourceIDsForTypes([ int(ty) for ty in value if ty.isdigit() ]))
+			elif name == 'lbl':
+				sets.append(CSE.storage.resourceIDsForLabels(value))
+			elif name in DiscoveryFilter.timestampConditions:
+				attribute, isLower = DiscoveryFilter.timestampConditions[name]
+				sets.append(CSE.storage.resourceIDsForTimeRange(attribute, after=value if isLower else None, before=None if isLower else value))
+			else:
+				unindexed += 1
+		if len(sets) == 0:
+			return None
+
+		# For AND all conditions must match, so any indexed condition restricts the candidates.
+		# For OR each condition may match, so all of them must be resolved by an index.
+		if fo == FilterOperation.AND:
+			sets.sort(key=len)
+			return sets[0].intersection(*sets[1:])
+		if fo == FilterOperation.OR and unindexed == 0:
+			return set().union(*sets)
+		return None
 
 
 	#########################################################################
@@ -486,25 +596,38 @@ class Dispatcher(object):
 		if resource.__srn__ is None:
 			resource[resource._srn] = Utils.structuredPath(resource)
 
-		# add the resource to storage
-		if (res := resource.dbCreate(overwrite=False)).rsc != RC.created:
-			return res
+		# Add, activate and update the resource, update the parent resource and notify it
+		# in a single transaction. The changes are committed together, and they are rolled
+		# back together when an exception is raised. A resource that is not created 
+		# successfully is removed again, so that the transaction of a caller can continue.
+		with CSE.storage.transaction():
 
-		# Activate the resource
-		# This is done *after* writing it to the DB, because in activate the resource might create or access other
-		# resources that will try to read the resource from the DB.
-		if not (res := resource.activate(parentResource, originator)).status: 	# activate the new resource
-			resource.dbDelete()
-			return res.errorResult()
+			# add the resource to storage
+			if (res := resource.dbCreate(overwrite=False)).rsc != RC.created:
+				return res
 
-		# Could be that we changed the resource in the activate, therefore write it again
-		if (res := resource.dbUpdate()).resource is None:
-			resource.dbDelete()
-			return res
+			# Activate the resource
+			# This is done *after* writing it to the DB, because in activate the resource might create or access other
+			# resources that will try to read the resource from the DB.
+			if not (res := resource.activate(parentResource, originator)).status: 	# activate the new resource
+				resource.dbDelete()
+				return res.errorResult()
 
-		if parentResource is not None:
-			parentResource = parentResource.dbReload().resource		# Read the resource again in case it was updated in the DB
-			parentResource.childAdded(resource, originator)			# notify the parent resource
+			# Could be that we changed the resource in the activate, therefore write it again
+			if (res := resource.dbUpdate()).resource is None:
+				resource.dbDelete()
+				return res
+
+			if parentResource is not None:
+				parentResource = parentResource.dbReload().resource		# Read the resource again in case it was updated in the DB
+				if parentResource.st is not None:						# increment parent resource's state tag
+					parentResource['st'] = parentResource.st + 1
+					if (res := parentResource.dbUpdate()).resource is None:
+						resource.dbDelete()
+						return Result(rsc=res.rsc, dbg=res.dbg)
+
+				# Notify the parent resource. This may send notifications.
+				parentResource.childAdded(resource, originator)
 
 		# send a create event
 		CSE.event.createResource(resource)	# type: ignore
@@ -679,16 +802,19 @@ class Dispatcher(object):
 			if not (res := CSE.registration.checkResourceDeletion(resource)).status:
 				return Result(rsc=RC.badRequest, dbg=res.dbg)
 
-		resource.deactivate(originator)	# deactivate it first
-		# notify the parent resource
-		parentResource = resource.retrieveParentResource()
-		res = resource.dbDelete()
+		# Remove the resource together with its child resources in a single transaction,
+		# and notify the parent resource
+		with CSE.storage.transaction():
+			resource.deactivate(originator)	# deactivate it first
+			# notify the parent resource
+			parentResource = resource.retrieveParentResource()
+			res = resource.dbDelete()
 
-		# send a delete event
-		CSE.event.deleteResource(resource) 	# type: ignore
+			# send a delete event
+			CSE.event.deleteResource(resource) 	# type: ignore
 
-		if parentResource is not None:
-			parentResource.childRemoved(resource, originator)
+			if parentResource is not None:
+				parentResource.childRemoved(resource, originator)
 		return Result(resource=resource, rsc=res.rsc, dbg=res.dbg)
 
 
@@ -724,7 +850,7 @@ class Dispatcher(object):
 		result = []
 		rss = CSE.storage.retrieveResourcesByType(ty)
 		for rs in (rss or []):
-			result.append(Utils.resourceFromJSON(rs).resource)
+			result.append(Utils.resourceFromDocument(rs).resource)
 		return result
 
 
@@ -743,41 +869,59 @@ class Dispatcher(object):
 		return { 'm2m:uril' : lst }
 
 
-	# Recursively walk the results and build a sub-resource tree for each resource type
 	def _resourceTreeJSON(self, resources:List[Resource], targetResource:Union[Resource, dict]) -> List[Resource]:
-		rri = targetResource['ri'] if 'ri' in targetResource else None
-		while True:		# go multiple times per level through the resources until the list is empty
-			result = []
-			handledTy = None
-			idx = 0
-			while idx < len(resources):
-				r = resources[idx]
+		"""	Build a sub-resource tree for each resource type from the discovered resources
+			and add it to *targetResource*. If *targetResource* has a resourceID then only
+			its child resources are added. Otherwise the resources are added type by type,
+			in the order of their first occurence, with all their descendants. Virtual 
+			resources are skipped. Return the resources that were not added.
+
+			The resources are grouped by their parents in a single pass, so that the tree
+			is built in linear time.
+		"""
+		children:Dict[str, List[int]] = {}		# pi -> indexes of the child resources, in the order of the list
+		types:Dict[int, List[int]] = {}			# ty -> indexes of the resources, in the order of the list
+		for idx, r in enumerate(resources):
+			if r.ty in C.virtualResources:		# Skip latest, oldest etc virtual resources
+				continue
+			children.setdefault(r.pi, []).append(idx)
+			types.setdefault(r.ty, []).append(idx)
+		added = [ False ] * len(resources)
 
-				if rri is not None and r.pi != rri:	# only direct children
-					idx += 1
-					continue
-				if r.ty in C.virtualResources:	# Skip latest, oldest etc virtual resources
+		if 'ri' in targetResource:		# only direct children
+			self._addResourceTree(resources, children.get(targetResource['ri'], []), targetResource, children, added)
+		else:
+			idx = 0
+			while True:
+				# The type of the first resource that was not added yet is handled next
+				while idx < len(resources) and (added[idx] or resources[idx].ty in C.virtualResources):
 					idx += 1
-					continue
-				if handledTy is None:
-					handledTy = r.ty					# this round we check this type
-				if r.ty == handledTy:					# handle only resources of the currently handled type
-					result.append(r)					# append the found resource 
-					resources.remove(r)						# remove resource from the original list (greedy), but don't increment the idx
-					resources = self._resourceTreeJSON(resources, r)	# check recursively whether this resource has children
-				else:
-					idx += 1							# next resource
-
-			# add all found resources under the same type tag to the rootResource
-			if len(result) > 0:
-				# sort resources by type and then by lowercase rn
-				if Configuration.get('cse.sortDiscoveredResources'):
-					result.sort(key=lambda x:(x.ty, x.rn.lower()))
-				targetResource[result[0].tpe] = [r.asJSON(embedded=False) for r in result]
-				# TODO not all child resources are lists [...] Handle just to-1 relations
-			else:
-				break # end of list, leave while loop
-		return resources # Return the remaining list
+				if idx == len(resources):
+					break
+				self._addResourceTree(resources, types[resources[idx].ty], targetResource, children, added)
+		return [ r for idx, r in enumerate(resources) if not added[idx] ]
+
+
+	def _addResourceTree(self, resources:List[Resource], indexes:List[int], targetResource:Union[Resource, dict], children:Dict[str, List[int]], added:List[bool]) -> None:
+		"""	Add the resources at *indexes* that were not added yet to *targetResource*,
+			together with their descendants, under the same type tag per resource type.
+		"""
+		results:Dict[int, List[Resource]] = {}	# ty -> resources, in the order of the first occurence of each type
+		for idx in indexes:
+			if added[idx]:
+				continue
+			added[idx] = True
+			r = resources[idx]
+			results.setdefault(r.ty, []).append(r)
+			self._addResourceTree(resources, children.get(r.ri, []), r, children, added)	# add the resource's children first
+
+		# add all found resources under the same type tag to the target resource
+		for result in results.values():
+			# sort resources by type and then by lowercase rn
+			if Configuration.get('cse.sortDiscoveredResources'):
+				result.sort(key=lambda x:(x.ty, x.rn.lower()))
+			targetResource[result[0].tpe] = [r.asJSON(embedded=False) for r in result]
+			# TODO not all child resources are lists [...] Handle just to-1 relations
 
 
 	def _resourceTreeReferences(self, resources:List[Resource], targetResource:Union[Resource, dict], drt: int) -> Union[Resource, dict]:
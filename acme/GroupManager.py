@@ -230,7 +230,7 @@ class GroupManager(object):
 		of group. If yes, remove the member. This method is called by the event manager. """
 
 		ri = deletedResource.ri
-		groups = CSE.storage.searchByTypeFieldValue(T.GRP, 'mid', ri)
+		groups = CSE.storage.searchGroupsForMember(ri)
 		for group in groups:
 			group['mid'].remove(ri)
 			group['cnm'] = group.cnm - 1
@@ -96,14 +96,13 @@ class NotificationManager(object):
 		if Utils.isVirtualResource(resource):
 			return 
 
-		Logging.logDebug('Checking subscriptions for notifications')
 		ri = resource.ri
 
 		# ATTN: The "subscription" returned here are NOT the <sub> resources,
 		# but an internal representation from the 'subscription' DB !!!
 		# Access to attributes is different bc the structure is flattened
 		subs = CSE.storage.getSubscriptionsForParent(ri)
-		if subs is None or len(subs) == 0:
+		if subs is None or len(subs) == 0:	# the common case. Don't do anything else
 			return
 
 		Logging.logDebug('Checking subscription for: %s, reason: %d' % (ri, reason))
@@ -260,7 +260,7 @@ class RequestManager(object):
 
 		if (nus := request.headers.responseTypeNUs) is None:
 			# RTU is not set, get POA's from the resp. AE.poa
-			aes = CSE.storage.searchByTypeFieldValue(ty=T.AE, field='aei', value=originator)
+			aes = CSE.storage.searchByTypeFieldValue(ty=T.AE, field='aei', value=originator, limit=2)	# more than one is an error anyway
 			if len(aes) != 1:
 				Logging.logWarn('Wrong number of AEs with aei: %s (%d): %s' % (originator, len(aes), str(aes)))
 				nus = aes[0].poa
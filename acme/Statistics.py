@@ -29,6 +29,10 @@ logWarnings			= 'lgWrn'
 cseStartUpTime		= 'cseSU'
 cseUpTime			= 'cseUT'
 resourceCount		= 'ctRes'
+resourceTypeCounts	= 'ctTyp'
+resourceCacheHits	= 'rcHit'
+resourceCacheMisses	= 'rcMis'
+dbReclaimedBytes	= 'dbRcl'
 
 # TODO startup, uptime, restartcount, errors, warnings
 
@@ -105,7 +109,11 @@ class Statistics(object):
 		# Calculate some stats
 		s[cseUpTime] = str(datetime.timedelta(seconds=int(datetime.datetime.utcnow().timestamp() - s[cseStartUpTime])))
 		s[cseStartUpTime] = Utils.toISO8601Date(s[cseStartUpTime])
-		s[resourceCount] = s[createdResources] - s[deletedResources]
+		s[resourceCount] = CSE.storage.countResources()
+		s[resourceTypeCounts] = { str(ty) : count for ty, count in sorted(CSE.storage.countResourcesByType().items()) }
+		s[resourceCacheHits] = CSE.storage.resourceCache.hits
+		s[resourceCacheMisses] = CSE.storage.resourceCache.misses
+		s[dbReclaimedBytes] = CSE.storage.reclaimedBytes
 		return s
 
 
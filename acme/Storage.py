@@ -4,25 +4,36 @@
 #	(c) 2020 by Andreas Kraft
 #	License: BSD 3-Clause License. See the LICENSE file for further details.
 #
-#	Store, retrieve and manage resources in the database. It currently relies on
-#	the document database TinyDB. It is possible to store resources either on disc
+#	Store, retrieve and manage resources in the database. The actual database
+#	is accessed through a binding. Currently supported are the document database
+#	TinyDB (default) and SQLite. It is possible to store resources either on disc
 #	or just in memory.
 #
 
 from tinydb import TinyDB, Query, where 		# type: ignore
-from tinydb.storages import MemoryStorage		# type: ignore
+from tinydb.storages import MemoryStorage				# type: ignore
+from tinydb.middlewares import CachingMiddleware	# type: ignore
 from tinydb.operations import delete 			# type: ignore
+from tinydb.table import Table, Document		# type: ignore
 # TODO remove mypy type checking supressions above as soon as tinydb provides typing stubs
 # from tinydb_smartcache import SmartCacheTable # TODO Not compatible with TinyDB 4 yet
 
-import os, json, re, time
-from typing import List, Callable, Any
-from threading import Lock
+import os, sys, copy, glob, json, re, time, sqlite3
+from contextlib import contextmanager, ExitStack
+from typing import List, Callable, Any, Dict, Set, Tuple, Iterator, Union
+from threading import Lock, RLock
 from Configuration import Configuration
 from Constants import Constants as C
 from Types import ResourceTypes as T, Result, ResponseCode as RC
 from Logging import Logging
 from resources.Resource import Resource
+from helpers.BackgroundWorker import BackgroundWorkerPool
+from helpers.Codecs import Codec, CodecStorage, migrate, codecForFile
+from helpers.Journal import Journal, JournaledTable
+from helpers.UndoLog import UndoLog, UndoTable
+from helpers.Indexes import SortedIndex, ReverseIndex, SeriesIndex, TreeIndex
+from helpers.LRUCache import LRUCache
+from helpers.ReadWriteLock import ReadWriteLock, ReadRWLock, WriteRWLock
 import CSE, Utils
 
 
@@ -41,23 +52,226 @@ class Storage(object):
 				Logging.logErr('db.path not set')
 				raise RuntimeError('db.path not set')
 
-		
-		self.db = TinyDBBinding(path)
-		self.db.openDB('-%s' % Utils.getCSETypeAsString()) # add CSE type as postfix
+
+		# create the database binding
+		self.db:StorageBinding = None
+		if (backend := Configuration.get('db.backend')) == 'sqlite':
+			self.db = SQLiteBinding(path)
+		else:
+			self.db = TinyDBBinding(path)
+		Logging.log('Using database backend: %s' % backend)
+		postfix = '-%s' % Utils.getCSETypeAsString()	# add CSE type as postfix
+		self.db.openDB(postfix)
+		self.backupFile = '%s/backup%s' % (Configuration.get('db.path'), postfix)	# without extension
+
+		# Only one thread at a time may change the resources, their indexes and the 
+		# subscriptions. A transaction holds the lock until it ends. The other tables,
+		# e.g. the batch notifications and the statistics, are not part of transactions
+		# and are only protected by the locks of the binding, so writing them doesn't 
+		# wait for open transactions.
+		self.lockResources = RLock()
+		self.transactions = 0				# Number of open (nested) transactions
+		self.transactionFailed = False		# An exception was raised in the open transaction
+		self.transactionResources:Set[str] = set()		# resourceIDs of the resources changed by the open transaction
+		self.transactionSubscriptions:Set[str] = set()	# resourceIDs of the subscriptions changed by the open transaction
 
 		# Reset dbs?
 		if Configuration.get('db.resetOnStartup') is True:
 			self.db.purgeDB()
 
+		# Restore the databases from a backup. This replaces all data
+		if (restoreFile := Configuration.get('db.restoreFile')) is not None:
+			self.restore(restoreFile)
+
+		# Cache for recently retrieved resource objects
+		self.resourceCache = LRUCache(Configuration.get('db.resourceCacheSize'))
+
+		# Build the in-memory indexes that are independent from the binding
+		self.parentIndex = TreeIndex()		# ri -> pi, and number of children and descendants per pi
+		self.tyIndex = ReverseIndex()		# ty -> ri, and number of resources per ty
+		self.lblIndex = ReverseIndex()		# lbl -> ri
+		self.ctIndex = SortedIndex()		# ri -> ct
+		self.ltIndex = SortedIndex()		# ri -> lt
+		self.etIndex = SortedIndex()		# ri -> et
+		self.acpiIndex = ReverseIndex()		# acpi -> ri
+		self.midIndex = ReverseIndex()		# mid -> ri of <group> resources
+		self.cinIndex = SeriesIndex()		# ri of <container> -> ri of <contentInstance> resources ordered by ct
+		self._buildIndexes()
+
+		# The subscriptions are checked for every change of a resource. Keep them in memory, 
+		# grouped by the resources they subscribe to.
+		self.subscriptionsByParent:Dict[str, Dict[str, dict]] = {}	# pi -> ri -> subscription
+		self.subscriptionParents:Dict[str, str] = {}				# ri -> pi of subscriptions
+		self.lockSubscriptionCache = Lock()
+		self._buildSubscriptionCache()
+
+		# Start the worker that regularly flushes the write-behind buffers
+		if (interval := Configuration.get('db.writeBehindInterval')) > 0:
+			Logging.log('Using write-behind with flush interval: %f s' % interval)
+			BackgroundWorkerPool.newWorker(interval, self.flushDBWorker, 'dbFlushWorker').start()
+
+		# Start the worker that regularly writes a backup
+		if (interval := Configuration.get('db.backupInterval')) > 0:
+			Logging.log('Writing database backups every %d s to: %s' % (interval, self.backupFile))
+			BackgroundWorkerPool.newWorker(interval, self.backupWorker, 'dbBackupWorker', startWithDelay=True).start()
+
+		# Start the worker that compacts the databases when the CSE is idle
+		self.lastChange = 0.0					# Time of the last change of a resource
+		self.lastCompaction = time.time()
+		self.reclaimedBytes = 0					# Bytes reclaimed by compactions since the start
+		if Configuration.get('db.compactionInterval') > 0:
+			BackgroundWorkerPool.newWorker(self.compactionIdleTime, self.compactionWorker, 'dbCompactionWorker', startWithDelay=True).start()
+
 		Logging.log('Storage initialized')
 
 
 	def shutdown(self) -> bool:
-		self.db.closeDB()
+		BackgroundWorkerPool.stopWorkers('dbCompactionWorker')
+		BackgroundWorkerPool.stopWorkers('dbBackupWorker')
+		BackgroundWorkerPool.stopWorkers('dbFlushWorker')
+		self.db.closeDB()	# This also drains the write-behind buffers
 		Logging.log('Storage shut down')
 		return True
 
 
+	def flushDBWorker(self) -> bool:
+		self.db.flushDB()
+		return True
+
+
+	@contextmanager
+	def transaction(self) -> Iterator[None]:
+		"""	Group all database changes of a block, e.g. creating a resource and updating
+			its parent, into a single commit. Changes and transactions of other threads
+			wait until the transaction has finished, so requests and notifications in a
+			transaction delay them, but reading is not blocked. Transactions may be nested, and the
+			changes are committed when the outermost transaction ends. When an exception
+			is raised in any of them, all changes are rolled back instead. Transactions 
+			only contain the resources and subscriptions. Changes of the other tables are
+			neither delayed nor rolled back by them.
+		"""
+		with self.lockResources:
+			if (outermost := self.transactions == 0):
+				self.transactionFailed = False
+				self.transactionResources.clear()
+				self.transactionSubscriptions.clear()
+				self.db.beginTransaction()
+			self.transactions += 1
+			try:
+				yield
+			except Exception:
+				self.transactionFailed = True
+				raise
+			finally:
+				self.transactions -= 1
+				if outermost:
+					if self.transactionFailed:
+						self._rollback()
+					else:
+						self.db.commitTransaction()
+
+
+	def _rollback(self) -> None:
+		"""	Roll back the changes of the outermost transaction. Only the index entries
+			and cached subscriptions of the resources that the transaction changed are
+			updated from the restored database.
+		"""
+		Logging.logWarn('Rolling back transaction')
+		self.db.rollbackTransaction()
+		for ri in self.transactionResources:
+			self.resourceCache.remove(ri)
+			if len(resources := self.db.searchResources(ri=ri)) == 1:
+				self._indexResource(resources[0])
+			else:
+				self._unindexResource({ 'ri' : ri })
+		for ri in self.transactionSubscriptions:
+			if (subs := self.db.searchSubscriptions(ri=ri)) is not None and len(subs) == 1:
+				self._cacheSubscription(subs[0])
+			else:
+				self._uncacheSubscription(ri)
+		self.transactionResources.clear()
+		self.transactionSubscriptions.clear()
+
+
+	def _changed(self, ri:str, subscription:bool=False) -> None:
+		"""	Record that a resource or subscription is changed by the open transaction,
+			if any. Must be called while holding *lockResources*.
+		"""
+		if self.transactions > 0:
+			(self.transactionSubscriptions if subscription else self.transactionResources).add(ri)
+
+
+	#########################################################################
+	##
+	##	Compaction
+	##
+
+	compactionIdleTime = 5.0	# Seconds without changes before a due compaction runs
+
+	def compactionWorker(self) -> bool:
+		"""	Run a compaction when the compaction interval has passed and the CSE was idle
+			for a short while.
+		"""
+		now = time.time()
+		if now - self.lastCompaction >= Configuration.get('db.compactionInterval') and now - self.lastChange >= self.compactionIdleTime:
+			self.compact()
+		return True
+
+
+	def compact(self) -> int:
+		"""	Compact the databases whose wasted space exceeds the compaction threshold.
+			Return the number of reclaimed bytes.
+		"""
+		start = time.perf_counter()
+		with self.lockResources:	# don't compact in the middle of a transaction
+			reclaimed = self.db.compactDB(Configuration.get('db.compactionThreshold'))
+		self.lastCompaction = time.time()
+		self.reclaimedBytes += reclaimed
+		Logging.log('Database compaction reclaimed %d bytes (%.3f s)' % (reclaimed, time.perf_counter() - start))
+		return reclaimed
+
+
+	#########################################################################
+	##
+	##	Backup and restore
+	##
+
+	def backupWorker(self) -> bool:
+		self.backup()
+		return True
+
+
+	def backup(self, filename:str=None) -> str:
+		"""	Write a point-in-time consistent backup of all databases while the CSE is running.
+			Changes are only blocked while the data is copied, but not while the backup
+			is written. *filename* is the name of the backup file without extension. Return 
+			the name of the written file.
+		"""
+		filename = filename or self.backupFile
+		os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+		start = time.perf_counter()
+		with self.lockResources:	# only include complete transactions
+			copy = self.db.copyDB()
+		copied = time.perf_counter()
+		filename = self.db.writeBackup(copy, filename)
+		Logging.log('Database backup written to: %s (blocked: %.3f s, total: %.3f s)' % (filename, copied - start, time.perf_counter() - start))
+		return filename
+
+
+	def restore(self, filename:str) -> None:
+		"""	Replace all databases with the content of a backup file. """
+		if not os.path.exists(filename):
+			Logging.logErr('Backup file not found: %s' % filename)
+			raise RuntimeError('Backup file not found: %s' % filename)
+		start = time.perf_counter()
+		try:
+			self.db.restoreBackup(filename)
+		except Exception as e:
+			Logging.logErr('Cannot restore backup: %s: %s' % (filename, str(e)))
+			raise RuntimeError('Cannot restore backup: %s' % filename)
+		Logging.log('Databases restored from backup: %s (%.3f s)' % (filename, time.perf_counter() - start))
+
+
 	#########################################################################
 	##
 	##	Resources
@@ -74,19 +288,22 @@ class Storage(object):
 		# Logging.logDebug('Adding resource (ty: %d, ri: %s, rn: %s)' % (resource['ty'], resource['ri'], resource['rn']))
 		did = None
 		srn = resource.__srn__
-		if overwrite:
-			Logging.logDebug('Resource enforced overwrite')
-			self.db.upsertResource(resource)
-		else: 
-			# if not self.db.hasResource(ri=ri) and not self.db.hasResource(srn=srn):	# Only when not resource does not exist yet
-			if not self.hasResource(ri, srn):	# Only when not resource does not exist yet
-				self.db.insertResource(resource)
-			else:
-				Logging.logWarn('Resource already exists (Skipping): %s ' % resource)
-				return Result(status=False, rsc=RC.alreadyExists, dbg='resource already exists')
-
-		# Add path to identifiers db
-		self.db.insertIdentifier(resource, ri, srn)
+		with self.lockResources:	# the database and the indexes are changed together
+			self._changed(ri)
+			if overwrite:
+				Logging.logDebug('Resource enforced overwrite')
+				self.db.upsertResource(resource)
+			else: 
+				# if not self.db.hasResource(ri=ri) and not self.db.hasResource(srn=srn):	# Only when not resource does not exist yet
+				if not self.hasResource(ri, srn):	# Only when not resource does not exist yet
+					self.db.insertResource(resource)
+				else:
+					Logging.logWarn('Resource already exists (Skipping): %s ' % resource)
+					return Result(status=False, rsc=RC.alreadyExists, dbg='resource already exists')
+
+			self.resourceCache.remove(ri)
+			self._indexResource(resource.json)
+		self.lastChange = time.time()
 		return Result(status=True, rsc=RC.created)
 
 
@@ -99,14 +316,24 @@ class Storage(object):
 		""" Return a resource via different addressing methods. """
 		resources = []
 
+		if ri is None and srn is not None:	# get the ri via the srn of the stored resources
+			if len(identifiers := self.db.searchIdentifiers(srn=srn)) == 1:
+				ri = identifiers[0]['ri']
+			else:
+				return Result(rsc=RC.notFound, dbg='resource not found')
+
 		if ri is not None:		# get a resource by its ri
 			# Logging.logDebug('Retrieving resource ri: %s' % ri)
-			resources = self.db.searchResources(ri=ri)
-
-		elif srn is not None:	# get a resource by its structured rn
-			# Logging.logDebug('Retrieving resource srn: %s' % srn)
-			# get the ri via the srn from the identifers table
-			resources = self.db.searchResources(srn=srn)
+			# The cached resources are never changed. The caller gets a copy-on-write
+			# copy, which only copies the attributes that the caller accesses.
+			if (resource := self.resourceCache.get(ri)) is not None:
+				return Result(resource=resource.clone(copyOnWrite=True))
+			generation = self.resourceCache.generation
+			if len(resources := self.db.searchResources(ri=ri)) == 1:
+				if (res := Utils.resourceFromDocument(resources[0])).resource is not None:
+					self.resourceCache.put(ri, res.resource, generation)
+					return Result(resource=res.resource.clone(copyOnWrite=True))
+				return res
 
 		elif csi is not None:	# get the CSE by its csi
 			# Logging.logDebug('Retrieving resource csi: %s' % csi)
@@ -115,7 +342,7 @@ class Storage(object):
 		# Logging.logDebug(resources)
 		# return Utils.resourceFromJSON(resources[0]) if len(resources) == 1 else None,
 		if (l := len(resources)) == 1:
-			return Utils.resourceFromJSON(resources[0])
+			return Utils.resourceFromDocument(resources[0])
 		elif l == 0:
 			return Result(rsc=RC.notFound, dbg='resource not found')
 
@@ -123,9 +350,12 @@ class Storage(object):
 
 
 	def retrieveResourcesByType(self, ty: T) -> List[dict]:
-		""" Return all resources of a certain type. """
+		""" Return all resources of a certain type. The resources are found via the type index. """
 		# Logging.logDebug('Retrieving all resources ty: %d' % ty)
-		return self.db.searchResources(ty=int(ty))
+		result:List[dict] = []
+		for ri in self.tyIndex.get(int(ty)):
+			result.extend(self.db.searchResources(ri=ri))
+		return result
 
 
 	def updateResource(self, resource: Resource) -> Result:
@@ -134,7 +364,13 @@ class Storage(object):
 			raise RuntimeError('resource is None')
 		ri = resource.ri
 		# Logging.logDebug('Updating resource (ty: %d, ri: %s, rn: %s)' % (resource['ty'], ri, resource['rn']))
-		return Result(resource=self.db.updateResource(resource), rsc=RC.updated)
+		with self.lockResources:	# the database and the indexes are changed together
+			self._changed(ri)
+			resource = self.db.updateResource(resource)
+			self.resourceCache.remove(ri)
+			self._indexResource(resource.json)
+		self.lastChange = time.time()
+		return Result(resource=resource, rsc=RC.updated)
 
 
 	def deleteResource(self, resource: Resource) -> Result:
@@ -142,29 +378,56 @@ class Storage(object):
 			Logging.logErr('resource is None')
 			raise RuntimeError('resource is None')
 		# Logging.logDebug('Removing resource (ty: %d, ri: %s, rn: %s)' % (resource['ty'], ri, resource['rn']))
-		self.db.deleteResource(resource)
-		self.db.deleteIdentifier(resource)
+		with self.lockResources:	# the database and the indexes are changed together
+			self._changed(resource.ri)
+			self.db.deleteResource(resource)
+			self.resourceCache.remove(resource.ri)
+			self._unindexResource(resource.json)
+		self.lastChange = time.time()
 		return Result(status=True, rsc=RC.deleted)
 
 
 
 	def directChildResources(self, pi: str, ty: T = None) -> List[Resource]:
+		"""	Return the child resources of *pi*, optionally only those with a resource type *ty*. """
+		return list(self.iterDirectChildResources(pi, ty))
+
+
+	def iterDirectChildResources(self, pi: str, ty: T = None) -> Iterator[Resource]:
+		"""	Yield the child resources of *pi* like directChildResources(). The documents
+			are read at once, but only converted to resources while the caller iterates.
+		"""
 		rs = self.db.searchResources(pi=pi, ty=int(ty) if ty is not None else None)
 
 		# if ty is not None:
 		# 	rs = self.tabResources.search((Query().pi == pi) & (Query().ty == ty))
 		# else:
 		# 	rs = self.tabResources.search(Query().pi == pi)			
-		result = []
 		for r in rs:
-			res = Utils.resourceFromJSON(r)
-			if res.resource is not None:
-				result.append(res.resource)
-		return result
+			if (res := Utils.resourceFromDocument(r)).resource is not None:
+				yield res.resource
 
 
-	def countResources(self) -> int:
-		return self.db.countResources()
+	def countResources(self, ty:T=None) -> int:
+		"""	Return the number of all resources, or of the resources with the resource type *ty*.
+			The counters are maintained with the indexes, so this doesn't access the database.
+		"""
+		return len(self.tyIndex) if ty is None else self.tyIndex.count(int(ty))
+
+
+	def countResourcesByType(self) -> Dict[int, int]:
+		"""	Return the number of resources for each resource type. """
+		return self.tyIndex.counts()
+
+
+	def countChildResources(self, pi:str) -> int:
+		"""	Return the number of direct child resources of the resource *pi*. """
+		return self.parentIndex.count(pi)
+
+
+	def countDescendantResources(self, pi:str) -> int:
+		"""	Return the number of all resources below the resource *pi*. """
+		return self.parentIndex.descendantCount(pi)
 
 
 	def identifier(self, ri:str) -> List[dict]:
@@ -174,9 +437,9 @@ class Storage(object):
 		return self.db.searchIdentifiers(srn=srn)
 
 
-	def searchByTypeFieldValue(self, ty:T, field:str, value:str) -> List[Resource]:
+	def searchByTypeFieldValue(self, ty:T, field:str, value:str, limit:int=None) -> List[Resource]:
 		"""Search and return all resources of a specific type and a value in a field,
-		and return them in an array."""
+		and return them in an array. Optionally, stop after *limit* resources."""
 		def filterFunc(r:dict) -> bool:
 			if 'ty' in r and r['ty'] == ty and field in r:
 				f = r[field]
@@ -186,7 +449,7 @@ class Storage(object):
 			return False
 
 
-		return self.searchByFilter(filterFunc)
+		return list(self.iterByFilter(filterFunc, limit=limit))
 		# return self.searchByFilter(lambda r: 'ty' in r and r['ty'] == ty and field in r and r[field] == value)
 
 
@@ -203,30 +466,96 @@ class Storage(object):
 		and return them in an array."""
 		result = []
 		for j in self.db.searchByValueInField(field, value):
-			res = Utils.resourceFromJSON(j)
+			res = Utils.resourceFromDocument(j)
 			if res.resource is not None:
 				result.append(res.resource)
 		return result
 
 
+	def searchByACPI(self, acpi:str) -> List[Resource]:
+		"""	Return all resources that reference the ACP with the resourceID *acpi* in
+			their acpi attribute. The acpi index is used, so this doesn't scan the database.
+		"""
+		return self._retrieveResources(self.acpiIndex.get(acpi))
+
+
+	def searchGroupsForMember(self, mid:str) -> List[Resource]:
+		"""	Return all <group> resources that have the resourceID *mid* in their
+			memberIDs. The mid index is used, so this doesn't scan the database.
+		"""
+		return self._retrieveResources(self.midIndex.get(mid))
+
+
+	def searchExpiredResources(self, now:str) -> Iterator[Resource]:
+		"""	Yield the resources with an expirationTime before *now*, ordered by their
+			expirationTime. The expiration index is used, so this doesn't scan the database.
+			The resources are retrieved one by one while the caller iterates, so resources
+			that are deleted in the meantime are skipped.
+		"""
+		return self._iterResources(self.etIndex.range(before=now))
+
+
+	def contentInstances(self, pi:str, after:str=None, before:str=None) -> List[Resource]:
+		"""	Return the <contentInstance> resources of a container, ordered by their creationTime.
+			Optionally, only the resources that were created after *after* and before *before*.
+		"""
+		return self._retrieveResources(self.cinIndex.range(pi, after=after, before=before))
+
+
+	def oldestContentInstance(self, pi:str) -> Resource:
+		"""	Return the oldest <contentInstance> resource of a container, or None. """
+		return self.retrieveResource(ri=ri).resource if (ri := self.cinIndex.first(pi)) is not None else None
+
+
+	def latestContentInstance(self, pi:str) -> Resource:
+		"""	Return the latest <contentInstance> resource of a container, or None. """
+		return self.retrieveResource(ri=ri).resource if (ri := self.cinIndex.last(pi)) is not None else None
+
+
+	def countContentInstances(self, pi:str) -> Tuple[int, int]:
+		"""	Return the number of <contentInstance> resources of a container and the sum of their sizes. """
+		return self.cinIndex.count(pi)
+
+
+	def _retrieveResources(self, ris:List[str]) -> List[Resource]:
+		"""	Return the resources for a list of resourceIDs. Missing resources are skipped. """
+		return list(self._iterResources(ris))
+
+
+	def _iterResources(self, ris:List[str]) -> Iterator[Resource]:
+		"""	Yield the resources for a list of resourceIDs. Missing resources are skipped. """
+		for ri in ris:
+			if (res := self.retrieveResource(ri=ri)).resource is not None:
+				yield res.resource
+
+
 	def searchByFilter(self, filter:Callable) -> List[Resource]:
 		"""	Return a list of resouces that match the given filter, or an empty list.
 		"""
-		result = []
-		for j in self.db.discoverResources(filter):
-			res = Utils.resourceFromJSON(j)
-			if res.resource is not None:
-				result.append(res.resource)
-		return result
+		return list(self.iterByFilter(filter))
 
-		
 
-	def searchAnnounceableResourcesForCSI(self, csi:str, isAnnounced:bool) -> List[Resource]:
-		""" Search and retrieve all resources that have the provided CSI in their 
-			'at' attribute.
+	def iterByFilter(self, filter:Callable, limit:int=None) -> Iterator[Resource]:
+		"""	Yield the resources that match the given filter. The database is scanned in
+			batches while the caller iterates, and only the matching documents are converted
+			to resources. The scan stops after *limit* resources, or when the caller stops
+			iterating. The caller may change the database while iterating.
+		"""
+		if limit is not None and limit <= 0:
+			return
+		count = 0
+		for j in self.db.iterateResources(filter):
+			if (res := Utils.resourceFromDocument(j)).resource is not None:
+				yield res.resource
+				count += 1
+				if limit is not None and count >= limit:
+					return
+
+
+	def searchAnnounceableResourcesForCSI(self, csi:str, isAnnounced:bool) -> Iterator[Resource]:
+		""" Search and yield all resources that have the provided CSI in their 
+			'at' attribute. The resources are found while the caller iterates.
 		"""
-		result = []
-
 		mcsi = '%s/' % csi
 		def _hasCSI(at:List[str]) -> bool:
 			for a in at:
@@ -246,13 +575,84 @@ class Storage(object):
 					return found == isAnnounced
 			return False
 
-		for j in self.db.discoverResources(_announcedFilter):
-			res = Utils.resourceFromJSON(j)
-			if res.resource is not None:
-				result.append(res.resource)
+		return self.iterByFilter(_announcedFilter)
+
+
+
+	#########################################################################
+	##
+	##	Indexes
+	##
+
+	def resourceIDsForTypes(self, tys:List[int]) -> Set[str]:
+		"""	Return the resourceIDs of all resources with one of the resource types *tys*. """
+		result:Set[str] = set()
+		for ty in tys:
+			result.update(self.tyIndex.get(ty))
+		return result
+
+
+	def resourceIDsForLabels(self, lbls:List[str]) -> Set[str]:
+		"""	Return the resourceIDs of all resources with at least one of the labels *lbls*. """
+		result:Set[str] = set()
+		for lbl in lbls:
+			result.update(self.lblIndex.get(lbl))
 		return result
 
 
+	def resourceIDsForTimeRange(self, attribute:str, after:str=None, before:str=None) -> Set[str]:
+		"""	Return the resourceIDs of all resources with a timestamp *attribute* (ct, lt or et)
+			that is after *after* and before *before*.
+		"""
+		index = { 'ct' : self.ctIndex, 'lt' : self.ltIndex, 'et' : self.etIndex }[attribute]
+		return set(index.range(after=after, before=before))
+
+
+	def parentResourceID(self, ri:str) -> str:
+		"""	Return the parent resourceID of a resource, or None. """
+		return self.parentIndex.get(ri)
+
+
+	def creationTime(self, ri:str) -> str:
+		"""	Return the creation time of a resource, or None. """
+		return self.ctIndex.get(ri)
+
+
+	def _indexes(self) -> List[Union[TreeIndex, ReverseIndex, SortedIndex, SeriesIndex]]:
+		"""	Return all in-memory indexes of the resources. """
+		return [ self.parentIndex, self.tyIndex, self.lblIndex, self.ctIndex, self.ltIndex, self.etIndex, self.acpiIndex, self.midIndex, self.cinIndex ]
+
+
+	def _buildIndexes(self) -> None:
+		"""	Build the in-memory indexes with a single scan of the database. """
+		self.resourceCache.clear()
+		for index in self._indexes():
+			index.clear()
+		for jsn in self.db.iterateResources(lambda r: True):
+			self._indexResource(jsn)
+		Logging.logDebug('Indexes built for %d resources' % self.countResources())
+
+
+	def _indexResource(self, jsn:dict) -> None:
+		ri = jsn.get('ri')
+		self.parentIndex.put(ri, jsn.get('pi'))
+		self.tyIndex.put(ri, [ jsn.get('ty') ])
+		self.lblIndex.put(ri, jsn.get('lbl'))
+		self.ctIndex.put(ri, jsn.get('ct'))
+		self.ltIndex.put(ri, jsn.get('lt'))
+		self.etIndex.put(ri, jsn.get('et'))
+		self.acpiIndex.put(ri, jsn.get('acpi'))
+		if (ty := jsn.get('ty')) == T.GRP:
+			self.midIndex.put(ri, jsn.get('mid'))
+		elif ty == T.CIN:
+			self.cinIndex.put(jsn.get('pi'), ri, jsn.get('ct'), jsn.get('cs') or 0)
+
+
+	def _unindexResource(self, jsn:dict) -> None:
+		ri = jsn.get('ri')
+		for index in self._indexes():
+			index.remove(ri)
+
 
 	#########################################################################
 	##
@@ -261,30 +661,83 @@ class Storage(object):
 
 	def getSubscription(self, ri: str) -> dict:
 		# Logging.logDebug('Retrieving subscription: %s' % ri)
-		subs = self.db.searchSubscriptions(ri=ri)
-		if subs is None or len(subs) != 1:
-			return None
-		return subs[0]
+		with self.lockSubscriptionCache:
+			if (pi := self.subscriptionParents.get(ri)) is None:
+				return None
+			return self.subscriptionsByParent[pi][ri]
 
 
 	def getSubscriptionsForParent(self, pi: str) -> List[dict]:
+		"""	Return the subscriptions for a resource. The returned subscriptions are shared
+			with the cache and must not be modified.
+		"""
 		# Logging.logDebug('Retrieving subscriptions for parent: %s' % pi)
-		return self.db.searchSubscriptions(pi=pi)
+		# Most resources have no subscriptions. Looking them up doesn't need the lock.
+		if (subs := self.subscriptionsByParent.get(pi)) is None:
+			return []
+		with self.lockSubscriptionCache:
+			return list(subs.values())
 
 
 	def addSubscription(self, subscription: Resource) -> bool:
 		# Logging.logDebug('Adding subscription: %s' % ri)
-		return self.db.upsertSubscription(subscription)
+		return self._upsertSubscription(subscription)
 
 
 	def removeSubscription(self, subscription: Resource) -> bool:
 		# Logging.logDebug('Removing subscription: %s' % subscription.ri)
-		return self.db.removeSubscription(subscription)
+		with self.lockResources:
+			self._changed(subscription.ri, subscription=True)
+			result = self.db.removeSubscription(subscription)
+			self._uncacheSubscription(subscription.ri)
+		return result
 
 
 	def updateSubscription(self, subscription : Resource) -> bool:
 		# Logging.logDebug('Updating subscription: %s' % ri)
-		return self.db.upsertSubscription(subscription)
+		return self._upsertSubscription(subscription)
+
+
+	def _upsertSubscription(self, subscription:Resource) -> bool:
+		with self.lockResources:
+			self._changed(subscription.ri, subscription=True)
+			if not self.db.upsertSubscription(subscription):
+				return False
+			# Cache the subscription as it was stored by the binding
+			if (subs := self.db.searchSubscriptions(ri=subscription.ri)) is not None and len(subs) == 1:
+				self._cacheSubscription(subs[0])
+		return True
+
+
+	def _buildSubscriptionCache(self) -> None:
+		with self.lockSubscriptionCache:
+			self.subscriptionsByParent.clear()
+			self.subscriptionParents.clear()
+		for sub in self.db.searchSubscriptions():
+			self._cacheSubscription(sub)
+
+
+	def _cacheSubscription(self, sub:dict) -> None:
+		ri = sub['ri']
+		with self.lockSubscriptionCache:
+			if (pi := self.subscriptionParents.get(ri)) is not None and pi != sub['pi']:
+				self._removeCachedSubscription(ri)
+			self.subscriptionsByParent.setdefault(sub['pi'], {})[ri] = sub
+			self.subscriptionParents[ri] = sub['pi']
+
+
+	def _uncacheSubscription(self, ri:str) -> None:
+		with self.lockSubscriptionCache:
+			self._removeCachedSubscription(ri)
+
+
+	def _removeCachedSubscription(self, ri:str) -> None:
+		if (pi := self.subscriptionParents.pop(ri, None)) is None:
+			return
+		subs = self.subscriptionsByParent[pi]
+		del subs[ri]
+		if len(subs) == 0:	# keep only the resources with subscriptions
+			del self.subscriptionsByParent[pi]
 
 
 
@@ -306,7 +759,7 @@ class Storage(object):
 		return self.db.getBatchNotifications(ri, nu)
 
 
-	def removeBatchNotifications(self, ri:str, nu:str) -> List[dict]:
+	def removeBatchNotifications(self, ri:str, nu:str) -> bool:
 		return self.db.removeBatchNotifications(ri, nu)
 
 
@@ -341,6 +794,213 @@ class Storage(object):
 		return self.db.removeAppData(data)
 
 
+#########################################################################
+#
+#	Interface for the database bindings
+#
+#	Every database binding must implement the following methods. Resources
+#	are passed in as Resource objects, but returned as plain dictionaries.
+
+
+class StorageBinding(object):
+
+	cursorBatchSize = 100	# Number of documents that are read at once by iterateResources()
+
+	def openDB(self, postfix:str) -> None:
+		raise NotImplementedError('openDB()')
+
+
+	def closeDB(self) -> None:
+		raise NotImplementedError('closeDB()')
+
+
+	def flushDB(self) -> None:
+		"""	Write all buffered changes to the persistent storage. """
+		raise NotImplementedError('flushDB()')
+
+
+	def beginTransaction(self) -> None:
+		"""	Start a transaction. Changes are not committed before the outermost 
+			transaction has ended. 
+		"""
+		raise NotImplementedError('beginTransaction()')
+
+
+	def commitTransaction(self) -> None:
+		"""	End a transaction and commit its changes when it is the outermost one. """
+		raise NotImplementedError('commitTransaction()')
+
+
+	def rollbackTransaction(self) -> None:
+		"""	End the outermost transaction and discard its changes. """
+		raise NotImplementedError('rollbackTransaction()')
+
+
+	def purgeDB(self) -> None:
+		raise NotImplementedError('purgeDB()')
+
+
+	def copyDB(self) -> Any:
+		"""	Return a consistent copy of all databases for a backup. Changes are blocked
+			while the copy is made, so this must be fast.
+		"""
+		raise NotImplementedError('copyDB()')
+
+
+	def writeBackup(self, copy:Any, filename:str) -> str:
+		"""	Write a copy that was made by copyDB() to a backup file. *filename* is without
+			extension. Return the name of the written file.
+		"""
+		raise NotImplementedError('writeBackup()')
+
+
+	def restoreBackup(self, filename:str) -> None:
+		"""	Replace the content of all databases with a backup file. """
+		raise NotImplementedError('restoreBackup()')
+
+
+	def compactDB(self, threshold:float) -> int:
+		"""	Rewrite the databases densely when the ratio of wasted space reaches *threshold*.
+			Return the number of bytes by which the database files shrank.
+		"""
+		raise NotImplementedError('compactDB()')
+
+
+	#
+	#	Resources
+	#
+
+	def insertResource(self, resource:Resource) -> None:
+		raise NotImplementedError('insertResource()')
+
+
+	def upsertResource(self, resource:Resource) -> None:
+		raise NotImplementedError('upsertResource()')
+
+
+	def updateResource(self, resource:Resource) -> Resource:
+		"""	Update a resource in the database. Attributes that are set to None
+			are removed from the database as well as from the resource.
+		"""
+		raise NotImplementedError('updateResource()')
+
+
+	def deleteResource(self, resource:Resource) -> None:
+		raise NotImplementedError('deleteResource()')
+
+
+	def searchResources(self, ri:str=None, csi:str=None, srn:str=None, pi:str=None, ty:int=None) -> List[dict]:
+		raise NotImplementedError('searchResources()')
+
+
+	def discoverResources(self, func:Callable) -> List[dict]:
+		raise NotImplementedError('discoverResources()')
+
+
+	def iterateResources(self, func:Callable) -> Iterator[dict]:
+		"""	Yield the resources that match *func*. The resources are read in batches of
+			*cursorBatchSize* documents, and no lock is held while the caller processes
+			a batch, so the caller may change the database in the meantime.
+		"""
+		raise NotImplementedError('iterateResources()')
+
+
+	def hasResource(self, ri:str=None, csi:str=None, srn:str=None, ty:int=None) -> bool:
+		raise NotImplementedError('hasResource()')
+
+
+	def countResources(self) -> int:
+		raise NotImplementedError('countResources()')
+
+
+	def searchByValueInField(self, field:str, value:Any) -> List[dict]:
+		raise NotImplementedError('searchByValueInField()')
+
+
+	#
+	#	Identifiers
+	#
+
+	def searchIdentifiers(self, ri:str=None, srn:str=None) -> List[dict]:
+		"""	Return the identifiers (ri, rn, srn, ty) of a resource. They are derived from 
+			the stored resource, which includes its structured path.
+		"""
+		raise NotImplementedError('searchIdentifiers()')
+
+
+	#
+	#	Subscriptions
+	#
+
+	def searchSubscriptions(self, ri:str=None, pi:str=None) -> List[dict]:
+		"""	Return the subscriptions with the resourceID *ri* or for the parent *pi*, 
+			or all subscriptions if neither is given.
+		"""
+		raise NotImplementedError('searchSubscriptions()')
+
+
+	def upsertSubscription(self, subscription:Resource) -> bool:
+		raise NotImplementedError('upsertSubscription()')
+
+
+	def removeSubscription(self, subscription:Resource) -> bool:
+		raise NotImplementedError('removeSubscription()')
+
+
+	#
+	#	BatchNotifications
+	#
+
+	def addBatchNotification(self, ri:str, nu:str, notificationRequest:dict) -> bool:
+		raise NotImplementedError('addBatchNotification()')
+
+
+	def countBatchNotifications(self, ri:str, nu:str) -> int:
+		raise NotImplementedError('countBatchNotifications()')
+
+
+	def getBatchNotifications(self, ri:str, nu:str) -> List[dict]:
+		raise NotImplementedError('getBatchNotifications()')
+
+
+	def removeBatchNotifications(self, ri:str, nu:str) -> bool:
+		raise NotImplementedError('removeBatchNotifications()')
+
+
+	#
+	#	Statistics
+	#
+
+	def searchStatistics(self) -> dict:
+		raise NotImplementedError('searchStatistics()')
+
+
+	def upsertStatistics(self, stats:dict) -> bool:
+		raise NotImplementedError('upsertStatistics()')
+
+
+	#
+	#	App Data
+	#
+
+	def searchAppData(self, id:str) -> dict:
+		raise NotImplementedError('searchAppData()')
+
+
+	def upsertAppData(self, data:dict) -> bool:
+		raise NotImplementedError('upsertAppData()')
+
+
+	def removeAppData(self, data:dict) -> bool:
+		raise NotImplementedError('removeAppData()')
+
+
+
+def _identifiers(ri:str, srn:str, ty:int) -> dict:
+	"""	Return the identifiers of a resource. The rn is the last element of its srn. """
+	return { 'ri' : ri, 'rn' : srn.split('/')[-1] if srn is not None else None, 'srn' : srn, 'ty' : ty }
+
+
 #########################################################################
 #
 #	DB class that implements the TinyDB binding
@@ -348,21 +1008,44 @@ class Storage(object):
 #	This class may be moved later to an own module.
 
 
-class TinyDBBinding(object):
+class TinyDBBinding(StorageBinding):
 
 	def __init__(self, path: str = None) -> None:
 		self.path = path
 		self.cacheSize = Configuration.get('db.cacheSize')
 		Logging.log('Cache Size: %s' % self.cacheSize)
-
-		# create transaction locks
-		# create transaction locks
-		self.lockResources = Lock()
-		self.lockIdentifiers = Lock()
-		self.lockSubscriptions = Lock()
-		self.lockBatchNotifications = Lock()
-		self.lockStatistics = Lock()
-		self.lockAppData = Lock()
+		# Number of buffered changes per database file when write-behind is enabled
+		self.writeBufferSize = Configuration.get('db.writeBehindOperations') if Configuration.get('db.writeBehindInterval') > 0 else 1
+		# Codec for the database and snapshot files
+		self.codec = Codec(Configuration.get('db.codec'), Configuration.get('db.compression'))
+
+		# create transaction locks. Reading requests may access a table concurrently,
+		# while changes get exclusive access.
+		self.lockResources = ReadWriteLock()
+		self.lockSubscriptions = ReadWriteLock()
+		self.lockBatchNotifications = ReadWriteLock()
+		self.lockStatistics = ReadWriteLock()
+		self.lockAppData = ReadWriteLock()
+
+		# In-memory indexes for the resources table. They are maintained alongside 
+		# the table and are protected by its lock.
+		self.riIndex:Dict[str, int] 				= {}	# ri -> doc_id
+		self.piIndex:Dict[str, Set[int]]			= {}	# pi -> set(doc_id)
+		self.piTyIndex:Dict[Tuple[str, int], Set[int]]	= {}	# (pi, ty) -> set(doc_id)
+		self.csiIndex:Dict[str, str]				= {}	# csi -> ri
+		self.srnIndex:Dict[str, str]				= {}	# srn -> ri
+
+		# Journals when the databases are held in memory, but persisted through a journal
+		self.journals:List[Tuple[TinyDB, Journal, ReadWriteLock]] = []
+
+		# Number of open (nested) transactions, and the previous versions of the documents
+		# that were changed by the open transaction
+		self.transactions = 0
+		self.lockTransactions = Lock()
+		self.undoLog = UndoLog()
+
+		# The number of changes of each table when it was last checked by the compaction
+		self.compactedChanges:Dict[str, int] = {}
 
 
 	def openDB(self, postfix: str) -> None:
@@ -372,45 +1055,397 @@ class TinyDBBinding(object):
 		if Configuration.get('db.inMemory'):
 			Logging.log('DB in memory')
 			self.dbResources = TinyDB(storage=MemoryStorage)
-			self.dbIdentifiers = TinyDB(storage=MemoryStorage)
 			self.dbSubscriptions = TinyDB(storage=MemoryStorage)
 			self.dbBatchNotifications = TinyDB(storage=MemoryStorage)
 			self.dbStatistics = TinyDB(storage=MemoryStorage)
 			self.dbAppData = TinyDB(storage=MemoryStorage)
+		elif Configuration.get('db.journal'):
+			Logging.log('DB in memory with journal in file system. Snapshot format: %s' % self.codec)
+			self._removeIdentifiersFiles(postfix)
+			self.dbResources = self._openJournaledDB('%s/resources%s' % (self.path, postfix), self.lockResources)
+			self.dbSubscriptions = self._openJournaledDB('%s/subscriptions%s' % (self.path, postfix), self.lockSubscriptions)
+			self.dbBatchNotifications = self._openJournaledDB('%s/batchNotifications%s' % (self.path, postfix), self.lockBatchNotifications)
+			self.dbStatistics = self._openJournaledDB('%s/statistics%s' % (self.path, postfix), self.lockStatistics)
+			self.dbAppData = self._openJournaledDB('%s/appdata%s' % (self.path, postfix), self.lockAppData)
 		else:
-			Logging.log('DB in file system')
-			self.dbResources = TinyDB('%s/resources%s.json' % (self.path, postfix))
-			self.dbIdentifiers = TinyDB('%s/identifiers%s.json' % (self.path, postfix))
-			self.dbSubscriptions = TinyDB('%s/subscriptions%s.json' % (self.path, postfix))
-			self.dbBatchNotifications = TinyDB('%s/batchNotifications%s.json' % (self.path, postfix))
-			self.dbStatistics = TinyDB('%s/statistics%s.json' % (self.path, postfix))
-			self.dbAppData = TinyDB('%s/appdata%s.json' % (self.path, postfix))
-		self.tabResources = self.dbResources.table('resources', cache_size=self.cacheSize)
-		self.tabIdentifiers = self.dbIdentifiers.table('identifiers', cache_size=self.cacheSize)
-		self.tabSubscriptions = self.dbSubscriptions.table('subsriptions', cache_size=self.cacheSize)
-		self.tabBatchNotifications = self.dbBatchNotifications.table('batchNotifications', cache_size=self.cacheSize)
-		self.tabStatistics = self.dbStatistics.table('statistics', cache_size=self.cacheSize)
-		self.tabAppData = self.dbAppData.table('appdata', cache_size=self.cacheSize)
+			Logging.log('DB in file system. Format: %s' % self.codec)
+			self._removeIdentifiersFiles(postfix)
+			self.dbResources = self._openFileDB('%s/resources%s' % (self.path, postfix))
+			self.dbSubscriptions = self._openFileDB('%s/subscriptions%s' % (self.path, postfix))
+			self.dbBatchNotifications = self._openFileDB('%s/batchNotifications%s' % (self.path, postfix))
+			self.dbStatistics = self._openFileDB('%s/statistics%s' % (self.path, postfix))
+			self.dbAppData = self._openFileDB('%s/appdata%s' % (self.path, postfix))
+		self.tabResources = self._table(self.dbResources, 'resources')
+		self.tabSubscriptions = self._table(self.dbSubscriptions, 'subsriptions')
+		self.tabBatchNotifications = self._table(self.dbBatchNotifications, 'batchNotifications')
+		self.tabStatistics = self._table(self.dbStatistics, 'statistics')
+		self.tabAppData = self._table(self.dbAppData, 'appdata')
+
+		# Build the indexes once
+		self._rebuildIndexes()
+
+		# Compact the replayed journals and start the snapshot worker
+		if len(self.journals) > 0:
+			for _, journal, _ in self.journals:
+				journal.open()
+			self._snapshot(force=True)
+			BackgroundWorkerPool.newWorker(Configuration.get('db.snapshotInterval'), self.snapshotWorker, 'dbSnapshotWorker', startWithDelay=True).start()
+
+
+	def _openFileDB(self, filename:str) -> TinyDB:
+		"""	Open a file based TinyDB. The whole database is kept in a read cache, so 
+			that lookups via the indexes don't have to read and parse the file again. 
+			Every write is written through to the file immediately, unless write-behind
+			is enabled, but only synchronized to the disk when *db.fsync* is set. The file
+			is encoded with the configured codec, and an existing file in another format 
+			is converted first.
+		"""
+		self._migrateFile(filename)
+		db = TinyDB(filename + self.codec.extension, storage=CachingMiddleware(CodecStorage), codec=self.codec, sync=Configuration.get('db.fsync'))
+		db.storage.WRITE_CACHE_SIZE = self.writeBufferSize
+		return db
+
+
+	def _openJournaledDB(self, filename:str, lock:ReadWriteLock) -> TinyDB:
+		"""	Open a TinyDB that is held in memory. It is initialized from the last 
+			snapshot and journal, and every change is appended to the journal.
+		"""
+		self._migrateFile(filename)
+		journal = Journal(filename + self.codec.extension, '%s.journal' % filename, self.writeBufferSize, self.codec)
+		db = TinyDB(storage=MemoryStorage)
+		db.storage.write(journal.load())
+		db.table_class = JournaledTable
+		self.journals.append((db, journal, lock))
+		return db
+
+
+	def _migrateFile(self, filename:str) -> None:
+		if (oldFilename := migrate(filename, self.codec)) is not None:
+			Logging.log('Converted database file: %s to format: %s' % (oldFilename, self.codec))
+
+
+	def _removeIdentifiersFiles(self, postfix:str) -> None:
+		"""	Remove the files of the former identifiers table, in any format and with its
+			journal. The identifiers are now resolved via the resources themselves, so
+			there is nothing to migrate.
+		"""
+		for filename in glob.glob('%s/identifiers%s.*' % (glob.escape(self.path), glob.escape(postfix))):
+			try:
+				os.remove(filename)
+				Logging.log('Removed obsolete database file: %s' % filename)
+			except OSError as e:
+				Logging.logWarn('Cannot remove obsolete database file: %s (%s)' % (filename, str(e)))
+
+
+	def _table(self, db:TinyDB, name:str) -> Table:
+		# Only the changes of the tables in transactions are recorded for a rollback
+		undoLog = self.undoLog if self._inTransactions(db) else None
+		for journaledDB, journal, _ in self.journals:
+			if journaledDB is db:
+				return db.table(name, cache_size=self.cacheSize, journal=journal, undoLog=undoLog)
+		db.table_class = UndoTable
+		return db.table(name, cache_size=self.cacheSize, undoLog=undoLog)
+
+
+	def _inTransactions(self, db:TinyDB) -> bool:
+		"""	Return whether the changes of a database belong to transactions. Only the
+			resources and subscriptions are changed in transactions. The other databases
+			are written independently, also while a transaction is open.
+		"""
+		return db is self.dbResources or db is self.dbSubscriptions
 
 
 	def closeDB(self) -> None:
 		Logging.log('Closing DBs')
+		if len(self.journals) > 0:
+			BackgroundWorkerPool.stopWorkers('dbSnapshotWorker')
+			self._snapshot()
+			for _, journal, _ in self.journals:
+				journal.close()
 		self.dbResources.close()
-		self.dbIdentifiers.close()
 		self.dbSubscriptions.close()
 		self.dbBatchNotifications.close()
 		self.dbStatistics.close()
 		self.dbAppData.close()
 
 
+	def flushDB(self) -> None:
+		with self.lockTransactions:
+			# changes of an open transaction are written when it is committed
+			for db, journal, lock in self.journals:
+				if self.transactions == 0 or not self._inTransactions(db):
+					with ReadRWLock(lock):
+						journal.flush()
+			for db, lock in self._fileDatabases():
+				if self.transactions == 0 or not self._inTransactions(db):
+					with ReadRWLock(lock):
+						db.storage.flush()
+
+
+	def beginTransaction(self) -> None:
+		with self.lockTransactions:
+			self.transactions += 1
+			if self.transactions > 1:
+				return
+			self.undoLog.start()
+			for db, journal, _ in self.journals:
+				if self._inTransactions(db):
+					journal.begin()
+			for db, _ in self._fileDatabases():
+				if self._inTransactions(db):
+					db.storage.WRITE_CACHE_SIZE = sys.maxsize	# keep all changes in the cache 
+
+
+	def commitTransaction(self) -> None:
+		with self.lockTransactions:
+			self.transactions -= 1
+			if self.transactions > 0:
+				return
+			self.undoLog.stop()
+			for db, journal, _ in self.journals:
+				if self._inTransactions(db):
+					journal.commit()
+			for db, lock in self._fileDatabases():
+				if self._inTransactions(db):
+					db.storage.WRITE_CACHE_SIZE = self.writeBufferSize
+					if self.writeBufferSize <= 1:	# otherwise the changes are written behind
+						with ReadRWLock(lock):
+							db.storage.flush()
+
+
+	def rollbackTransaction(self) -> None:
+		with self.lockTransactions:
+			if self.transactions == 1:
+				# Write back the previous versions of the changed documents. The restored 
+				# documents are journaled and written like any other change.
+				previous = self.undoLog.stop()
+				for table, lock in self._tables():
+					if (documents := previous.get(table.name)) is not None:
+						with WriteRWLock(lock):
+							if table is self.tabResources:	# only the restored documents are indexed again
+								for docID in documents:
+									self._unindexResource(docID)
+							restored = table.undo(documents)
+							if table is self.tabResources:
+								self._reindexResources(restored)
+		self.commitTransaction()
+
+
+	def _fileDatabases(self) -> List[Tuple[TinyDB, ReadWriteLock]]:
+		"""	Return the file based databases and their locks. """
+		if Configuration.get('db.inMemory') or len(self.journals) > 0:
+			return []
+		return [	(self.dbResources, self.lockResources), 
+					(self.dbSubscriptions, self.lockSubscriptions),
+					(self.dbBatchNotifications, self.lockBatchNotifications),
+					(self.dbStatistics, self.lockStatistics),
+					(self.dbAppData, self.lockAppData) ]
+
+
 	def purgeDB(self) -> None:
 		Logging.log('Purging DBs')
 		self.tabResources.truncate()
-		self.tabIdentifiers.truncate()
 		self.tabSubscriptions.truncate()
 		self.tabBatchNotifications.truncate()
 		self.tabStatistics.truncate()
 		self.tabAppData.truncate()
+		self._rebuildIndexes()
+
+
+	#
+	#	Backup and restore
+	#
+
+	def _tables(self) -> List[Tuple[Table, ReadWriteLock]]:
+		return [	(self.tabResources, self.lockResources),
+					(self.tabSubscriptions, self.lockSubscriptions),
+					(self.tabBatchNotifications, self.lockBatchNotifications),
+					(self.tabStatistics, self.lockStatistics),
+					(self.tabAppData, self.lockAppData) ]
+
+
+	def copyDB(self) -> Dict[str, Dict[str, dict]]:
+		tables = self._tables()
+		with ExitStack() as stack:
+			# Hold the locks of all tables at the same time to get a consistent state
+			for _, lock in tables:
+				stack.enter_context(ReadRWLock(lock))
+			# The stored documents may be changed in place later, also their nested
+			# attributes, therefore the documents are copied completely.
+			return { table.name : { docID : copy.deepcopy(doc) for docID, doc in self._documents(table).items() } for table, _ in tables }
+
+
+	def writeBackup(self, copy:Dict[str, Dict[str, dict]], filename:str) -> str:
+		filename += self.codec.extension
+		self.codec.write(filename, { 'version' : 1, 'tables' : copy })
+		return filename
+
+
+	def restoreBackup(self, filename:str) -> None:
+		if (codec := codecForFile(filename)) is None:
+			raise ValueError('unknown backup file format')
+		if (backup := codec.read(filename)) is None or not isinstance(tables := backup.get('tables'), dict):
+			raise ValueError('not a database backup')
+		for table, lock in self._tables():
+			with WriteRWLock(lock):
+				self._replaceDocuments(table, list(tables.get(table.name, {}).values()))
+		self._rebuildIndexes()
+		if len(self.journals) > 0:
+			self._snapshot(force=True)
+
+
+	def _replaceDocuments(self, table:Table, documents:List[dict]) -> None:
+		"""	Replace all documents of a table. The documents get new, consecutive doc_ids.
+			A database file is written only once.
+		"""
+		if (cached := isinstance(table.storage, CachingMiddleware)):
+			table.storage.WRITE_CACHE_SIZE = sys.maxsize	# keep both changes in the cache
+		try:
+			table.truncate()
+			table.insert_multiple(documents)
+		finally:
+			if cached:
+				table.storage.WRITE_CACHE_SIZE = self.writeBufferSize
+				table.storage.flush()
+
+
+	#
+	#	Compaction
+	#
+
+	def compactDB(self, threshold:float) -> int:
+		"""	The doc_ids of the tables only grow, and with many inserted and removed documents,
+			e.g. contentInstances, the gaps make up most of the id range. Tables with a ratio 
+			of unused doc_ids of at least *threshold* are rewritten with consecutive doc_ids.
+			Journals are compacted into a new snapshot when they have grown to *threshold*
+			of their snapshot's size. Tables that were not changed since they were last 
+			checked are skipped.
+		"""
+		if Configuration.get('db.inMemory'):
+			return 0
+		self.flushDB()		# measure the files with the written-behind changes
+		size = self._filesSize()
+		for table, lock in self._tables():
+			with WriteRWLock(lock):
+				if self.compactedChanges.get(table.name) == table.changes:
+					continue
+				documents = self._documents(table)
+				if len(documents) > 0 and 1.0 - len(documents) / max(map(int, documents)) >= threshold:
+					Logging.logDebug('Compacting table: %s' % table.name)
+					self._replaceDocuments(table, list(documents.values()))
+					if table is self.tabResources:
+						self._rebuildIndexes()	# the indexes contain doc_ids
+				self.compactedChanges[table.name] = table.changes
+		for db, journal, lock in self.journals:
+			with ReadRWLock(lock):
+				if journal.entries > 0 and os.path.getsize(journal.journalFile) >= threshold * max(os.path.getsize(journal.snapshotFile) if os.path.exists(journal.snapshotFile) else 0, 1):
+					Logging.logDebug('Compacting journal: %s' % journal.journalFile)
+					journal.snapshot(db.storage.read() or {})
+		return max(size - self._filesSize(), 0)
+
+
+	def _filesSize(self) -> int:
+		"""	Return the total size of the database, snapshot and journal files. """
+		files = [ db.storage.storage.path for db, _ in self._fileDatabases() ]
+		for _, journal, _ in self.journals:
+			files.extend([ journal.snapshotFile, journal.journalFile ])
+		return sum(os.path.getsize(file) for file in files if os.path.exists(file))
+
+
+	#
+	#	Journal snapshots
+	#
+
+	def snapshotWorker(self) -> bool:
+		Logging.logDebug('Writing DB snapshots')
+		self._snapshot()
+		return True
+
+
+	def _snapshot(self, force:bool=False) -> None:
+		"""	Write a snapshot for each journal that has changed since its last snapshot. """
+		for db, journal, lock in self.journals:
+			with ReadRWLock(lock):
+				if force or journal.entries > 0:
+					journal.snapshot(db.storage.read() or {})
+
+
+	#
+	#	Indexes
+	#
+
+	def _documents(self, table:Table) -> Dict[str, dict]:
+		"""	Return the raw documents of a table, indexed by their (string) doc_id. Unlike
+			TinyDB's own methods this doesn't convert the whole table for each access.
+		"""
+		if (tables := table.storage.read()) is None:
+			return {}
+		return tables.get(table.name, {})
+
+
+	def _getDocuments(self, table:Table, docIDs:Any) -> List[dict]:
+		"""	Return copies of the documents for the given doc_ids. """
+		documents = self._documents(table)
+		return [ Document(doc, docID) for docID in docIDs if (doc := documents.get(str(docID))) is not None ]
+
+
+	def _search(self, table:Table, cond:Callable) -> List[dict]:
+		"""	Return copies of the documents that match a condition. Unlike TinyDB's search()
+			this doesn't update the table's query cache, so it may be called by concurrent readers.
+		"""
+		return [ Document(doc, int(docID)) for docID, doc in self._documents(table).items() if cond(doc) ]
+
+
+	def _rebuildIndexes(self) -> None:
+		with WriteRWLock(self.lockResources):
+			self.riIndex.clear()
+			self.piIndex.clear()
+			self.piTyIndex.clear()
+			self.csiIndex.clear()
+			self.srnIndex.clear()
+			for docID, doc in self._documents(self.tabResources).items():
+				self._indexResource(int(docID), doc)
+		Logging.logDebug('Indexed %d resources' % len(self.riIndex))
+
+
+	def _reindexResources(self, docIDs:List[int]) -> None:
+		"""	Index the documents *docIDs* again, e.g. after they were restored. """
+		documents = self._documents(self.tabResources)
+		for docID in docIDs:
+			if (doc := documents.get(str(docID))) is not None:
+				self._indexResource(docID, doc)
+
+
+	def _indexResource(self, docID:int, doc:dict) -> None:
+		self.riIndex[(ri := doc.get('ri'))] = docID
+		self.piIndex.setdefault((pi := doc.get('pi')), set()).add(docID)
+		self.piTyIndex.setdefault((pi, doc.get('ty')), set()).add(docID)
+		if (csi := doc.get('csi')) is not None:
+			self.csiIndex[csi] = ri
+		if (srn := doc.get(Resource._srn)) is not None:
+			self.srnIndex[srn] = ri
+
+
+	def _unindexResource(self, docID:int) -> None:
+		if (doc := self._documents(self.tabResources).get(str(docID))) is None:
+			return
+		ri = doc.get('ri')
+		if self.riIndex.get(ri) == docID:
+			del self.riIndex[ri]
+		pi = doc.get('pi')
+		self._discardFromIndex(self.piIndex, pi, docID)
+		self._discardFromIndex(self.piTyIndex, (pi, doc.get('ty')), docID)
+		if (csi := doc.get('csi')) is not None and self.csiIndex.get(csi) == ri:
+			del self.csiIndex[csi]
+		if (srn := doc.get(Resource._srn)) is not None and self.srnIndex.get(srn) == ri:
+			del self.srnIndex[srn]
+
+
+	def _discardFromIndex(self, index:Dict[Any, Set[int]], key:Any, docID:int) -> None:
+		if (docIDs := index.get(key)) is not None:
+			docIDs.discard(docID)
+			if len(docIDs) == 0:
+				del index[key]
 
 
 	#
@@ -419,81 +1454,106 @@ class TinyDBBinding(object):
 
 
 	def insertResource(self, resource: Resource) -> None:
-		with self.lockResources:
-			self.tabResources.insert(resource.json)
+		with WriteRWLock(self.lockResources):
+			docID = self.tabResources.insert(resource.json)
+			self._indexResource(docID, resource.json)
 	
 
 	def upsertResource(self, resource: Resource) -> None:
 		#Logging.logDebug(resource)
-		with self.lockResources:
-			self.tabResources.upsert(resource.json, Query().ri == resource.ri)	# Update existing or insert new when overwriting
+		with WriteRWLock(self.lockResources):
+			# Update existing or insert new when overwriting
+			if (docID := self.riIndex.get(resource.ri)) is not None:
+				self._unindexResource(docID)
+				self.tabResources.update(resource.json, doc_ids=[docID])
+			else:
+				docID = self.tabResources.insert(resource.json)
+			self._indexResource(docID, resource.json)
 	
 
 	def updateResource(self, resource: Resource) -> Resource:
 		#Logging.logDebug(resource)
-		with self.lockResources:
+		with WriteRWLock(self.lockResources):
 			ri = resource.ri
-			self.tabResources.update(resource.json, Query().ri == ri)
+			if (docID := self.riIndex.get(ri)) is None:
+				return resource
+			self._unindexResource(docID)
+			self.tabResources.update(resource.json, doc_ids=[docID])
 			# remove nullified fields from db and resource
 			# TODO remove Null values recursively
 			for k in list(resource.json):
 				if resource.json[k] is None:
-					self.tabResources.update(delete(k), Query().ri == ri)
+					self.tabResources.update(delete(k), doc_ids=[docID])
 					del resource.json[k]
+			self._indexResource(docID, resource.json)
 			return resource
 
 
 	def deleteResource(self, resource: Resource) -> None:
-		with self.lockResources:
-			self.tabResources.remove(Query().ri == resource.ri)
+		with WriteRWLock(self.lockResources):
+			if (docID := self.riIndex.get(resource.ri)) is not None:
+				self._unindexResource(docID)
+				self.tabResources.remove(doc_ids=[docID])
 	
 
 	def searchResources(self, ri: str = None, csi: str = None, srn: str = None, pi: str = None, ty: int = None) -> List[dict]:
-
-		# find the ri first and then try again recursively
-		if srn is not None:
-			if len((identifiers := self.searchIdentifiers(srn=srn))) == 1:
-				return self.searchResources(ri=identifiers[0]['ri'])
-			return []
-
-		with self.lockResources:
+		with ReadRWLock(self.lockResources):
+			# resolve the srn and retrieve the resource in one step
+			if srn is not None:
+				if (ri := self.srnIndex.get(srn)) is None:
+					return []
 			if ri is not None:
-				return self.tabResources.search(Query().ri == ri)
+				return self._getDocuments(self.tabResources, [ docID ] if (docID := self.riIndex.get(ri)) is not None else [])
 			elif csi is not None:
-				return self.tabResources.search(Query().csi == csi)
+				return self._getDocuments(self.tabResources, [ self.riIndex[ri] ]) if (ri := self.csiIndex.get(csi)) in self.riIndex else []
+			# Multiple resources are ordered by their creation time, like in the other bindings
 			elif pi is not None and ty is not None:
-				return self.tabResources.search((Query().pi == pi) & (Query().ty == ty))
+				return self._byCreationTime(self._getDocuments(self.tabResources, self.piTyIndex.get((pi, ty), [])))
 			elif pi is not None:
-				return self.tabResources.search(Query().pi == pi)
+				return self._byCreationTime(self._getDocuments(self.tabResources, self.piIndex.get(pi, [])))
 			elif ty is not None:
-				return self.tabResources.search(Query().ty == ty)
+				return self._byCreationTime(self._search(self.tabResources, Query().ty == ty))
 			return []
 
 
+	def _byCreationTime(self, docs:List[Document]) -> List[Document]:
+		# Resources with the same creation time are ordered by their insertion
+		docs.sort(key=lambda doc: (doc.get('ct') or '', doc.doc_id))
+		return docs
+
+
 	def discoverResources(self, func: Callable) -> List[dict]:
-		with self.lockResources:
-			return self.tabResources.search(func)
+		with ReadRWLock(self.lockResources):
+			return self._search(self.tabResources, func)
 
 
-	def hasResource(self, ri: str = None, csi: str = None, srn: str = None, ty: int = None) -> bool:
+	def iterateResources(self, func: Callable) -> Iterator[dict]:
+		with ReadRWLock(self.lockResources):
+			docIDs = list(self._documents(self.tabResources))
+		for i in range(0, len(docIDs), self.cursorBatchSize):
+			# Documents that were removed since the scan started are skipped
+			with ReadRWLock(self.lockResources):
+				documents = self._documents(self.tabResources)
+				batch = [ Document(doc, int(docID)) for docID in docIDs[i:i+self.cursorBatchSize] if (doc := documents.get(docID)) is not None and func(doc) ]
+			yield from batch
 
-		# find the ri first and then try again recursively
-		if srn is not None:
-			if len((identifiers := self.searchIdentifiers(srn=srn))) == 1:
-				return self.hasResource(ri=identifiers[0]['ri'])
-		with self.lockResources:
-			if ri is not None:
-				return self.tabResources.contains(Query().ri == ri)
+
+	def hasResource(self, ri: str = None, csi: str = None, srn: str = None, ty: int = None) -> bool:
+		with ReadRWLock(self.lockResources):
+			if srn is not None:
+				return srn in self.srnIndex
+			elif ri is not None:
+				return ri in self.riIndex
 			elif csi is not None:
-				return self.tabResources.contains(Query().csi == csi)
+				return csi in self.csiIndex
 			elif ty is not None:
-				return self.tabResources.contains(Query().ty == ty)
+				return any(doc.get('ty') == ty for doc in self._documents(self.tabResources).values())
 			else:
 				return False
 
 
 	def countResources(self) -> int:
-		with self.lockResources:
+		with ReadRWLock(self.lockResources):
 			return len(self.tabResources)
 
 
@@ -509,9 +1569,9 @@ class TinyDBBinding(object):
 	def  searchByValueInField(self, field: str, value: Any) -> List[dict]:
 		"""Search and return all resources of a value in a field,
 		and return them in an array."""
-		with self.lockResources:
+		with ReadRWLock(self.lockResources):
 			#return self.tabResources.search(where(field).any(value))
-			return self.tabResources.search(where(field).test(lambda s: value in s))
+			return self._search(self.tabResources, where(field).test(lambda s: value in s))
 
 
 	#
@@ -519,26 +1579,15 @@ class TinyDBBinding(object):
 	#
 
 
-	def insertIdentifier(self, resource: Resource, ri: str, srn: str) -> None:
-		with self.lockIdentifiers:
-			self.tabIdentifiers.upsert(
-				# ri, rn, srn 
-				{'ri' : ri, 'rn' : resource.rn, 'srn' : srn, 'ty' : resource.ty}, 
-				Query().ri == ri)
-
-
-	def deleteIdentifier(self, resource: Resource) -> None:
-		with self.lockIdentifiers:
-			self.tabIdentifiers.remove(Query().ri == resource.ri)
-
-
 	def searchIdentifiers(self, ri: str = None, srn: str = None) -> List[dict]:
-		with self.lockIdentifiers:
+		with ReadRWLock(self.lockResources):
 			if srn is not None:
-				return self.tabIdentifiers.search(Query().srn == srn)
-			elif ri is not None:
-				return self.tabIdentifiers.search(Query().ri == ri) 
-			return []
+				if (ri := self.srnIndex.get(srn)) is None:
+					return []
+			if ri is None or (docID := self.riIndex.get(ri)) is None:
+				return []
+			doc = self._documents(self.tabResources)[str(docID)]
+			return [ _identifiers(ri, doc.get(Resource._srn), doc.get('ty')) ]
 
 
 	#
@@ -547,16 +1596,16 @@ class TinyDBBinding(object):
 
 
 	def searchSubscriptions(self, ri : str = None, pi : str = None) -> List[dict]:
-		with self.lockSubscriptions:
+		with ReadRWLock(self.lockSubscriptions):
 			if ri is not None:
-				return self.tabSubscriptions.search(Query().ri == ri)
+				return self._search(self.tabSubscriptions, Query().ri == ri)
 			if pi is not None:
-				return self.tabSubscriptions.search(Query().pi == pi)
-			return None
+				return self._search(self.tabSubscriptions, Query().pi == pi)
+			return self._search(self.tabSubscriptions, lambda doc: True)
 
 
 	def upsertSubscription(self, subscription : Resource) -> bool:
-		with self.lockSubscriptions:
+		with WriteRWLock(self.lockSubscriptions):
 			ri = subscription.ri
 			result = self.tabSubscriptions.upsert(
 									{	'ri'  : ri, 
@@ -575,7 +1624,7 @@ class TinyDBBinding(object):
 
 
 	def removeSubscription(self, subscription: Resource) -> bool:
-		with self.lockSubscriptions:
+		with WriteRWLock(self.lockSubscriptions):
 			return self.tabSubscriptions.remove(Query().ri == subscription.ri)
 
 
@@ -584,7 +1633,7 @@ class TinyDBBinding(object):
 	#
 
 	def addBatchNotification(self, ri:str, nu:str, notificationRequest:dict) -> bool:
-		with self.lockBatchNotifications:
+		with WriteRWLock(self.lockBatchNotifications):
 			result = self.tabBatchNotifications.insert(
 									{	'ri' 		: ri,
 										'nu' 		: nu,
@@ -595,34 +1644,34 @@ class TinyDBBinding(object):
 
 
 	def countBatchNotifications(self, ri:str, nu:str) -> int:
-		with self.lockBatchNotifications:
+		with ReadRWLock(self.lockBatchNotifications):
 			q = Query()
-			return self.tabBatchNotifications.count((q.ri == ri) & (q.nu == nu))
+			return len(self._search(self.tabBatchNotifications, (q.ri == ri) & (q.nu == nu)))
 
 
 	def getBatchNotifications(self, ri:str, nu:str) -> List[dict]:
-		with self.lockBatchNotifications:
+		with ReadRWLock(self.lockBatchNotifications):
 			q = Query()
-			return self.tabBatchNotifications.search((q.ri == ri) & (q.nu == nu))
+			return self._search(self.tabBatchNotifications, (q.ri == ri) & (q.nu == nu))
 
 
-	def removeBatchNotifications(self, ri:str, nu:str) -> List[dict]:
-		with self.lockBatchNotifications:
+	def removeBatchNotifications(self, ri:str, nu:str) -> bool:
+		with WriteRWLock(self.lockBatchNotifications):
 			q = Query()
-			return self.tabBatchNotifications.remove((q.ri == ri) & (q.nu == nu))
+			return len(self.tabBatchNotifications.remove((q.ri == ri) & (q.nu == nu))) > 0
 
 	#
 	#	Statistics
 	#
 
 	def searchStatistics(self) -> dict:
-		with self.lockStatistics:
+		with ReadRWLock(self.lockStatistics):
 			stats = self.tabStatistics.get(doc_id=1)
 			return stats if stats is not None and len(stats) > 0 else None
 
 
 	def upsertStatistics(self, stats: dict) -> bool:
-		with self.lockStatistics:
+		with WriteRWLock(self.lockStatistics):
 			if len(self.tabStatistics) > 0:
 				return self.tabStatistics.update(stats, doc_ids=[1]) is not None
 			else:
@@ -634,13 +1683,13 @@ class TinyDBBinding(object):
 	#
 
 	def searchAppData(self, id: str) -> dict:
-		with self.lockAppData:
+		with ReadRWLock(self.lockAppData):
 			data = self.tabAppData.get(Query().id == id)
 			return data if data is not None and len(data) > 0 else None
 
 
 	def upsertAppData(self, data: dict) -> bool:
-		with self.lockAppData:
+		with WriteRWLock(self.lockAppData):
 			if 'id' not in data:
 				return None
 			if len(self.tabAppData) > 0:
@@ -650,7 +1699,440 @@ class TinyDBBinding(object):
 
 
 	def removeAppData(self, data: dict) -> bool:
-		with self.lockAppData:
+		with WriteRWLock(self.lockAppData):
 			if 'id' not in data:
 				return None	
 			return self.tabAppData.remove(Query().id == data['id'])
+
+
+
+#########################################################################
+#
+#	DB class that implements the SQLite binding
+#
+#	All tables are stored in a single database file. The resources, 
+#	subscriptions etc are stored as JSON documents, and some of their
+#	attributes are additionally stored in indexed columns for fast lookups.
+
+
+class SQLiteBinding(StorageBinding):
+
+	def __init__(self, path:str=None) -> None:
+		self.path = path
+		self.filename:str = None		# None for in-memory databases
+		self.conn:sqlite3.Connection = None
+
+		# The connection is shared between threads. All access is serialized by this lock.
+		self.lockDB = RLock()
+
+		# With write-behind several changes are committed together in one transaction
+		self.writeBehind = Configuration.get('db.writeBehindInterval') > 0
+		self.writeBehindOperations = Configuration.get('db.writeBehindOperations')
+		self.pendingOperations = 0
+
+		# Number of open (nested) transactions. Changes are only committed outside of transactions.
+		self.transactions = 0
+		# Only the resources and subscriptions belong to transactions. The changes of the other
+		# tables while a transaction is open are repeated after the transaction is rolled back.
+		self.independentChanges:List[Tuple[str, tuple]] = []	# (sql, parameters)
+
+
+	def openDB(self, postfix:str) -> None:
+		if Configuration.get('db.inMemory'):
+			Logging.log('DB in memory')
+			self.conn = sqlite3.connect(':memory:', check_same_thread=False)
+		else:
+			Logging.log('DB in file system')
+			self.filename = '%s/cse%s.db' % (self.path, postfix)
+			self.conn = sqlite3.connect(self.filename, check_same_thread=False)
+			self.conn.execute('PRAGMA journal_mode=WAL')
+			self.conn.execute('PRAGMA synchronous=NORMAL')
+		with self.lockDB, self.conn:
+			self.conn.executescript('''
+				-- seq orders resources with the same ct by their insertion, also after a VACUUM
+				CREATE TABLE IF NOT EXISTS resources (seq INTEGER PRIMARY KEY, ri TEXT NOT NULL UNIQUE, pi TEXT, ty INTEGER, csi TEXT, srn TEXT, ct TEXT, doc TEXT NOT NULL);
+				CREATE TABLE IF NOT EXISTS subscriptions (ri TEXT PRIMARY KEY, pi TEXT, doc TEXT NOT NULL);
+				CREATE INDEX IF NOT EXISTS subscriptionsPi ON subscriptions (pi);
+				CREATE TABLE IF NOT EXISTS batchNotifications (id INTEGER PRIMARY KEY AUTOINCREMENT, ri TEXT, nu TEXT, doc TEXT NOT NULL);
+				CREATE INDEX IF NOT EXISTS batchNotificationsRiNu ON batchNotifications (ri, nu);
+				CREATE TABLE IF NOT EXISTS statistics (id INTEGER PRIMARY KEY, doc TEXT NOT NULL);
+				CREATE TABLE IF NOT EXISTS appdata (id TEXT PRIMARY KEY, doc TEXT NOT NULL);
+				CREATE INDEX IF NOT EXISTS resourcesPi ON resources (pi, ty);
+				CREATE INDEX IF NOT EXISTS resourcesPiCt ON resources (pi, ct);
+				CREATE INDEX IF NOT EXISTS resourcesTy ON resources (ty);
+				CREATE INDEX IF NOT EXISTS resourcesCsi ON resources (csi);
+				CREATE INDEX IF NOT EXISTS resourcesSrn ON resources (srn);
+			''')
+
+
+	def closeDB(self) -> None:
+		Logging.log('Closing DBs')
+		with self.lockDB:
+			self.conn.commit()
+			self.conn.close()
+
+
+	def flushDB(self) -> None:
+		with self.lockDB:
+			if self.transactions == 0:
+				self._commit()
+
+
+	def beginTransaction(self) -> None:
+		with self.lockDB:
+			self.transactions += 1
+			# A savepoint inside of an explicit transaction, so that releasing it doesn't
+			# commit buffered write-behind changes
+			if not self.conn.in_transaction:
+				self.conn.execute('BEGIN')
+			self.conn.execute('SAVEPOINT acmeTransaction')
+
+
+	def commitTransaction(self) -> None:
+		with self.lockDB:
+			self.transactions -= 1
+			self.conn.execute('RELEASE SAVEPOINT acmeTransaction')
+			if self.transactions == 0:
+				self.independentChanges.clear()
+			self._changed(0)
+
+
+	def rollbackTransaction(self) -> None:
+		with self.lockDB:
+			self.transactions -= 1
+			self.conn.execute('ROLLBACK TO SAVEPOINT acmeTransaction')
+			self.conn.execute('RELEASE SAVEPOINT acmeTransaction')
+			if self.transactions == 0:
+				for sql, parameters in self.independentChanges:
+					self.conn.execute(sql, parameters)
+				self.independentChanges.clear()
+			self._changed(0)
+
+
+	def _changed(self, operations:int=1) -> None:
+		"""	Count changes and commit them, unless they belong to an open transaction 
+			or are written behind. Must be called with the lock held.
+		"""
+		self.pendingOperations += operations
+		if self.transactions == 0 and (not self.writeBehind or self.pendingOperations >= self.writeBehindOperations):
+			self._commit()
+
+
+	def _commit(self) -> None:
+		# Also end a transaction without changes, which was started by beginTransaction()
+		if self.pendingOperations > 0 or self.conn.in_transaction:
+			self.conn.commit()
+			self.pendingOperations = 0
+
+
+	def purgeDB(self) -> None:
+		Logging.log('Purging DBs')
+		with self.lockDB, self.conn:
+			for table in [ 'resources', 'subscriptions', 'batchNotifications', 'statistics', 'appdata' ]:
+				self.conn.execute('DELETE FROM %s' % table)
+
+
+	#
+	#	Backup and restore
+	#
+
+	def copyDB(self) -> sqlite3.Connection:
+		with self.lockDB:
+			if self.transactions == 0:	# include buffered write-behind changes
+				self._commit()
+			# SQLite's online backup copies the database pages to an in-memory database
+			copy = sqlite3.connect(':memory:', check_same_thread=False)
+			self.conn.backup(copy)
+			return copy
+
+
+	def writeBackup(self, copy:sqlite3.Connection, filename:str) -> str:
+		filename += '.db'
+		tmpFile = filename + '.tmp'
+		if os.path.exists(tmpFile):
+			os.remove(tmpFile)
+		target = sqlite3.connect(tmpFile)
+		try:
+			copy.backup(target)
+		finally:
+			target.close()
+			copy.close()
+		os.replace(tmpFile, filename)
+		return filename
+
+
+	def restoreBackup(self, filename:str) -> None:
+		source = sqlite3.connect(filename)
+		try:
+			with self.lockDB:
+				source.backup(self.conn)
+		finally:
+			source.close()
+
+
+	#
+	#	Compaction
+	#
+
+	def compactDB(self, threshold:float) -> int:
+		"""	Deleted rows leave free pages in the database file, which are only reclaimed 
+			by VACUUM. The database is vacuumed when the ratio of free pages reaches 
+			*threshold*. The write-ahead log is truncated in any case.
+		"""
+		if self.filename is None:
+			return 0
+		with self.lockDB:
+			if self.transactions > 0:
+				return 0
+			self._commit()		# measure the files with the written-behind changes
+			size = self._filesSize()
+			pages = self.conn.execute('PRAGMA page_count').fetchone()[0]
+			freePages = self.conn.execute('PRAGMA freelist_count').fetchone()[0]
+			if pages > 0 and freePages / pages >= threshold:
+				Logging.logDebug('Vacuuming database: %s (%d of %d pages free)' % (self.filename, freePages, pages))
+				self.conn.execute('VACUUM')
+			self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+		return max(size - self._filesSize(), 0)
+
+
+	def _filesSize(self) -> int:
+		files = [ self.filename, self.filename + '-wal' ]
+		return sum(os.path.getsize(file) for file in files if os.path.exists(file))
+
+
+	def _query(self, sql:str, parameters:tuple=()) -> List[tuple]:
+		with self.lockDB:
+			return self.conn.execute(sql, parameters).fetchall()
+
+
+	def _queryDocs(self, sql:str, parameters:tuple=()) -> List[dict]:
+		return [ json.loads(row[0]) for row in self._query(sql, parameters) ]
+
+
+	def _execute(self, sql:str, parameters:tuple=(), independent:bool=False) -> int:
+		"""	Execute a modifying statement in its own transaction, or in the current 
+			transaction or write-behind transaction. Return the number of affected rows. 
+			*independent* statements change tables that don't belong to transactions.
+		"""
+		with self.lockDB:
+			rowcount = self.conn.execute(sql, parameters).rowcount
+			if independent and self.transactions > 0:
+				self.independentChanges.append((sql, parameters))
+			self._changed()
+			return rowcount
+
+
+	#
+	#	Resources
+	#
+
+
+	# Update an existing row in place. Unlike "INSERT OR REPLACE" this doesn't delete and
+	# re-insert the row, so its position in the table doesn't change.
+	upsertResourceSQL = '''INSERT INTO resources (ri, pi, ty, csi, srn, ct, doc) VALUES (?, ?, ?, ?, ?, ?, ?)
+						   ON CONFLICT(ri) DO UPDATE SET pi = excluded.pi, ty = excluded.ty, csi = excluded.csi, srn = excluded.srn, ct = excluded.ct, doc = excluded.doc'''
+
+
+	def _resourceRow(self, doc:dict) -> Tuple[Any, ...]:
+		return (doc.get('ri'), doc.get('pi'), doc.get('ty'), doc.get('csi'), doc.get(Resource._srn), doc.get('ct'), json.dumps(doc))
+
+
+	def insertResource(self, resource:Resource) -> None:
+		self._execute('INSERT INTO resources (ri, pi, ty, csi, srn, ct, doc) VALUES (?, ?, ?, ?, ?, ?, ?)', self._resourceRow(resource.json))
+
+
+	def upsertResource(self, resource:Resource) -> None:
+		self._execute(self.upsertResourceSQL, self._resourceRow(resource.json))
+
+
+	def updateResource(self, resource:Resource) -> Resource:
+		ri = resource.ri
+		with self.lockDB:
+			# Like TinyDB, merge the attributes into the stored document
+			doc = {}
+			if (row := self.conn.execute('SELECT doc FROM resources WHERE ri = ?', (ri,)).fetchone()) is not None:
+				doc = json.loads(row[0])
+			doc.update(resource.json)
+			# remove nullified fields from db and resource
+			for k in list(resource.json):
+				if resource.json[k] is None:
+					del doc[k]
+					del resource.json[k]
+			self.conn.execute(self.upsertResourceSQL, self._resourceRow(doc))
+			self._changed()
+		return resource
+
+
+	def deleteResource(self, resource:Resource) -> None:
+		self._execute('DELETE FROM resources WHERE ri = ?', (resource.ri,))
+
+
+	def searchResources(self, ri:str=None, csi:str=None, srn:str=None, pi:str=None, ty:int=None) -> List[dict]:
+		# Multiple resources are ordered by their creation time, so that the order doesn't 
+		# depend on the storage or changes of the resources
+		if srn is not None:
+			return self._queryDocs('SELECT doc FROM resources WHERE srn = ?', (srn,))
+		elif ri is not None:
+			return self._queryDocs('SELECT doc FROM resources WHERE ri = ?', (ri,))
+		elif csi is not None:
+			return self._queryDocs('SELECT doc FROM resources WHERE csi = ?', (csi,))
+		elif pi is not None and ty is not None:
+			return self._queryDocs('SELECT doc FROM resources WHERE pi = ? AND ty = ? ORDER BY ct, seq', (pi, ty))
+		elif pi is not None:
+			return self._queryDocs('SELECT doc FROM resources WHERE pi = ? ORDER BY ct, seq', (pi,))
+		elif ty is not None:
+			return self._queryDocs('SELECT doc FROM resources WHERE ty = ? ORDER BY ct, seq', (ty,))
+		return []
+
+
+	def discoverResources(self, func:Callable) -> List[dict]:
+		return [ doc for doc in self._queryDocs('SELECT doc FROM resources') if func(doc) ]
+
+
+	def iterateResources(self, func:Callable) -> Iterator[dict]:
+		# Page through the resources in the order of their insertion, like the other bindings.
+		# The sequence number doesn't change when a resource is updated.
+		seq = 0
+		while len(rows := self._query('SELECT seq, doc FROM resources WHERE seq > ? ORDER BY seq LIMIT ?', (seq, self.cursorBatchSize))) > 0:
+			seq = rows[-1][0]
+			for _, jsn in rows:
+				if func(doc := json.loads(jsn)):
+					yield doc
+
+
+	def hasResource(self, ri:str=None, csi:str=None, srn:str=None, ty:int=None) -> bool:
+		if srn is not None:
+			return len(self._query('SELECT 1 FROM resources WHERE srn = ? LIMIT 1', (srn,))) > 0
+		elif ri is not None:
+			return len(self._query('SELECT 1 FROM resources WHERE ri = ?', (ri,))) > 0
+		elif csi is not None:
+			return len(self._query('SELECT 1 FROM resources WHERE csi = ? LIMIT 1', (csi,))) > 0
+		elif ty is not None:
+			return len(self._query('SELECT 1 FROM resources WHERE ty = ? LIMIT 1', (ty,))) > 0
+		else:
+			return False
+
+
+	def countResources(self) -> int:
+		return self._query('SELECT COUNT(*) FROM resources')[0][0]
+
+
+	def searchByValueInField(self, field:str, value:Any) -> List[dict]:
+		"""Search and return all resources of a value in a field,
+		and return them in an array."""
+		# Pre-select the documents that contain the value somewhere, then check the field
+		docs = self._queryDocs('SELECT doc FROM resources WHERE instr(doc, ?) > 0', (json.dumps(value)[1:-1],))
+		return [ doc for doc in docs if field in doc and value in doc[field] ]
+
+
+	#
+	#	Identifiers
+	#
+
+
+	def searchIdentifiers(self, ri:str=None, srn:str=None) -> List[dict]:
+		if srn is not None:
+			rows = self._query('SELECT ri, srn, ty FROM resources WHERE srn = ?', (srn,))
+		elif ri is not None:
+			rows = self._query('SELECT ri, srn, ty FROM resources WHERE ri = ?', (ri,))
+		else:
+			return []
+		return [ _identifiers(*row) for row in rows ]
+
+
+	#
+	#	Subscriptions
+	#
+
+
+	def searchSubscriptions(self, ri:str=None, pi:str=None) -> List[dict]:
+		if ri is not None:
+			return self._queryDocs('SELECT doc FROM subscriptions WHERE ri = ?', (ri,))
+		if pi is not None:
+			return self._queryDocs('SELECT doc FROM subscriptions WHERE pi = ?', (pi,))
+		return self._queryDocs('SELECT doc FROM subscriptions')
+
+
+	def upsertSubscription(self, subscription:Resource) -> bool:
+		ri = subscription.ri
+		doc = {	'ri'  : ri, 
+				'pi'  : subscription.pi,
+				'nct' : subscription.nct,
+				'net' : subscription['enc/net'],
+				'atr' : subscription['enc/atr'],
+				'chty': subscription['enc/chty'],
+				'exc' : subscription.exc,
+				'ln'  : subscription.ln,
+				'nus' : subscription.nu,
+				'bn'  : subscription.bn
+			  }
+		return self._execute('INSERT OR REPLACE INTO subscriptions (ri, pi, doc) VALUES (?, ?, ?)', (ri, subscription.pi, json.dumps(doc))) > 0
+
+
+	def removeSubscription(self, subscription:Resource) -> bool:
+		return self._execute('DELETE FROM subscriptions WHERE ri = ?', (subscription.ri,)) > 0
+
+
+	#
+	#	BatchNotifications
+	#
+
+	def addBatchNotification(self, ri:str, nu:str, notificationRequest:dict) -> bool:
+		doc = {	'ri' 		: ri,
+				'nu' 		: nu,
+				'tstamp'	: time.time(),
+				'request'	: notificationRequest
+			  }
+		return self._execute('INSERT INTO batchNotifications (ri, nu, doc) VALUES (?, ?, ?)', (ri, nu, json.dumps(doc)), independent=True) > 0
+
+
+	def countBatchNotifications(self, ri:str, nu:str) -> int:
+		return self._query('SELECT COUNT(*) FROM batchNotifications WHERE ri = ? AND nu = ?', (ri, nu))[0][0]
+
+
+	def getBatchNotifications(self, ri:str, nu:str) -> List[dict]:
+		return self._queryDocs('SELECT doc FROM batchNotifications WHERE ri = ? AND nu = ? ORDER BY id', (ri, nu))
+
+
+	def removeBatchNotifications(self, ri:str, nu:str) -> bool:
+		return self._execute('DELETE FROM batchNotifications WHERE ri = ? AND nu = ?', (ri, nu), independent=True) > 0
+
+
+	#
+	#	Statistics
+	#
+
+	def searchStatistics(self) -> dict:
+		stats = self._queryDocs('SELECT doc FROM statistics WHERE id = 1')
+		return stats[0] if len(stats) == 1 and len(stats[0]) > 0 else None
+
+
+	def upsertStatistics(self, stats:dict) -> bool:
+		with self.lockDB:
+			# Like TinyDB, merge the statistics into an existing record
+			doc = {}
+			if (row := self.conn.execute('SELECT doc FROM statistics WHERE id = 1').fetchone()) is not None:
+				doc = json.loads(row[0])
+			doc.update(stats)
+			return self._execute('INSERT OR REPLACE INTO statistics (id, doc) VALUES (1, ?)', (json.dumps(doc),), independent=True) > 0
+
+
+	#
+	#	App Data
+	#
+
+	def searchAppData(self, id:str) -> dict:
+		data = self._queryDocs('SELECT doc FROM appdata WHERE id = ?', (id,))
+		return data[0] if len(data) == 1 and len(data[0]) > 0 else None
+
+
+	def upsertAppData(self, data:dict) -> bool:
+		if 'id' not in data:
+			return None
+		return self._execute('INSERT OR REPLACE INTO appdata (id, doc) VALUES (?, ?)', (data['id'], json.dumps(data)), independent=True) > 0
+
+
+	def removeAppData(self, data:dict) -> bool:
+		if 'id' not in data:
+			return None
+		return self._execute('DELETE FROM appdata WHERE id = ?', (data['id'],), independent=True) > 0
@@ -10,7 +10,7 @@
 from __future__ import annotations
 import json
 from dataclasses import dataclass, field
-from typing import Any, List
+from typing import Any, List, Set
 from enum import IntEnum, Enum, auto
 from flask import Request
 
@@ -558,6 +558,16 @@ class Result:
 		return r
 
 
+@dataclass
+class DiscoveryPlan:
+	"""	The strategy to discover the resources below a target resource. """
+	strategy 			: str 			= 'walk'	# walk: walk the resource tree, parallel: walk large subtrees in parallel, index: check the candidates from the indexes
+	candidates 			: Set[str]		= None		# resourceIDs of the candidates, if the indexes can be used
+
+	def __str__(self) -> str:
+		return self.strategy if self.candidates is None else '%s (candidates: %d)' % (self.strategy, len(self.candidates))
+
+
 ##############################################################################
 #
 #	Requests
@@ -8,9 +8,9 @@
 #	modules and entities of the CSE.
 #
 
-import datetime, json, random, string, sys, re, threading, traceback, time
+import copy, datetime, json, random, string, sys, re, threading, traceback, time
 import isodate
-from typing import Any, List, Tuple, Union, Dict
+from typing import Any, List, Tuple, Type, Union, Dict
 from resources import ACP, ACPAnnc, AE, AEAnnc, ANDI, ANDIAnnc, ANI, ANIAnnc, BAT, BATAnnc
 from resources import CIN, CINAnnc, CNT, CNTAnnc, CNT_LA, CNT_OL, CSEBase, CSR, CSRAnnc
 from resources import DVC, DVCAnnc,DVI, DVIAnnc, EVL, EVLAnnc, FCI, FCIAnnc, FCNT, FCNTAnnc, FCNT_LA, FCNT_OL
@@ -409,6 +409,50 @@ def resourceFromJSON(jsn:dict, pi:str=None, acpi:str=None, ty:Union[T, int]=None
 	return Result(resource=Unknown.Unknown(jsn, root, pi=pi, create=create))	# Capture-All resource
 
 
+# Instance attributes of the resources, besides the document, per (ty, resource type specifier)
+_documentTemplates:Dict[Tuple[int, str], Tuple[Type[Resource.Resource], dict]] = {}
+_documentAttributes = [ 'json', '_originalJson', 'isImported' ]
+
+def resourceFromDocument(jsn:dict) -> Result:
+	"""	Create a resource from a complete document that was read from the database.
+		The resource takes over the document, so the caller must not use it afterwards.
+		Unlike resourceFromJSON() the document is neither copied nor initialized with
+		default values again, and the structured path isn't determined again. The 
+		other instance attributes are the same for all resources of a class, and
+		are copied from the first resource of that class.
+
+		Nested dicts and lists of the document are copied, because they are still
+		shared with the database, and changing them in place would change the stored
+		document without an update.
+	"""
+	if (root := jsn.get(Resource.Resource._rtype)) is None or Resource.Resource._srn not in jsn:	# not a stored resource
+		return resourceFromJSON(jsn)
+	for k, v in jsn.items():
+		if isinstance(v, (dict, list)):
+			jsn[k] = _copyValue(v)
+	if (template := _documentTemplates.get((key := (jsn.get('ty'), root)))) is None:
+		if (res := resourceFromJSON(jsn)).resource is not None:
+			_documentTemplates[key] = (res.resource.__class__, { k : v for k, v in res.resource.__dict__.items() if k not in _documentAttributes })
+		return res
+
+	cls, attributes = template
+	resource = cls.__new__(cls)
+	resource.__dict__.update({ k : v if k in cls.sharedAttributes or not isinstance(v, (dict, list)) else copy.copy(v) for k, v in attributes.items() })
+	resource.json = jsn
+	resource._originalJson = jsn.copy()
+	resource.isImported = jsn.get(C.jsnIsImported)
+	return Result(resource=resource)
+
+
+def _copyValue(value:Any) -> Any:
+	"""	Copy nested dicts and lists. None values are removed from dicts. """
+	if isinstance(value, dict):
+		return { k : _copyValue(v) for k, v in value.items() if v is not None }
+	if isinstance(value, list):
+		return [ _copyValue(v) for v in value ]
+	return value
+
+
 excludeFromRoot = [ 'pi' ]
 def pureResource(jsn: dict) -> Tuple[dict, str]:
 	""" Return the "pure" json without the "m2m:xxx" or "<domain>:id" resource specifier."""
@@ -0,0 +1,175 @@
+#
+#	Codecs.py
+#
+#	(c) 2020 by Andreas Kraft
+#	License: BSD 3-Clause License. See the LICENSE file for further details.
+#
+#	Codecs for the database files. Besides JSON the databases can be stored in the
+#	compact binary formats MessagePack and CBOR, optionally compressed with zlib.
+#	The binary formats require the optional packages *msgpack* resp. *cbor2*.
+#
+
+from __future__ import annotations
+import gc, json, os, zlib
+from typing import Any, BinaryIO, Callable
+from tinydb.storages import Storage				# type: ignore
+
+
+formats = [ 'json', 'msgpack', 'cbor' ]
+compressions = [ 'none', 'zlib' ]
+_packages = { 'json' : 'json', 'msgpack' : 'msgpack', 'cbor' : 'cbor2' }
+
+
+def isAvailable(format:str) -> bool:
+	"""	Check whether the package that is needed for a format is installed. """
+	try:
+		__import__(_packages[format])
+		return True
+	except ImportError:
+		return False
+
+
+def packageFor(format:str) -> str:
+	return _packages[format]
+
+
+class Codec(object):
+	"""	Encode and decode data for a database file. The file extension reflects
+		the format and the compression, e.g. *.msgpack.z*.
+	"""
+
+	def __init__(self, format:str='json', compression:str='none') -> None:
+		self.format = format
+		self.compression = compression
+		self.extension = '.%s%s' % (format, '.z' if compression == 'zlib' else '')
+		self._encode:Callable[[Any], bytes]
+		self._decode:Callable[[bytes], Any]
+		if format == 'msgpack':
+			import msgpack
+			self._encode = lambda data: msgpack.packb(data, use_bin_type=True)
+			self._decode = lambda data: msgpack.unpackb(data, raw=False, strict_map_key=False)
+		elif format == 'cbor':
+			import cbor2
+			self._encode = cbor2.dumps
+			self._decode = cbor2.loads
+		else:
+			self._encode = lambda data: json.dumps(data, separators=(',', ':')).encode('utf-8')
+			self._decode = json.loads
+
+
+	def __str__(self) -> str:
+		return '%s (compression: %s)' % (self.format, self.compression)
+
+
+	def encode(self, data:Any) -> bytes:
+		data = self._encode(data)
+		# Level 1 is much faster than the default and only slightly larger
+		return zlib.compress(data, 1) if self.compression == 'zlib' else data
+
+
+	def decode(self, data:bytes) -> Any:
+		return self._decode(zlib.decompress(data) if self.compression == 'zlib' else data)
+
+
+	def read(self, filename:str) -> Any:
+		"""	Read and decode a file. Return None if the file doesn't exist or is empty. """
+		if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+			return None
+		with open(filename, 'rb') as file:
+			data = file.read()
+		# Decoding creates a lot of objects, but no reference cycles. Pause the garbage
+		# collector, which would otherwise run many times while decoding large files.
+		gcEnabled = gc.isenabled()
+		gc.disable()
+		try:
+			return self.decode(data)
+		finally:
+			if gcEnabled:
+				gc.enable()
+
+
+	def write(self, filename:str, data:Any) -> None:
+		"""	Encode and write data to a file. The file is replaced atomically, so that
+			it is never left in a partially written state.
+		"""
+		tmpFile = filename + '.tmp'
+		with open(tmpFile, 'wb') as file:
+			file.write(self.encode(data))
+			file.flush()
+			os.fsync(file.fileno())
+		os.replace(tmpFile, filename)
+
+
+def migrate(basename:str, codec:Codec) -> str:
+	"""	Convert an existing database file in a different format or compression to
+		the file *basename* + the codec's extension, unless that file already exists.
+		The converted file is removed. Return the name of the converted file, or None.
+	"""
+	filename = basename + codec.extension
+	if os.path.exists(filename):
+		return None
+	for format in formats:
+		for compression in compressions:
+			if (oldCodec := _codecFor(format, compression)) is None or oldCodec.extension == codec.extension:
+				continue
+			oldFilename = basename + oldCodec.extension
+			if not os.path.exists(oldFilename):
+				continue
+			if (data := oldCodec.read(oldFilename)) is not None:
+				codec.write(filename, data)
+			os.remove(oldFilename)
+			return oldFilename
+	return None
+
+
+def codecForFile(filename:str) -> Codec:
+	"""	Return the codec for a file with one of the codecs' extensions, or None. """
+	for format in formats:
+		for compression in compressions:
+			if (codec := _codecFor(format, compression)) is not None and filename.endswith(codec.extension):
+				return codec
+	return None
+
+
+def _codecFor(format:str, compression:str) -> Codec:
+	return Codec(format, compression) if isAvailable(format) else None
+
+
+class CodecStorage(Storage):
+	"""	TinyDB storage that reads and writes a file with a codec. Use it instead of
+		TinyDB's *JSONStorage*.
+
+		With *sync* every write replaces the file atomically and synchronizes it to the
+		disk. Otherwise, like *JSONStorage*, the file is kept open and overwritten in
+		place, and it is only synchronized to the disk when the storage is closed.
+	"""
+
+	def __init__(self, path:str, codec:Codec=None, sync:bool=False, **kwargs:Any) -> None:
+		super().__init__()
+		self.path = path
+		self.codec = codec if codec is not None else Codec()
+		self.sync = sync
+		self.file:BinaryIO = None
+
+
+	def read(self) -> Any:
+		return self.codec.read(self.path)
+
+
+	def write(self, data:Any) -> None:
+		if self.sync:
+			self.codec.write(self.path, data)
+			return
+		if self.file is None:
+			self.file = open(self.path, 'r+b' if os.path.exists(self.path) else 'w+b')
+		self.file.seek(0)
+		self.file.write(self.codec.encode(data))
+		self.file.truncate()
+		self.file.flush()
+
+
+	def close(self) -> None:
+		if self.file is not None:
+			os.fsync(self.file.fileno())
+			self.file.close()
+			self.file = None
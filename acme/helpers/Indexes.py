@@ -0,0 +1,462 @@
+#
+#	Indexes.py
+#
+#	(c) 2020 by Andreas Kraft
+#	License: BSD 3-Clause License. See the LICENSE file for further details.
+#
+#	In-memory index structures that are maintained alongside the database.
+#	All indexes are thread-safe.
+#
+
+from __future__ import annotations
+import bisect, random
+from threading import Lock
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+
+
+class SortedIndex(object):
+	"""	An index that maps keys to ordered values, e.g. resourceIDs to timestamps, 
+		and that efficiently returns the keys within a range of values.
+		Adding and removing a key takes O(log n).
+	"""
+
+	def __init__(self) -> None:
+		self.entries = _SkipList()			# ordered (value, key)
+		self.values:Dict[Any, Any] = {}		# key -> current value
+		self.lock = Lock()
+
+
+	def __len__(self) -> int:
+		return len(self.values)
+
+
+	def put(self, key:Any, value:Any) -> None:
+		"""	Add or replace the value for a key. A value of *None* removes the key. """
+		with self.lock:
+			if (oldValue := self.values.get(key)) == value:
+				return
+			if oldValue is not None:
+				self.entries.remove((oldValue, key))
+				del self.values[key]
+			if value is None:
+				return
+			self.values[key] = value
+			self.entries.insert((value, key))
+
+
+	def remove(self, key:Any) -> None:
+		self.put(key, None)
+
+
+	def clear(self) -> None:
+		with self.lock:
+			self.entries.clear()
+			self.values.clear()
+
+
+	def get(self, key:Any) -> Any:
+		"""	Return the value of a key, or None. """
+		with self.lock:
+			return self.values.get(key)
+
+
+	def range(self, after:Any=None, before:Any=None) -> List[Any]:
+		"""	Return the keys with a value greater than *after* and lower than *before*,
+			ordered by their values. Missing limits are not checked.
+		"""
+		with self.lock:
+			# (value, max) sorts after all (value, key), and (value, ) before them
+			result = []
+			for value, key in self.entries.iterate((after, _Max) if after is not None else None):
+				if before is not None and value >= before:
+					break
+				result.append(key)
+			return result
+
+
+class _SkipListNode(object):
+	__slots__ = ( 'entry', 'next' )
+
+	def __init__(self, entry:Any, level:int) -> None:
+		self.entry = entry
+		self.next:List[Optional[_SkipListNode]] = [ None ] * level
+
+
+class _SkipList(object):
+	"""	An ordered collection of unique entries. Inserting, removing and finding an 
+		entry takes O(log n) on average, because each node is linked on a random 
+		number of levels and the higher levels skip over most of the lower ones.
+	"""
+
+	maxLevel = 32
+
+	def __init__(self) -> None:
+		self.head = _SkipListNode(None, self.maxLevel)
+		self.level = 1		# number of levels in use
+		self.length = 0
+
+
+	def __len__(self) -> int:
+		return self.length
+
+
+	def insert(self, entry:Any) -> None:
+		previous = self._previous(entry)
+		level = 1
+		while level < self.maxLevel and random.random() < 0.25:
+			level += 1
+		self.level = max(self.level, level)
+		node = _SkipListNode(entry, level)
+		for i in range(level):
+			node.next[i] = previous[i].next[i]
+			previous[i].next[i] = node
+		self.length += 1
+
+
+	def remove(self, entry:Any) -> bool:
+		"""	Remove an entry. Return False if it is not in the list. """
+		previous = self._previous(entry)
+		if (node := previous[0].next[0]) is None or node.entry != entry:
+			return False
+		for i in range(len(node.next)):
+			previous[i].next[i] = node.next[i]
+		while self.level > 1 and self.head.next[self.level - 1] is None:
+			self.level -= 1
+		self.length -= 1
+		return True
+
+
+	def clear(self) -> None:
+		self.head.next = [ None ] * self.maxLevel
+		self.level = 1
+		self.length = 0
+
+
+	def iterate(self, start:Any=None) -> Iterator[Any]:
+		"""	Iterate over the entries in order, beginning with the first entry that is 
+			not lower than *start*, or with the first entry if *start* is None.
+		"""
+		node = self._previous(start)[0].next[0] if start is not None else self.head.next[0]
+		while node is not None:
+			yield node.entry
+			node = node.next[0]
+
+
+	def _previous(self, entry:Any) -> List[_SkipListNode]:
+		"""	Return, for each level, the last node with an entry lower than *entry*. """
+		previous = [ self.head ] * self.maxLevel
+		node = self.head
+		for i in range(self.level - 1, -1, -1):
+			while (nextNode := node.next[i]) is not None and nextNode.entry < entry:
+				node = nextNode
+			previous[i] = node
+		return previous
+
+
+class _MaxType(object):
+	"""	A value that is greater than any other value. """
+
+	def __lt__(self, other:Any) -> bool:
+		return False
+
+	def __gt__(self, other:Any) -> bool:
+		return True
+
+	def __eq__(self, other:Any) -> bool:
+		return isinstance(other, _MaxType)
+
+_Max = _MaxType()
+
+
+class ReverseIndex(object):
+	"""	An index that maps each value of a multi-valued attribute back to the keys 
+		that contain it, e.g. an acpi entry to the resources that reference it.
+	"""
+
+	def __init__(self) -> None:
+		self.forward:Dict[Any, FrozenSet[Any]] = {}	# key -> values
+		self.reverse:Dict[Any, Set[Any]] = {}		# value -> keys
+		self.lock = Lock()
+
+
+	def __len__(self) -> int:
+		return len(self.forward)
+
+
+	def put(self, key:Any, values:Iterable[Any]) -> None:
+		"""	Add or replace the values for a key. *None* or an empty list removes the key. 
+			The values are copied.
+		"""
+		newValues = frozenset(values) if values is not None else frozenset()
+		with self.lock:
+			oldValues = self.forward.get(key, frozenset())
+			if newValues == oldValues:
+				return
+			for value in oldValues - newValues:
+				self._discard(value, key)
+			for value in newValues - oldValues:
+				self.reverse.setdefault(value, set()).add(key)
+			if len(newValues) > 0:
+				self.forward[key] = newValues
+			else:
+				self.forward.pop(key, None)
+
+
+	def remove(self, key:Any) -> None:
+		self.put(key, None)
+
+
+	def clear(self) -> None:
+		with self.lock:
+			self.forward.clear()
+			self.reverse.clear()
+
+
+	def get(self, value:Any) -> List[Any]:
+		"""	Return the keys that contain *value*. """
+		with self.lock:
+			return list(self.reverse.get(value, []))
+
+
+	def count(self, value:Any) -> int:
+		"""	Return the number of keys that contain *value*. """
+		with self.lock:
+			return len(self.reverse.get(value, []))
+
+
+	def counts(self) -> Dict[Any, int]:
+		"""	Return the number of keys for each value. """
+		with self.lock:
+			return { value : len(keys) for value, keys in self.reverse.items() }
+
+
+	def _discard(self, value:Any, key:Any) -> None:
+		if (keys := self.reverse.get(value)) is not None:
+			keys.discard(key)
+			if len(keys) == 0:
+				del self.reverse[value]
+
+
+class CountIndex(object):
+	"""	An index that maps keys to a single value, e.g. resourceIDs to the resourceIDs 
+		of their parents, and that counts the keys for each value.
+	"""
+
+	def __init__(self) -> None:
+		self.values:Dict[Any, Any] = {}	# key -> value
+		self.counts:Dict[Any, int] = {}	# value -> number of keys
+		self.lock = Lock()
+
+
+	def __len__(self) -> int:
+		return len(self.values)
+
+
+	def put(self, key:Any, value:Any) -> None:
+		"""	Add or replace the value for a key. A value of *None* removes the key. """
+		with self.lock:
+			self._put(key, value)
+
+
+	def remove(self, key:Any) -> None:
+		self.put(key, None)
+
+
+	def clear(self) -> None:
+		with self.lock:
+			self.values.clear()
+			self.counts.clear()
+
+
+	def get(self, key:Any) -> Any:
+		"""	Return the value of a key, or None. """
+		with self.lock:
+			return self.values.get(key)
+
+
+	def count(self, value:Any) -> int:
+		"""	Return the number of keys with *value*. """
+		with self.lock:
+			return self.counts.get(value, 0)
+
+
+	def _put(self, key:Any, value:Any) -> None:
+		if (oldValue := self.values.get(key)) == value:
+			return
+		if oldValue is not None:
+			if (count := self.counts[oldValue] - 1) > 0:
+				self.counts[oldValue] = count
+			else:
+				del self.counts[oldValue]
+		if value is None:
+			del self.values[key]
+			return
+		self.values[key] = value
+		self.counts[value] = self.counts.get(value, 0) + 1
+
+
+class TreeIndex(CountIndex):
+	"""	A CountIndex for the nodes of a tree, e.g. resourceIDs and the resourceIDs of 
+		their parents. In addition to the children it counts all descendants of each
+		node. The nodes may be added in any order, e.g. children before their parents.
+	"""
+
+	def __init__(self) -> None:
+		super().__init__()
+		self.descendants:Dict[Any, int] = {}	# node -> number of descendants
+
+
+	def clear(self) -> None:
+		super().clear()
+		with self.lock:
+			self.descendants.clear()
+
+
+	def descendantCount(self, key:Any) -> int:
+		"""	Return the number of all descendants of *key*. """
+		with self.lock:
+			return self.descendants.get(key, 0)
+
+
+	def _put(self, key:Any, value:Any) -> None:
+		if (oldValue := self.values.get(key)) == value:
+			return
+		size = 1 + self.descendants.get(key, 0)		# the node and its subtree move together
+		if oldValue is not None:
+			self._addDescendants(oldValue, -size)
+		super()._put(key, value)
+		if value is not None:
+			self._addDescendants(value, size)
+
+
+	def _addDescendants(self, node:Any, delta:int) -> None:
+		"""	Add *delta* to the descendants of *node* and of all its known ancestors. """
+		while node is not None:
+			if (count := self.descendants.get(node, 0) + delta) > 0:
+				self.descendants[node] = count
+			else:
+				self.descendants.pop(node, None)
+			node = self.values.get(node)
+
+
+class SeriesIndex(object):
+	"""	An index that keeps several series of keys ordered by a value, e.g. the 
+		contentInstances of each container ordered by their creation time. Entries
+		with the same value stay in the order in which they were added. The first 
+		and last entries of a series, as well as its count and total size, are 
+		available in constant time, and removing the first entries is cheap.
+	"""
+
+	def __init__(self) -> None:
+		self.series:Dict[Any, _Series] = {}		# series -> _Series
+		self.keys:Dict[Any, Tuple[Any, Tuple[Any, int, Any], int]] = {}	# key -> (series, entry, size)
+		self.sequence = 0							# Orders entries with the same value
+		self.lock = Lock()
+
+
+	def __len__(self) -> int:
+		return len(self.keys)
+
+
+	def put(self, series:Any, key:Any, value:Any, size:int=0) -> None:
+		"""	Add or replace a key in a series. *size* is added to the total size of the series. """
+		with self.lock:
+			if (old := self.keys.get(key)) is not None:
+				if old[0] == series and old[1][0] == value:	# same position, only update the size
+					s = self.series[series]
+					s.size += size - old[2]
+					self.keys[key] = (series, old[1], size)
+					return
+				self._remove(key)
+			self.sequence += 1
+			entry = (value, self.sequence, key)
+			self.series.setdefault(series, _Series()).add(entry, size)
+			self.keys[key] = (series, entry, size)
+
+
+	def remove(self, key:Any) -> None:
+		with self.lock:
+			self._remove(key)
+
+
+	def clear(self) -> None:
+		with self.lock:
+			self.series.clear()
+			self.keys.clear()
+
+
+	def first(self, series:Any) -> Any:
+		"""	Return the key with the lowest value of a series, or None. """
+		with self.lock:
+			return s.entries[s.start][2] if (s := self.series.get(series)) is not None else None
+
+
+	def last(self, series:Any) -> Any:
+		"""	Return the key with the highest value of a series, or None. """
+		with self.lock:
+			return s.entries[-1][2] if (s := self.series.get(series)) is not None else None
+
+
+	def count(self, series:Any) -> Tuple[int, int]:
+		"""	Return the number of keys and their total size of a series. """
+		with self.lock:
+			return (len(s), s.size) if (s := self.series.get(series)) is not None else (0, 0)
+
+
+	def range(self, series:Any, after:Any=None, before:Any=None) -> List[Any]:
+		"""	Return the keys of a series with a value greater than *after* and lower than 
+			*before*, ordered by their values. Missing limits are not checked.
+		"""
+		with self.lock:
+			if (s := self.series.get(series)) is None:
+				return []
+			start = bisect.bisect_right(s.entries, (after, _Max), lo=s.start) if after is not None else s.start
+			end = bisect.bisect_left(s.entries, (before, ), lo=s.start) if before is not None else len(s.entries)
+			return [ key for _, _, key in s.entries[start:end] ]
+
+
+	def _remove(self, key:Any) -> None:
+		if (old := self.keys.pop(key, None)) is None:
+			return
+		series, entry, size = old
+		s = self.series[series]
+		s.remove(entry, size)
+		if len(s) == 0:
+			del self.series[series]
+
+
+class _Series(object):
+	"""	The ordered entries of a single series. Entries before *start* were removed
+		from the head of the series and are discarded when they take up too much space.
+	"""
+
+	def __init__(self) -> None:
+		self.entries:List[Tuple[Any, int, Any]] = []	# sorted list of (value, sequence, key)
+		self.start = 0
+		self.size = 0
+
+
+	def __len__(self) -> int:
+		return len(self.entries) - self.start
+
+
+	def add(self, entry:Tuple[Any, int, Any], size:int) -> None:
+		if len(self) == 0 or entry >= self.entries[-1]:	# usually new entries are the latest ones
+			self.entries.append(entry)
+		else:
+			bisect.insort(self.entries, entry, lo=self.start)
+		self.size += size
+
+
+	def remove(self, entry:Tuple[Any, int, Any], size:int) -> None:
+		i = bisect.bisect_left(self.entries, entry, lo=self.start)
+		if i >= len(self.entries) or self.entries[i] != entry:
+			return
+		if i == self.start:		# removing the oldest entry only moves the start
+			self.start += 1
+			if self.start > 32 and self.start * 2 > len(self.entries):
+				del self.entries[:self.start]
+				self.start = 0
+		else:
+			del self.entries[i]
+		self.size -= size
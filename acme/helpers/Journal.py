@@ -0,0 +1,223 @@
+#
+#	Journal.py
+#
+#	(c) 2020 by Andreas Kraft
+#	License: BSD 3-Clause License. See the LICENSE file for further details.
+#
+#	This module implements an append-only journal with snapshots for TinyDB
+#	databases that are held in memory. Every change to a document is appended
+#	as a single line to the journal file. The journal is regularly compacted
+#	into a snapshot file, which has the same format as a TinyDB database file.
+#	Optionally, changes are buffered and only the last change of each document
+#	is written when the buffer is flushed. Several changes that are written 
+#	together, e.g. the changes of a transaction, are written as a single line,
+#	so that they are either replayed completely or not at all.
+#
+
+from __future__ import annotations
+from Logging import Logging
+import json, os
+from threading import Lock
+from typing import Any, Dict, List, Mapping, TextIO, Tuple
+from tinydb.storages import Storage				# type: ignore
+from helpers.Codecs import Codec
+from helpers.UndoLog import UndoTable
+
+
+class Journal(object):
+
+	def __init__(self, snapshotFile:str, journalFile:str, bufferSize:int=1, codec:Codec=None) -> None:
+		self.snapshotFile = snapshotFile
+		self.codec = codec if codec is not None else Codec()	# Codec for the snapshot file
+		self.journalFile = journalFile
+		self.bufferSize = bufferSize
+		self.file:TextIO = None
+		self.entries = 0				# Number of entries since the last snapshot
+		self.pending:Dict[Tuple[str, int], str] = {}	# Buffered journal entries, one per document
+		self.transactions = 0			# Number of open (nested) transactions
+		self.lock = Lock()
+
+
+	def load(self) -> Dict[str, Dict[str, dict]]:
+		"""	Load the last snapshot and replay the journal on top of it. Return the
+			tables in the TinyDB storage format.
+		"""
+		tables:Dict[str, Dict[str, dict]] = self.codec.read(self.snapshotFile) or {}
+
+		replayed = 0
+		if os.path.exists(self.journalFile):
+			with open(self.journalFile, 'r') as file:
+				for line in file:
+					try:
+						entry = json.loads(line)
+					except json.JSONDecodeError:
+						# Only the last line might be incomplete, e.g. after a crash
+						Logging.logWarn('Ignoring incomplete journal entry in: %s' % self.journalFile)
+						break
+					for change in entry.get('x', [ entry ]):
+						table = tables.setdefault(change['t'], {})
+						if change.get('truncate'):
+							table.clear()
+						elif 'd' in change:
+							table[str(change['id'])] = change['d']
+						else:
+							table.pop(str(change['id']), None)
+						replayed += 1
+		if replayed > 0:
+			Logging.log('Replayed %d journal entries from: %s' % (replayed, self.journalFile))
+		return tables
+
+
+	def open(self) -> None:
+		with self.lock:
+			if self.file is None:
+				self.file = open(self.journalFile, 'a')
+
+
+	def close(self) -> None:
+		with self.lock:
+			if self.file is not None:
+				self._flushPending()
+				self.file.close()
+				self.file = None
+
+
+	def flush(self) -> None:
+		with self.lock:
+			if self.transactions == 0:	# changes of an open transaction are written when it is committed
+				self._flushPending()
+
+
+	def begin(self) -> None:
+		"""	Start a transaction. All changes are buffered until the transaction is committed. """
+		with self.lock:
+			self.transactions += 1
+
+
+	def commit(self) -> None:
+		with self.lock:
+			self.transactions -= 1
+			if self.transactions == 0 and len(self.pending) >= self.bufferSize:
+				self._flushPending()
+
+
+	def append(self, table:str, docID:int, doc:Mapping=None) -> None:
+		"""	Append a changed document to the journal. A missing `doc` marks the removal
+			of the document.
+		"""
+		entry:Dict[str, Any] = { 't' : table, 'id' : docID }
+		if doc is not None:
+			entry['d'] = doc
+		self._write((table, docID), entry)
+
+
+	def appendTruncate(self, table:str) -> None:
+		with self.lock:
+			# Buffered changes of the table are obsolete now
+			for key in [ key for key in self.pending if key[0] == table ]:
+				del self.pending[key]
+		self._write((table, None), { 't' : table, 'truncate' : True })
+
+
+	def _write(self, key:Tuple[str, int], entry:dict) -> None:
+		line = json.dumps(entry)
+		with self.lock:
+			if self.file is None:
+				return
+			self.entries += 1
+			if self.bufferSize <= 1 and self.transactions == 0:
+				self.file.write(line + '\n')
+				self.file.flush()
+				return
+			# Replace an older buffered change of the same document
+			self.pending.pop(key, None)
+			self.pending[key] = line
+			if self.transactions == 0 and len(self.pending) >= self.bufferSize:
+				self._flushPending()
+
+
+	def _flushPending(self) -> None:
+		if len(self.pending) == 0 or self.file is None:
+			return
+		lines = list(self.pending.values())
+		self.file.write((lines[0] if len(lines) == 1 else '{"x": [%s]}' % ', '.join(lines)) + '\n')
+		self.file.flush()
+		self.pending.clear()
+
+
+	def snapshot(self, tables:Dict[str, Dict[str, dict]]) -> None:
+		"""	Write the tables to a new snapshot and start a new, empty journal. The caller
+			must make sure that the tables are not modified in the meantime.
+		"""
+		with self.lock:
+			if self.transactions > 0:	# don't persist the changes of an open transaction
+				return
+			self.codec.write(self.snapshotFile, tables)	# atomic replacement of the old snapshot
+			self.pending.clear()					# buffered changes are part of the snapshot
+			# Truncate the journal
+			isOpen = self.file is not None
+			if isOpen:
+				self.file.close()
+			self.file = open(self.journalFile, 'w')
+			if not isOpen:
+				self.file.close()
+				self.file = None
+			self.entries = 0
+
+
+class JournaledTable(UndoTable):
+	"""	TinyDB table that appends all changes of its documents to a journal.
+	"""
+
+	def __init__(self, storage:Storage, name:str, journal:Journal=None, **kwargs:Any) -> None:
+		super().__init__(storage, name, **kwargs)
+		self.journal = journal
+
+
+	def insert(self, document:Mapping) -> int:
+		docID = super().insert(document)
+		self._journalDocuments([docID])
+		return docID
+
+
+	def insert_multiple(self, documents:List[Mapping]) -> List[int]:
+		docIDs = super().insert_multiple(documents)
+		self._journalDocuments(docIDs)
+		return docIDs
+
+
+	def update(self, fields:Any, cond:Any=None, doc_ids:List[int]=None) -> List[int]:
+		docIDs = super().update(fields, cond, doc_ids)
+		self._journalDocuments(docIDs)
+		return docIDs
+
+
+	def remove(self, cond:Any=None, doc_ids:List[int]=None) -> List[int]:
+		docIDs = super().remove(cond, doc_ids)
+		if self.journal is not None:
+			for docID in docIDs:
+				self.journal.append(self.name, docID)
+		return docIDs
+
+
+	def truncate(self) -> None:
+		super().truncate()
+		if self.journal is not None:
+			self.journal.appendTruncate(self.name)
+
+
+	def undo(self, previous:Dict[int, dict]) -> List[int]:
+		docIDs = super().undo(previous)
+		if self.journal is not None:
+			documents = self.storage.read()[self.name]
+			for docID in docIDs:
+				self.journal.append(self.name, docID, documents.get(str(docID)))
+		return docIDs
+
+
+	def _journalDocuments(self, docIDs:List[int]) -> None:
+		if self.journal is None:
+			return
+		documents = self.storage.read()[self.name]
+		for docID in docIDs:
+			self.journal.append(self.name, docID, documents[str(docID)])
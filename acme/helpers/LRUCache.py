@@ -0,0 +1,67 @@
+#
+#	LRUCache.py
+#
+#	(c) 2020 by Andreas Kraft
+#	License: BSD 3-Clause License. See the LICENSE file for further details.
+#
+#	A simple, thread-safe LRU cache with hit and miss counters.
+#
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Any
+
+
+class LRUCache(object):
+
+	def __init__(self, size:int) -> None:
+		self.size = size
+		self.entries:OrderedDict = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.generation = 0		# Incremented with every invalidation
+		self.lock = Lock()
+
+
+	def __len__(self) -> int:
+		return len(self.entries)
+
+
+	def get(self, key:Any) -> Any:
+		"""	Return the cached value for a key, or None. """
+		with self.lock:
+			if (value := self.entries.get(key)) is None:
+				self.misses += 1
+				return None
+			self.entries.move_to_end(key)
+			self.hits += 1
+			return value
+
+
+	def put(self, key:Any, value:Any, generation:int=None) -> None:
+		"""	Add a value to the cache and evict the least recently used entries if necessary.
+			If *generation* is given then the value is only added if no entry was invalidated
+			since the caller read that generation. This prevents caching a value that was
+			read before a concurrent update.
+		"""
+		if self.size <= 0:
+			return
+		with self.lock:
+			if generation is not None and generation != self.generation:
+				return
+			self.entries[key] = value
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.size:
+				self.entries.popitem(last=False)
+
+
+	def remove(self, key:Any) -> None:
+		with self.lock:
+			self.generation += 1
+			self.entries.pop(key, None)
+
+
+	def clear(self) -> None:
+		with self.lock:
+			self.generation += 1
+			self.entries.clear()
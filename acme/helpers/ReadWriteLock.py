@@ -3,6 +3,8 @@
 #   stream of readers may starve a writer, Lock Promotion and Context Managers
 
 import threading
+from types import TracebackType
+from typing import List, Literal, Optional, Type
 #import logging
 
 
@@ -10,40 +12,38 @@ class ReadWriteLock(object):
     """ A lock object that allows many simultaneous "read locks", but
     only one "write lock." """
 
-    def __init__(self, withPromotion=False):
-        self._read_ready = threading.Condition(threading.RLock())
+    def __init__(self, withPromotion:bool=False) -> None:
+        self._lock = threading.RLock()  # Used directly by readers, which is faster than the Condition
+        self._read_ready = threading.Condition(self._lock)
         self._readers = 0
         self._writers = 0
         self._promote = withPromotion
-        self._readerList = []  # List of Reader thread IDs
-        self._writerList = []  # List of Writer thread IDs
+        self._readerList:List[int] = []  # List of Reader thread IDs
+        self._writerList:List[int] = []  # List of Writer thread IDs
 
-    def acquire_read(self):
+    def acquire_read(self) -> None:
         #logging.debug("RWL : acquire_read()")
         """ Acquire a read lock. Blocks only if a thread has
-	acquired the write lock. """
-        self._read_ready.acquire()
-        try:
-            while self._writers > 0:
+	acquired the write lock. A thread that already holds the write lock
+	or a read lock doesn't block, otherwise it would wait for itself. """
+        ident = threading.get_ident()
+        with self._lock:
+            while self._writers > 0 and ident not in self._writerList and ident not in self._readerList:
                 self._read_ready.wait()
             self._readers += 1
-        finally:
-            self._readerList.append(threading.get_ident())
-            self._read_ready.release()
+            self._readerList.append(ident)
 
-    def release_read(self):
+    def release_read(self) -> None:
         #logging.debug("RWL : release_read()")
         """ Release a read lock. """
-        self._read_ready.acquire()
-        try:
+        ident = threading.get_ident()
+        with self._lock:
             self._readers -= 1
-            if not self._readers:
-                self._read_ready.notifyAll()
-        finally:
-            self._readerList.remove(threading.get_ident())
-            self._read_ready.release()
+            self._readerList.remove(ident)
+            if not self._readers and self._writers:    # only writers wait for the last reader
+                self._read_ready.notify_all()
 
-    def acquire_write(self):
+    def acquire_write(self) -> None:
         #logging.debug("RWL : acquire_write()")
         """ Acquire a write lock. Blocks until there are no
 	acquired read or write locks. """
@@ -59,7 +59,7 @@ class ReadWriteLock(object):
             else:
                 self._read_ready.wait()
 
-    def release_write(self):
+    def release_write(self) -> None:
         #logging.debug("RWL : release_write()")
         """ Release a write lock. """
         self._writers -= 1
@@ -73,14 +73,14 @@ class ReadWriteLock(object):
 class ReadRWLock(object):
     # Context Manager class for ReadWriteLock
 
-    def __init__(self, rwLock):
+    def __init__(self, rwLock:ReadWriteLock) -> None:
         self.rwLock = rwLock
 
-    def __enter__(self):
+    def __enter__(self) -> 'ReadRWLock':
         self.rwLock.acquire_read()
         return self         # Not mandatory, but returning to be safe
 
-    def __exit__(self, exc_type, exc_value, traceback):
+    def __exit__(self, exc_type:Optional[Type[BaseException]], exc_value:Optional[BaseException], traceback:Optional[TracebackType]) -> Literal[False]:
         self.rwLock.release_read()
         return False        # Raise the exception, if exited due to an exception
 
@@ -90,14 +90,14 @@ class ReadRWLock(object):
 class WriteRWLock(object):
     # Context Manager class for ReadWriteLock
 
-    def __init__(self, rwLock):
+    def __init__(self, rwLock:ReadWriteLock) -> None:
         self.rwLock = rwLock
 
-    def __enter__(self):
+    def __enter__(self) -> 'WriteRWLock':
         self.rwLock.acquire_write()
         return self         # Not mandatory, but returning to be safe
 
-    def __exit__(self, exc_type, exc_value, traceback):
+    def __exit__(self, exc_type:Optional[Type[BaseException]], exc_value:Optional[BaseException], traceback:Optional[TracebackType]) -> Literal[False]:
         self.rwLock.release_write()
         return False        # Raise the exception, if exited due to an exception
 
@@ -105,7 +105,7 @@ class WriteRWLock(object):
 import time
 
 
-def reads():
+def reads() -> None:
     readLock = ReadRWLock(lock)
     while True:
         with readLock as _:
@@ -113,7 +113,7 @@ def reads():
             time.sleep(0.1)
 
 
-def writes():
+def writes() -> None:
     writeLock = WriteRWLock(lock)
     while True:
         with writeLock as _:
@@ -0,0 +1,169 @@
+#
+#	UndoLog.py
+#
+#	(c) 2020 by Andreas Kraft
+#	License: BSD 3-Clause License. See the LICENSE file for further details.
+#
+#	This module implements the rollback of transactions for TinyDB tables. While
+#	a transaction is open, the previous version of every document is recorded
+#	before it is changed or removed for the first time. A rollback writes the
+#	recorded versions back.
+#
+#	The tables also change their documents in place, instead of converting the
+#	whole table for every change like TinyDB does.
+#
+
+from __future__ import annotations
+import copy
+from collections.abc import MutableMapping
+from threading import Lock
+from typing import Any, Callable, Dict, Iterator, List
+from tinydb.table import Table					# type: ignore
+from tinydb.storages import Storage				# type: ignore
+
+
+class UndoLog(object):
+
+	def __init__(self) -> None:
+		self.recording = False
+		self.tables:Dict[str, Dict[int, dict]] = {}	# table name -> doc_id -> previous document, or None for a new document
+		self.lock = Lock()
+
+
+	def start(self) -> None:
+		with self.lock:
+			self.tables.clear()
+			self.recording = True
+
+
+	def stop(self) -> Dict[str, Dict[int, dict]]:
+		"""	Stop recording and return the recorded documents. """
+		with self.lock:
+			self.recording = False
+			tables, self.tables = self.tables, {}
+			return tables
+
+
+class _DocumentTable(MutableMapping):
+	"""	The table data that is passed to TinyDB's update functions. It maps the
+		integer doc_ids that TinyDB expects to the string keys of the stored table,
+		so that single documents can be changed in place.
+	"""
+
+	def __init__(self, data:Dict[str, dict]) -> None:
+		self.data = data
+
+
+	def __getitem__(self, docID:int) -> dict:
+		return self.data[str(docID)]
+
+
+	def __setitem__(self, docID:int, doc:dict) -> None:
+		self.data[str(docID)] = doc
+
+
+	def __delitem__(self, docID:int) -> None:
+		del self.data[str(docID)]
+
+
+	def __contains__(self, docID:Any) -> bool:
+		return str(docID) in self.data
+
+
+	def __iter__(self) -> Iterator[int]:
+		return (int(docID) for docID in self.data)
+
+
+	def __len__(self) -> int:
+		return len(self.data)
+
+
+class _RecordingTable(MutableMapping):
+	"""	The table data that is passed to TinyDB's update functions while recording.
+		It records a copy of every document before it may be changed in place,
+		replaced or removed.
+	"""
+
+	def __init__(self, data:MutableMapping, previous:Dict[int, dict]) -> None:
+		self.data = data
+		self.previous = previous
+
+
+	def _record(self, docID:int) -> None:
+		if docID not in self.previous:
+			self.previous[docID] = copy.deepcopy(self.data.get(docID))
+
+
+	def __getitem__(self, docID:int) -> dict:
+		self._record(docID)		# The caller may change the document in place
+		return self.data[docID]
+
+
+	def __setitem__(self, docID:int, doc:dict) -> None:
+		self._record(docID)
+		self.data[docID] = doc
+
+
+	def __delitem__(self, docID:int) -> None:
+		self._record(docID)
+		del self.data[docID]
+
+
+	def __contains__(self, docID:Any) -> bool:
+		return docID in self.data
+
+
+	def __iter__(self) -> Iterator[int]:
+		return iter(self.data)
+
+
+	def __len__(self) -> int:
+		return len(self.data)
+
+
+class UndoTable(Table):
+	"""	TinyDB table that records the previous versions of its documents in an UndoLog
+		while a transaction is open.
+	"""
+
+	def __init__(self, storage:Storage, name:str, undoLog:UndoLog=None, **kwargs:Any) -> None:
+		super().__init__(storage, name, **kwargs)
+		self.undoLog = undoLog
+		self.changes = 0		# Number of writes, to find out whether the table has changed
+
+
+	def _update_table(self, updater:Callable[[MutableMapping], None]) -> None:
+		if self.undoLog is None or not self.undoLog.recording:
+			return self._updateDocuments(updater)
+		with self.undoLog.lock:
+			previous = self.undoLog.tables.setdefault(self.name, {})
+		self._updateDocuments(lambda table: updater(_RecordingTable(table, previous)))
+
+
+	def _updateDocuments(self, updater:Callable[[MutableMapping], None]) -> None:
+		"""	Let *updater* change the documents in place, and write the data back to the
+			storage. TinyDB's own implementation converts the whole table twice for every
+			change, so the cost of a write grew with the size of the table. This relies on
+			the storage returning the same data for every read, like the MemoryStorage and
+			the CachingMiddleware do.
+		"""
+		if (tables := self._storage.read()) is None:	# empty database
+			tables = {}
+		updater(_DocumentTable(tables.setdefault(self.name, {})))
+		self._storage.write(tables)
+		self.changes += 1
+		self.clear_cache()
+
+
+	def undo(self, previous:Dict[int, dict]) -> List[int]:
+		"""	Write back the *previous* versions of documents. Documents without a previous
+			version are removed. Return the doc_ids of the restored documents.
+		"""
+		def restore(table:MutableMapping) -> None:
+			for docID, doc in previous.items():
+				if doc is None:
+					table.pop(docID, None)
+				else:
+					table[docID] = doc
+		self._updateDocuments(restore)
+		return list(previous.keys())
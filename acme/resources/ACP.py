@@ -64,7 +64,7 @@ class ACP(AnnounceableResource):
 
 		# Remove own resourceID from all acpi
 		Logging.logDebug('Removing acp.ri: %s from assigned resource acpi' % self.ri)
-		for r in CSE.storage.searchByValueInField('acpi', self.ri):
+		for r in CSE.storage.searchByACPI(self.ri):
 			acpi = r.acpi
 			if self.ri in acpi:
 				acpi.remove(self.ri)
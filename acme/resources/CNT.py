@@ -77,7 +77,7 @@ class CNT(AnnounceableResource):
 
 	# Get all content instances of a resource and return a sorted (by ct) list 
 	def contentInstances(self) -> List[Resource]:
-		return sorted(CSE.dispatcher.directChildResources(self.ri, T.CIN), key=lambda x: (x.ct))
+		return CSE.storage.contentInstances(self.ri)
 
 
 	def childWillBeAdded(self, childResource:Resource, originator:str) -> Result:
@@ -132,34 +132,24 @@ class CNT(AnnounceableResource):
 		""" Internal validation and checks. This called more often then just from
 			the validate() method.
 		"""
-		# retrieve all children
-		cs = self.contentInstances()
-
-		# Check number of instances
+		# Check number of instances and their size. The storage keeps track of both,
+		# so only the instances that are removed need to be retrieved.
 		mni = self.mni
-		cni = len(cs)
-		i = 0
-		l = cni
-		while cni > mni and i < l:
-			# remove oldest
-			CSE.dispatcher.deleteResource(cs[i])
-			cni -= 1
-			i += 1
-		self['cni'] = cni
-
-		# check size
-		cs = self.contentInstances()	# get CINs again
 		mbs = self.mbs
-		cbs = 0
-		for c in cs:					# Calculate cbs
-			cbs += c['cs']
-		i = 0
-		l = len(cs)
-		while cbs > mbs and i < l:
+		cni, cbs = CSE.storage.countContentInstances(self.ri)
+		deletedRi = None
+		while (cni > mni or cbs > mbs) and (oldest := CSE.storage.oldestContentInstance(self.ri)) is not None:
+			# Stop when the oldest instance wasn't removed, instead of trying it forever
+			if oldest.ri == deletedRi:
+				Logging.logErr('Oldest <contentInstance> is still stored after deleting it: %s' % deletedRi)
+				break
 			# remove oldest
-			cbs -= cs[i]['cs']
-			CSE.dispatcher.deleteResource(cs[i])
-			i += 1
+			if (res := CSE.dispatcher.deleteResource(oldest)).rsc != RC.deleted:
+				Logging.logErr('Cannot delete oldest <contentInstance>: %s (%s)' % (oldest.ri, res.dbg))
+				break
+			deletedRi = oldest.ri
+			cni, cbs = CSE.storage.countContentInstances(self.ri)
+		self['cni'] = cni
 		self['cbs'] = cbs
 
 		# TODO: support maxInstanceAge
@@ -53,8 +53,4 @@ class CNT_LA(Resource):
 
 
 	def _getLatest(self) -> Resource:
-		pi = self['pi']
-		rs = []
-		if (parentResource := CSE.dispatcher.retrieveResource(pi).resource) is not None:
-			rs = parentResource.contentInstances()						# ask parent for all CIN
-		return rs[-1] if len(rs) > 0 else None
+		return CSE.storage.latestContentInstance(self['pi'])
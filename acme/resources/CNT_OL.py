@@ -53,9 +53,5 @@ class CNT_OL(Resource):
 
 
 	def _getOldest(self) -> Resource:
-		pi = self['pi']
-		rs = []
-		if (parentResource := CSE.dispatcher.retrieveResource(pi).resource) is not None:
-			rs = parentResource.contentInstances()						# ask parent for all CIN
-		return rs[0] if len(rs) > 0 else None
+		return CSE.storage.oldestContentInstance(self['pi'])
 
@@ -9,13 +9,13 @@
 
 # The following import allows to use "Resource" inside a method typing definition
 from __future__ import annotations
-from typing import Any, Tuple, Union, Dict, List
+from typing import Any, Tuple, Union, Dict, List, Set
 from Logging import Logging
 from Constants import Constants as C
 from Types import ResourceTypes as T, Result, NotificationEventType, ResponseCode as RC
 from Configuration import Configuration
 import Utils, CSE
-import datetime, random, traceback
+import datetime, random, traceback, copy
 from .Resource import *
 
 # Future TODO: Check RO/WO etc for attributes (list of attributes per resource?)
@@ -37,6 +37,13 @@ class Resource(object):
 	# ATTN: There is a similar definition in FCNT! Don't Forget to add attributes there as well
 	internalAttributes	= [ _rtype, _srn, _node, _createdInternally, _imported, _isVirtual, _isInstantiated, _originator, _announcedTo, _modified ]
 
+	# Instance attributes that are shared by all resources of a class, and are never changed
+	sharedAttributes	= [ 'attributePolicies', 'resourceAttributePolicies' ]
+
+	# Top-level attributes of the document whose values are still shared with another
+	# resource, see clone()
+	_sharedKeys:Set[str] = None
+
 	def __init__(self, ty:Union[T, int], jsn:dict=None, pi:str=None, tpe:str=None, create:bool=False, inheritACP:bool=False, readOnly:bool=False, rn:str=None, attributePolicies:dict=None, isVirtual:bool=False) -> None:
 		self.tpe = tpe
 		if isinstance(ty, T) and ty not in [ T.FCNT, T.FCI ]: 	# For some types the tpe/root is empty and will be set later in this method
@@ -147,12 +154,7 @@ class Resource(object):
 		if not (res := self.validate(originator, create=True)).status:
 			return res
 
-		# increment parent resource's state tag
-		if parentResource is not None and parentResource.st is not None:
-			parentResource = parentResource.dbReload().resource	# Read the resource again in case it was updated in the DB
-			parentResource['st'] = parentResource.st + 1
-			if (res := parentResource.dbUpdate()).resource is None:
-				return Result(status=False, rsc=res.rsc, dbg=res.dbg)
+		# The parent resource's state tag is incremented by the Dispatcher after the activation
 
 		self.setAttribute(self._originator, originator, overwrite=False)
 		self.setAttribute(self._rtype, self.tpe, overwrite=False) 
@@ -316,10 +318,14 @@ class Resource(object):
 
 
 	def setAttribute(self, key:str, value:Any, overwrite:bool=True) -> None:
+		if self._sharedKeys:
+			self._ownAttribute(key, copyValue='/' in key)
 		Utils.setXPath(self.json, key, value, overwrite)
 
 
 	def attribute(self, key:str, default:Any=None) -> Any:
+		if self._sharedKeys:	# the caller may change the value in place
+			self._ownAttribute(key)
 		if '/' in key:	# search in path
 			return Utils.findXPath(self.json, key, default)
 		if self.hasAttribute(key):
@@ -339,6 +345,8 @@ class Resource(object):
 			really deleted from the resource.
 		"""
 		if self.hasAttribute(key):
+			if self._sharedKeys:
+				self._ownAttribute(key, copyValue=False)
 			if setNone:
 				self.json[key] = None
 			else:
@@ -406,6 +414,36 @@ class Resource(object):
 		return CSE.storage.retrieveResource(ri=self.ri)
 
 
+	def clone(self, copyOnWrite:bool=False) -> Resource:
+		"""	Return a copy of the resource that can be changed independently, without
+			running the initialization again.
+
+			With *copyOnWrite* only the top level of the document is copied. The nested
+			attributes are copied when they are accessed for the first time, because the
+			caller may change them in place. This resource must not be changed anymore
+			then, like a resource in the resource cache.
+		"""
+		resource = self.__class__.__new__(self.__class__)
+		if copyOnWrite:
+			resource.__dict__.update(self.__dict__)	# the other attributes are only read
+			resource.json = self.json.copy()
+			resource._sharedKeys = { k for k, v in self.json.items() if isinstance(v, (dict, list)) }
+			return resource
+		resource.__dict__.update({ k : v if k in self.sharedAttributes else copy.deepcopy(v) for k, v in self.__dict__.items() })
+		resource._sharedKeys = None
+		return resource
+
+
+	def _ownAttribute(self, key:str, copyValue:bool=True) -> None:
+		"""	Copy the value of a top-level attribute that is still shared with another
+			resource before it may be changed. *key* may also be a path.
+		"""
+		if (key := key.split('/', 1)[0]) in self._sharedKeys:
+			self._sharedKeys.discard(key)
+			if copyValue:
+				self.json[key] = copy.deepcopy(self.json[key])
+
+
 
 	#########################################################################
 
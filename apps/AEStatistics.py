@@ -49,7 +49,11 @@ class AEStatistics(AEBase):
 				'lgErr'	: [ BT.nonNegInteger,	CAR.car01, RO.O, RO.O, RO.O, AN.OA ],
 				'lgWrn'	: [ BT.nonNegInteger,	CAR.car01, RO.O, RO.O, RO.O, AN.OA ],
 				'cseUT'	: [ BT.string,			CAR.car01, RO.O, RO.O, RO.O, AN.OA ],
-				'ctRes'	: [ BT.nonNegInteger,	CAR.car01, RO.O, RO.O, RO.O, AN.OA ]
+				'ctRes'	: [ BT.nonNegInteger,	CAR.car01, RO.O, RO.O, RO.O, AN.OA ],
+				'ctTyp'	: [ BT.dict,			CAR.car01, RO.O, RO.O, RO.O, AN.OA ],
+				'rcHit'	: [ BT.nonNegInteger,	CAR.car01, RO.O, RO.O, RO.O, AN.OA ],
+				'rcMis'	: [ BT.nonNegInteger,	CAR.car01, RO.O, RO.O, RO.O, AN.OA ],
+				'dbRcl'	: [ BT.nonNegInteger,	CAR.car01, RO.O, RO.O, RO.O, AN.OA ]
 			}
 		}
 
@@ -75,7 +79,11 @@ class AEStatistics(AEBase):
 				Statistics.logWarnings : 0,
 				Statistics.cseStartUpTime : '',
 				Statistics.cseUpTime : '',
-				Statistics.resourceCount: 0
+				Statistics.resourceCount: 0,
+				Statistics.resourceTypeCounts: {},
+				Statistics.resourceCacheHits: 0,
+				Statistics.resourceCacheMisses: 0,
+				Statistics.dbReclaimedBytes: 0
 			}
 		}
 		# add announceTarget if target CSI is given
@@ -164,6 +164,59 @@ class TestCNT_CIN(unittest.TestCase):
 		self.assertEqual(findXPath(r, 'm2m:cin/con'), 'dValue')
 
 
+	@unittest.skipIf(noCSE, 'No CSEBase')
+	def test_changeCNTMbs(self):
+		jsn = 	{ 'm2m:cnt' : {
+					'mni' : 10
+ 				}}
+		cnt, rsc = UPDATE(cntURL, TestCNT_CIN.originator, jsn)
+		self.assertEqual(rsc, RC.updated)
+		for con in [ 'eValue', 'fValue', 'gValue' ]:
+			jsn = 	{ 'm2m:cin' : {
+						'cnf' : 'a',
+						'con' : con
+					}}
+			r, rsc = CREATE(cntURL, TestCNT_CIN.originator, T.CIN, jsn)
+			self.assertEqual(rsc, RC.created)
+
+		r, rsc = RETRIEVE(cntURL, TestCNT_CIN.originator)
+		self.assertEqual(rsc, RC.OK)
+		self.assertEqual(findXPath(r, 'm2m:cnt/cni'), 4)
+		self.assertEqual(findXPath(r, 'm2m:cnt/cbs'), 24)
+
+		jsn = 	{ 'm2m:cnt' : {
+					'mbs' : 12
+ 				}}
+		cnt, rsc = UPDATE(cntURL, TestCNT_CIN.originator, jsn)
+		self.assertEqual(rsc, RC.updated)
+		self.assertEqual(findXPath(cnt, 'm2m:cnt/mbs'), 12)
+		self.assertEqual(findXPath(cnt, 'm2m:cnt/cni'), 2)
+		self.assertEqual(findXPath(cnt, 'm2m:cnt/cbs'), 12)
+
+		r, rsc = RETRIEVE('%s/ol' % cntURL, TestCNT_CIN.originator)
+		self.assertEqual(rsc, RC.OK)
+		self.assertEqual(findXPath(r, 'm2m:cin/con'), 'fValue')
+
+		r, rsc = RETRIEVE('%s/la' % cntURL, TestCNT_CIN.originator)
+		self.assertEqual(rsc, RC.OK)
+		self.assertEqual(findXPath(r, 'm2m:cin/con'), 'gValue')
+
+
+	@unittest.skipIf(noCSE, 'No CSEBase')
+	def test_deleteCNTLa(self):
+		_, rsc = DELETE('%s/la' % cntURL, TestCNT_CIN.originator)
+		self.assertEqual(rsc, RC.deleted)
+
+		r, rsc = RETRIEVE('%s/la' % cntURL, TestCNT_CIN.originator)
+		self.assertEqual(rsc, RC.OK)
+		self.assertEqual(findXPath(r, 'm2m:cin/con'), 'fValue')
+
+		r, rsc = RETRIEVE(cntURL, TestCNT_CIN.originator)
+		self.assertEqual(rsc, RC.OK)
+		self.assertEqual(findXPath(r, 'm2m:cnt/cni'), 1)
+		self.assertEqual(findXPath(r, 'm2m:cnt/cbs'), 6)
+
+
 def run():
 	suite = unittest.TestSuite()
 	suite.addTest(TestCNT_CIN('test_addCIN'))
@@ -171,6 +224,8 @@ def run():
 	suite.addTest(TestCNT_CIN('test_rerieveCNTLa'))
 	suite.addTest(TestCNT_CIN('test_rerieveCNTOl'))
 	suite.addTest(TestCNT_CIN('test_changeCNTMni'))
+	suite.addTest(TestCNT_CIN('test_changeCNTMbs'))
+	suite.addTest(TestCNT_CIN('test_deleteCNTLa'))
 	result = unittest.TextTestRunner(verbosity=testVerbosity, failfast=True).run(suite)
 	return result.testsRun, len(result.errors + result.failures), len(result.skipped)
 
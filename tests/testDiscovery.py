@@ -144,6 +144,28 @@ class TestDiscovery(unittest.TestCase):
 		self.assertIn(findXPath(r, 'm2m:uril/{1}').split('/')[-1], (cntRN, cnt2RN))
 
 
+	# lim and ofst apply to all discovered resources, not only to the direct children
+	@unittest.skipIf(noCSE, 'No CSEBase')
+	def test_discoverCINunderAEWithLim(self):
+		r, rsc = RETRIEVE('%s?fu=1&rcn=%d&ty=%d&lim=3' % (aeURL, RCN.discoveryResultReferences, T.CIN), TestDiscovery.originator)
+		self.assertEqual(rsc, RC.OK)
+		self.assertIsNotNone(findXPath(r, 'm2m:uril'))
+		self.assertEqual(len(findXPath(r, 'm2m:uril')), 3)
+
+
+	@unittest.skipIf(noCSE, 'No CSEBase')
+	def test_discoverCINunderAEWithOfst(self):
+		r, rsc = RETRIEVE('%s?fu=1&rcn=%d&ty=%d' % (aeURL, RCN.discoveryResultReferences, T.CIN), TestDiscovery.originator)
+		self.assertEqual(rsc, RC.OK)
+		self.assertEqual(len(uril := findXPath(r, 'm2m:uril')), 10)
+		r, rsc = RETRIEVE('%s?fu=1&rcn=%d&ty=%d&ofst=5&lim=3' % (aeURL, RCN.discoveryResultReferences, T.CIN), TestDiscovery.originator)
+		self.assertEqual(rsc, RC.OK)
+		self.assertEqual(findXPath(r, 'm2m:uril'), uril[4:7])
+		r, rsc = RETRIEVE('%s?fu=1&rcn=%d&ty=%d&ofst=9' % (aeURL, RCN.discoveryResultReferences, T.CIN), TestDiscovery.originator)
+		self.assertEqual(rsc, RC.OK)
+		self.assertEqual(findXPath(r, 'm2m:uril'), uril[8:])
+
+
 	# attributes (fail fail for discovery)
 	@unittest.skipIf(noCSE, 'No CSEBase')
 	def test_discoverCNTunderAEWrongRCN1(self):
@@ -563,6 +585,27 @@ class TestDiscovery(unittest.TestCase):
 		self.assertEqual(rsc, RC.badRequest)
 
 
+	# The order of the discovered resources doesn't depend on updates or on whether the
+	# resources are found via the indexes or by walking the resource tree
+	@unittest.skipIf(noCSE, 'No CSEBase')
+	def test_discoverWithOfstAndLimAfterUpdate(self):
+		r, rsc = UPDATE(cntURL, TestDiscovery.originator, { 'm2m:cnt' : { 'lbl' : [ 'cntLbl', 'updated' ] }})
+		self.assertEqual(rsc, RC.updated)
+		# The ty conditions are resolved by the indexes. OR with the unindexed szb walks the tree.
+		indexURL = '%s?fu=1&rcn=%d&ty=%d&ty=%d' % (aeURL, RCN.discoveryResultReferences, T.CNT, T.CIN)
+		walkURL = '%s?fu=1&rcn=%d&fo=%d&ty=%d&ty=%d&szb=1000' % (aeURL, RCN.discoveryResultReferences, FilterOperation.OR, T.CNT, T.CIN)
+		r, rsc = RETRIEVE(indexURL, TestDiscovery.originator)
+		self.assertEqual(rsc, RC.OK)
+		self.assertGreater(len(uril := findXPath(r, 'm2m:uril')), 10)
+		r, rsc = RETRIEVE(walkURL, TestDiscovery.originator)
+		self.assertEqual(rsc, RC.OK)
+		self.assertEqual(findXPath(r, 'm2m:uril'), uril)
+		for url in [ indexURL, walkURL ]:
+			r, rsc = RETRIEVE('%s&ofst=2&lim=5' % url, TestDiscovery.originator)
+			self.assertEqual(rsc, RC.OK)
+			self.assertEqual(findXPath(r, 'm2m:uril'), uril[1:6])
+
+
 	@unittest.skipIf(noCSE, 'No CSEBase')
 	def test_retrieveWithWrongArgument(self):
 		r, rsc = RETRIEVE('%s?rcn=%d&wrong=wrong' % (aeURL, RCN.attributes), TestDiscovery.originator)
@@ -596,6 +639,8 @@ def run():
 	suite.addTest(TestDiscovery('test_retrieveCNIwithWrongSZB'))
 	suite.addTest(TestDiscovery('test_discoverCNTunderAERCN6'))
 	suite.addTest(TestDiscovery('test_discoveryCNTunderAERCN11'))
+	suite.addTest(TestDiscovery('test_discoverCINunderAEWithLim'))
+	suite.addTest(TestDiscovery('test_discoverCINunderAEWithOfst'))
 	suite.addTest(TestDiscovery('test_discoverCNTunderAEWrongRCN1'))
 	suite.addTest(TestDiscovery('test_discoverCNTunderAEWrongRCN4'))
 	suite.addTest(TestDiscovery('test_discoverCNTunderAEWrongRCN5'))
@@ -633,6 +678,7 @@ def run():
 	suite.addTest(TestDiscovery('test_createCNTwithRCN9'))
 	suite.addTest(TestDiscovery('test_updateCNTwithRCN9'))
 	suite.addTest(TestDiscovery('test_updateCNTwithWrongRCN2'))
+	suite.addTest(TestDiscovery('test_discoverWithOfstAndLimAfterUpdate'))
 	suite.addTest(TestDiscovery('test_retrieveWithWrongArgument'))
 	suite.addTest(TestDiscovery('test_retrieveWithWrongFU'))
 	suite.addTest(TestDiscovery('test_retrieveWithWrongDRT'))
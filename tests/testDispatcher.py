@@ -0,0 +1,249 @@
+#
+#	testDispatcher.py
+#
+#	(c) 2020 by Andreas Kraft
+#	License: BSD 3-Clause License. See the LICENSE file for further details.
+#
+#	Unit tests for the discovery of the dispatcher.
+#
+#	Like testStorage.py, these tests don't need a running CSE. They use the storage
+#	component with an in-memory database and the default configuration.
+#
+
+import unittest, sys
+from unittest.mock import patch
+sys.path.append('../acme')
+from testStorage import StorageTestCase		# also imports the CSE's modules in the right order
+import CSE
+from Configuration import Configuration
+from Dispatcher import Dispatcher, DiscoveryFilter
+from EventManager import EventManager
+from NotificationManager import NotificationManager
+from SecurityManager import SecurityManager
+from Validator import Validator
+from Types import ResourceTypes as T, FilterOperation, ResponseCode as RC
+from resources.AE import AE
+from resources.CNT import CNT
+import Utils
+from init import testVerbosity
+
+
+class TestDiscovery(StorageTestCase):
+
+	def setUp(self):
+		super().setUp()
+		self.openStorage()
+		Configuration._configuration['cse.security.enableACPChecks'] = False
+		Configuration._configuration['cse.sortDiscoveredResources'] = False
+		CSE.security = SecurityManager()
+		CSE.notification = NotificationManager()
+		CSE.event = EventManager()
+		CSE.validator = Validator()
+		self.dispatcher = CSE.dispatcher = Dispatcher()
+
+
+	def tearDown(self):
+		self.dispatcher.shutdown()
+		CSE.security = None
+		CSE.dispatcher = None
+		CSE.notification = None
+		CSE.event = None
+		CSE.validator = None
+		super().tearDown()
+
+
+	def createTree(self) -> None:
+		"""	Create an <AE> with two <container> resources, and three <contentInstance>
+			resources in the first container.
+		"""
+		self.ae = self.createResource({ 'm2m:ae' : { 'rn' : 'ae', 'api' : 'Ntest', 'rr' : False, 'srv' : [ '3' ], 'lbl' : [ 'tag:ae' ] } }, ty=T.AE, pi=self.cse.ri)
+		self.cnt1 = self.createResource({ 'm2m:cnt' : { 'rn' : 'cnt1', 'lbl' : [ 'tag:cnt' ] } }, ty=T.CNT, pi=self.ae.ri)
+		self.cins = [ self.createResource({ 'm2m:cin' : { 'rn' : 'cin%d' % i, 'cnf' : 'text/plain:0', 'con' : 'x' * i, 'cs' : i } }, ty=T.CIN, pi=self.cnt1.ri) for i in range(1, 4) ]
+		self.cnt2 = self.createResource({ 'm2m:cnt' : { 'rn' : 'cnt2' } }, ty=T.CNT, pi=self.ae.ri)
+
+
+	def discover(self, handling:dict=None, fo:int=FilterOperation.AND, conditions:dict=None, attributes:dict=None) -> list:
+		res = self.dispatcher.discoverResources(self.cse.ri, 'CAdmin', handling or {}, fo, conditions, attributes)
+		self.assertIsNotNone(res.lst, res.dbg)
+		return [ r.rn for r in res.lst ]
+
+
+	#
+	#	Filter
+	#
+
+	def test_filterConditions(self):
+		self.createTree()
+		cin1, cin2, cin3 = self.cins
+		def matches(fo:int, conditions:dict=None, attributes:dict=None) -> list:
+			discoveryFilter = DiscoveryFilter(fo, conditions, attributes)
+			return [ r.rn for r in [ self.ae, self.cnt1, cin1, cin2, cin3, self.cnt2 ] if discoveryFilter.match(r) ]
+
+		AND, OR = FilterOperation.AND, FilterOperation.OR
+		self.assertEqual(matches(AND), [ 'ae', 'cnt1', 'cin1', 'cin2', 'cin3', 'cnt2' ])
+		self.assertEqual(matches(OR), [])
+		self.assertEqual(matches(AND, { 'ty' : [ str(int(T.CNT)), str(int(T.AE)) ] }), [ 'ae', 'cnt1', 'cnt2' ])
+		self.assertEqual(matches(AND, { 'ty' : [ str(int(T.CNT)) ], 'lbl' : [ 'tag:cnt', 'tag:other' ] }), [ 'cnt1' ])
+		self.assertEqual(matches(OR, { 'ty' : [ str(int(T.CNT)) ], 'lbl' : [ 'tag:ae' ] }), [ 'ae', 'cnt1', 'cnt2' ])
+		self.assertEqual(matches(AND, { 'sza' : '2', 'szb' : '3' }), [ 'cin2' ])
+		self.assertEqual(matches(AND, { 'cty' : [ 'text/plain:0' ] }), [ 'cin1', 'cin2', 'cin3' ])
+		self.assertEqual(matches(AND, { 'cra' : cin1.ct, 'crb' : cin3.ct }), [ 'cin2' ] if cin1.ct < cin2.ct < cin3.ct else [])
+		self.assertEqual(matches(AND, { 'cra' : '99991231T235959' }), [])
+		self.assertEqual(matches(AND, attributes={ 'rn' : 'cin*' }), [ 'cin1', 'cin2', 'cin3' ])
+		self.assertEqual(matches(AND, attributes={ 'rn' : 'cin*', 'con' : 'xx' }), [ 'cin2' ])
+		self.assertEqual(matches(OR, attributes={ 'rn' : 'cnt2', 'con' : 'x' }), [ 'cin1', 'cnt2' ])
+
+
+	def test_unsupportedConditions(self):
+		for name in [ 'lbq', 'catr', 'patr' ]:
+			res = self.dispatcher.discoverResources(self.cse.ri, 'CAdmin', {}, FilterOperation.OR, { name : 'any', 'ty' : [ str(int(T.AE)) ] })
+			self.assertIsNone(res.lst)
+			self.assertEqual(res.rsc, RC.notImplemented)
+
+
+	#
+	#	Discovery
+	#
+
+	def test_discoveryOrder(self):
+		self.createTree()
+		# Walking the tree and resolving the candidates via the indexes return the same order
+		self.assertEqual(self.discover(), [ 'ae', 'cnt1', 'cin1', 'cin2', 'cin3', 'cnt2' ])
+		self.assertEqual(self.discover(conditions={ 'ty' : [ str(int(T.CNT)), str(int(T.CIN)) ] }), [ 'cnt1', 'cin1', 'cin2', 'cin3', 'cnt2' ])
+		self.assertEqual(self.discover(handling={ 'lvl' : 2 }), [ 'ae', 'cnt1', 'cnt2' ])
+
+
+	def test_discoveryPlan(self):
+		self.createTree()
+		ty = lambda *types: { 'ty' : [ str(int(t)) for t in types ] }
+		plan = lambda ri, conditions: self.dispatcher._planDiscovery(ri, FilterOperation.AND, conditions, None)
+		self.assertEqual(plan(self.cse.ri, None).strategy, 'walk')
+		self.assertEqual(plan(self.cse.ri, { 'lbl' : [ 'tag:ae' ] }).strategy, 'index')
+		self.assertEqual((p := plan(self.cse.ri, ty(T.CIN))).strategy, 'index')
+		self.assertEqual(p.candidates, { r.ri for r in self.cins })
+
+		# The subtree is not larger than the candidates, so it is walked
+		self.assertEqual(plan(self.cnt1.ri, ty(T.CIN)).strategy, 'walk')
+		self.assertEqual(plan(self.cnt2.ri, ty(T.CNT)).strategy, 'walk')
+
+		# Both plans find the same resources
+		res = self.dispatcher.discoverResources(self.cnt1.ri, 'CAdmin', {}, FilterOperation.AND, ty(T.CIN))
+		self.assertEqual([ r.rn for r in res.lst ], [ 'cin1', 'cin2', 'cin3' ])
+		self.assertEqual(self.discover(conditions=ty(T.CIN)), [ 'cin1', 'cin2', 'cin3' ])
+		res = self.dispatcher.discoverResources(self.cnt2.ri, 'CAdmin', {}, FilterOperation.AND, ty(T.CNT))
+		self.assertEqual(res.lst, [])
+
+
+	def test_offsetAndLimit(self):
+		self.createTree()
+		for conditions in [ None, { 'ty' : [ str(int(T.CNT)), str(int(T.CIN)) ] } ]:	# walk and index
+			self.assertEqual(self.discover(handling={ 'ofst' : 3 }, conditions=conditions)[-2:], [ 'cin3', 'cnt2' ])
+			self.assertEqual(self.discover(handling={ 'ofst' : 3, 'lim' : 2 }, conditions=conditions), self.discover(conditions=conditions)[2:4])
+			self.assertEqual(self.discover(handling={ 'lim' : 1 }, conditions=conditions), self.discover(conditions=conditions)[:1])
+			self.assertEqual(self.discover(handling={ 'ofst' : 10 }, conditions=conditions), [])
+
+
+	#
+	#	Transactions
+	#
+
+	def test_createResourceInTransaction(self):
+		self.createTree()
+		st = self.cnt1.st
+		cnt = Utils.resourceFromJSON({ 'm2m:cnt' : { 'rn' : 'cnt3' } }, pi=self.cnt1.ri, ty=T.CNT, create=True).resource
+
+		# Nothing is committed when notifying the parent resource fails, including the
+		# <latest> and <oldest> resources that were created while activating the container
+		with patch.object(CNT, 'childAdded', side_effect=RuntimeError('childAdded')):
+			with self.assertRaises(RuntimeError):
+				self.dispatcher.createResource(cnt, self.cnt1, 'CAdmin')
+		self.assertIsNone(self.storage.retrieveResource(ri=cnt.ri).resource)
+		self.assertEqual(self.storage.retrieveResource(ri=self.cnt1.ri).resource.st, st)
+		self.assertEqual(self.storage.countDescendantResources(self.cnt1.ri), 3)
+		self.assertEqual(self.storage.countResources(T.CNT_LA), 0)
+
+		res = self.dispatcher.createResource(cnt, self.cnt1, 'CAdmin')
+		self.assertEqual(res.rsc, RC.created, res.dbg)
+		self.assertEqual(self.storage.retrieveResource(ri=self.cnt1.ri).resource.st, st + 1)
+		self.assertEqual(self.storage.countDescendantResources(self.cnt1.ri), 6)
+		self.assertEqual(self.storage.countResources(T.CNT_LA), 1)
+
+
+	def test_deleteResourceInTransaction(self):
+		self.createTree()
+		cni = self.cnt1.cni
+
+		# The child resources are not removed when notifying the parent resource fails
+		with patch.object(AE, 'childRemoved', side_effect=RuntimeError('childRemoved')):
+			with self.assertRaises(RuntimeError):
+				self.dispatcher.deleteResource(self.cnt1, 'CAdmin')
+		self.assertEqual([ r.rn for r in self.storage.directChildResources(self.cnt1.ri) ], [ 'cin1', 'cin2', 'cin3' ])
+		self.assertEqual(self.storage.countDescendantResources(self.ae.ri), 5)
+		self.assertEqual(self.storage.retrieveResource(ri=self.cnt1.ri).resource.cni, cni)
+
+		self.assertEqual(self.dispatcher.deleteResource(self.cnt1, 'CAdmin').rsc, RC.deleted)
+		self.assertEqual(self.storage.countDescendantResources(self.ae.ri), 1)
+		self.assertEqual(self.storage.countResources(T.CIN), 0)
+
+
+	#
+	#	Resource tree
+	#
+
+	def test_resourceTreeAttributesAndChildResources(self):
+		self.createTree()
+		def names(resources:list) -> list:
+			return [ r['rn'] for r in resources ]
+
+		# The child resources are added to the resources, so every case works on copies
+		def copies() -> tuple:
+			return tuple(r.clone() for r in [ self.ae, self.cnt1, self.cnt2 ] + self.cins)
+
+		# Parents before their children, like a discovery returns them. The children of
+		# each resource are added in the order of the list.
+		ae, cnt1, cnt2, cin1, cin2, cin3 = copies()
+		target:dict = {}
+		self.assertEqual(self.dispatcher._resourceTreeJSON([ ae, cnt2, cin3, cnt1, cin1, cin2 ], target), [])
+		self.assertEqual(list(target), [ 'm2m:ae' ])
+		self.assertEqual(names(target['m2m:ae']), [ 'ae' ])
+		self.assertEqual(names(cnts := target['m2m:ae'][0]['m2m:cnt']), [ 'cnt2', 'cnt1' ])
+		self.assertNotIn('m2m:cin', cnts[0])
+		self.assertEqual(names(cnts[1]['m2m:cin']), [ 'cin3', 'cin1', 'cin2' ])
+
+		# Children before their parents. The resources are added type by type, in the order
+		# of the first occurence of each type, and each resource only once.
+		ae, cnt1, cnt2, cin1, cin2, cin3 = copies()
+		target = {}
+		self.assertEqual(self.dispatcher._resourceTreeJSON([ cin2, cnt2, ae, cin1, cnt1, cin3 ], target), [])
+		self.assertEqual(list(target), [ 'm2m:cin', 'm2m:cnt', 'm2m:ae' ])
+		self.assertEqual(names(target['m2m:cin']), [ 'cin2', 'cin1', 'cin3' ])
+		self.assertEqual(names(target['m2m:cnt']), [ 'cnt2', 'cnt1' ])
+		self.assertNotIn('m2m:cin', target['m2m:cnt'][1])
+		self.assertEqual(names(target['m2m:ae']), [ 'ae' ])
+		self.assertNotIn('m2m:cnt', target['m2m:ae'][0])
+
+		# Only the direct children of a target resource with a resourceID, and their 
+		# descendants. The other resources are returned.
+		ae, cnt1, cnt2, cin1, cin2, cin3 = copies()
+		parent = cnt1.clone()
+		self.assertEqual([ r.rn for r in self.dispatcher._resourceTreeJSON([ cin2, cnt2, ae, cin1, cnt1, cin3 ], parent) ], [ 'cnt2', 'ae', 'cnt1' ])
+		self.assertEqual(names(parent['m2m:cin']), [ 'cin2', 'cin1', 'cin3' ])
+
+
+def run() -> tuple:
+	suite = unittest.TestSuite()
+	suite.addTest(TestDiscovery('test_filterConditions'))
+	suite.addTest(TestDiscovery('test_unsupportedConditions'))
+	suite.addTest(TestDiscovery('test_discoveryOrder'))
+	suite.addTest(TestDiscovery('test_discoveryPlan'))
+	suite.addTest(TestDiscovery('test_offsetAndLimit'))
+	suite.addTest(TestDiscovery('test_createResourceInTransaction'))
+	suite.addTest(TestDiscovery('test_deleteResourceInTransaction'))
+	suite.addTest(TestDiscovery('test_resourceTreeAttributesAndChildResources'))
+	result = unittest.TextTestRunner(verbosity=testVerbosity, failfast=True).run(suite)
+	return result.testsRun, len(result.errors + result.failures), len(result.skipped)
+
+
+if __name__ == '__main__':
+	_, errors, _ = run()
+	sys.exit(errors)
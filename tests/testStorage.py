@@ -0,0 +1,947 @@
+#
+#	testStorage.py
+#
+#	(c) 2020 by Andreas Kraft
+#	License: BSD 3-Clause License. See the LICENSE file for further details.
+#
+#	Unit tests for the storage component and its database bindings.
+#
+#	These tests don't need a running CSE. They open the bindings, or the storage
+#	component with the default configuration, directly in a temporary directory.
+#	Most tests run once for each database binding.
+#
+
+import unittest, sys, os, shutil, tempfile, argparse, random
+from threading import Event, Lock, Thread
+from typing import Any
+sys.path.append('../acme')
+sys.path.append('../apps')
+import CSE	# import first to resolve the import order of the CSE's modules
+from Configuration import Configuration
+from Storage import Storage, StorageBinding, TinyDBBinding, SQLiteBinding
+from Types import ResourceTypes as T
+from resources.Resource import Resource
+from helpers.BackgroundWorker import BackgroundWorkerPool
+from helpers.Codecs import Codec, migrate
+from helpers.Indexes import SortedIndex
+from helpers.Journal import Journal
+from helpers.LRUCache import LRUCache
+import Utils
+from init import testVerbosity
+
+
+class StoredResource(object):
+	"""	Minimal stand-in for a Resource. The bindings only access the resource's
+		JSON and some of its attributes.
+	"""
+	def __init__(self, jsn:dict) -> None:
+		self.json = jsn
+
+	def __getattr__(self, key:str) -> Any:
+		return self.json.get(key)
+
+
+def newResource(ri:str, pi:str='cse', ty:int=3, ct:str='20201026T120000,000000', **kwargs:Any) -> StoredResource:
+	jsn = { 'ri' : ri, 'rn' : ri, 'pi' : pi, 'ty' : ty, 'ct' : ct, 'lt' : ct, '__srn__' : 'cse-in/%s' % ri }
+	jsn.update(kwargs)
+	return StoredResource(jsn)
+
+
+class NotIterableDict(dict):
+	"""	Table data that fails when all its documents are accessed. """
+	def __iter__(self) -> Any:
+		raise AssertionError('table is iterated')
+
+	def items(self) -> Any:
+		raise AssertionError('table is iterated')
+
+	def keys(self) -> Any:
+		raise AssertionError('table is iterated')
+
+	def values(self) -> Any:
+		raise AssertionError('table is iterated')
+
+	def unwrap(self) -> dict:
+		return dict(dict.items(self))
+
+
+def crashBinding(db:StorageBinding) -> None:
+	"""	Drop a binding without closing it, like a crashed CSE. Only the background
+		worker and the open journal files are released.
+	"""
+	BackgroundWorkerPool.stopWorkers('dbSnapshotWorker')
+	for _, journal, _ in getattr(db, 'journals', []):
+		if journal.file is not None:
+			journal.file.close()
+			journal.file = None
+
+
+def resourceIDs(db:StorageBinding, pi:str='cse') -> list:
+	return [ doc['ri'] for doc in db.searchResources(pi=pi) ]
+
+
+class StorageTestCase(unittest.TestCase):
+	"""	Base class of the storage tests. Each test runs against the database binding
+		that is given when the test is added to the suite, one of *bindings*.
+	"""
+	bindings = [ 'memory', 'tinydb', 'journal', 'sqlite-memory', 'sqlite' ]
+	defaults:dict = None		# The default configuration, read only once
+
+
+	def __init__(self, methodName:str='runTest', binding:str='memory') -> None:
+		super().__init__(methodName)
+		self.binding = binding
+
+
+	def __str__(self) -> str:
+		return '%s [%s]' % (super().__str__(), self.binding)
+
+
+	@classmethod
+	def setUpClass(cls):
+		cls.configuration = Configuration._configuration
+		if StorageTestCase.defaults is None:
+			Configuration.init(argparse.Namespace(configfile='../acme.ini.default', https=False))
+			StorageTestCase.defaults = Configuration._configuration
+
+
+	@classmethod
+	def tearDownClass(cls):
+		Configuration._configuration = cls.configuration
+
+
+	def setUp(self):
+		self.path = tempfile.mkdtemp(prefix='acme-test-')
+		self.storage = None
+
+
+	def tearDown(self):
+		if self.storage is not None:
+			self.storage.shutdown()
+			CSE.storage = None
+		shutil.rmtree(self.path, ignore_errors=True)
+
+
+	def isInMemory(self) -> bool:
+		return self.binding in [ 'memory', 'sqlite-memory' ]
+
+
+	def configure(self, **kwargs:Any) -> None:
+		"""	Set the database configuration for the test's binding. Further database settings
+			can be given as keyword arguments, e.g. compression='zlib'.
+		"""
+		Configuration._configuration = dict(StorageTestCase.defaults)
+		Configuration._configuration.update({	'db.backend'			: 'sqlite' if self.binding.startswith('sqlite') else 'tinydb',
+												'db.inMemory'			: self.isInMemory(),
+												'db.journal'			: self.binding == 'journal',
+												'db.path'				: self.path,
+												'db.snapshotInterval'	: 3600,
+												'db.backupInterval'		: 0,
+												'db.compactionInterval'	: 0 })
+		for key, value in kwargs.items():
+			Configuration._configuration['db.%s' % key] = value
+
+
+	#
+	#	Bindings
+	#
+
+	def openBinding(self, **kwargs:Any) -> StorageBinding:
+		"""	Open the test's binding in the test's directory. """
+		self.configure(**kwargs)
+		db = SQLiteBinding(self.path) if self.binding.startswith('sqlite') else TinyDBBinding(self.path)
+		db.openDB('-test')
+		return db
+
+
+	def reopenBinding(self, db:StorageBinding) -> StorageBinding:
+		"""	Reopen a binding. In-memory databases are returned as they are, and a journal
+			is replayed without closing the database first.
+		"""
+		if self.isInMemory():
+			return db
+		if self.binding == 'journal':
+			crashBinding(db)
+		else:
+			db.closeDB()
+		return self.openBinding()
+
+
+	#
+	#	Storage
+	#
+
+	def openStorage(self, **kwargs:Any) -> Storage:
+		"""	Open the storage component with the test's binding, and create a <CSEBase>
+			resource unless it already exists.
+		"""
+		self.configure(**kwargs)
+		self.storage = Storage()
+		CSE.storage = self.storage
+		if (cse := self.storage.retrieveResource(ri='id-in').resource) is None:
+			cse = self.createResource({ 'm2m:cb' : { 'ri' : 'id-in', 'rn' : 'cse-in', 'csi' : '/id-in' } }, ty=T.CSEBase)
+		self.cse = cse
+		return self.storage
+
+
+	def reopenStorage(self) -> Storage:
+		"""	Shut down and open the storage component again. For in-memory databases the
+			storage component is returned as it is.
+		"""
+		if self.isInMemory():
+			return self.storage
+		self.storage.shutdown()
+		self.storage = None
+		return self.openStorage()
+
+
+	def createResource(self, jsn:dict, ty:T, pi:str=None) -> Resource:
+		resource = Utils.resourceFromJSON(jsn, pi=pi, ty=ty, create=True).resource
+		self.assertTrue(self.storage.createResource(resource, overwrite=False).status)
+		return resource
+
+
+class TestJournal(StorageTestCase):
+
+	def test_journalReplayAfterCrash(self):
+		db = self.openBinding()
+		for ri in [ 'r1', 'r2', 'r3' ]:
+			db.insertResource(newResource(ri))
+		db.updateResource(newResource('r2', lbl=[ 'tag:updated' ]))
+		db.deleteResource(newResource('r3'))
+		crashBinding(db)
+		self.assertGreater(os.path.getsize('%s/resources-test.journal' % self.path), 0)
+
+		db = self.openBinding()
+		try:
+			self.assertEqual(resourceIDs(db), [ 'r1', 'r2' ])
+			self.assertEqual(db.searchResources(ri='r2')[0]['lbl'], [ 'tag:updated' ])
+			# The replayed journal is compacted into a new snapshot
+			self.assertEqual(os.path.getsize('%s/resources-test.journal' % self.path), 0)
+		finally:
+			db.closeDB()
+
+
+	def test_journalIgnoreIncompleteEntry(self):
+		journal = Journal('%s/test.json' % self.path, '%s/test.journal' % self.path)
+		journal.open()
+		journal.append('resources', 1, { 'ri' : 'r1' })
+		journal.append('resources', 2, { 'ri' : 'r2' })
+		journal.append('resources', 1)
+		journal.close()
+		with open(journal.journalFile, 'a') as file:	# crash while writing the last entry
+			file.write('{"t": "resources", "id": 3, "d": {"ri": ')
+		self.assertEqual(journal.load(), { 'resources' : { '2' : { 'ri' : 'r2' } } })
+
+
+	def test_journalReplayTransactionCompletelyOrNot(self):
+		journal = Journal('%s/test.json' % self.path, '%s/test.journal' % self.path)
+		journal.open()
+		journal.append('resources', 1, { 'ri' : 'r1' })
+		journal.begin()
+		journal.append('resources', 2, { 'ri' : 'r2' })
+		journal.append('resources', 1, { 'ri' : 'r1', 'st' : 1 })
+		journal.commit()
+		journal.close()
+		self.assertEqual(journal.load(), { 'resources' : { '1' : { 'ri' : 'r1', 'st' : 1 }, '2' : { 'ri' : 'r2' } } })
+
+		# Cut the transaction's line in half
+		with open(journal.journalFile, 'r') as file:
+			lines = file.readlines()
+		with open(journal.journalFile, 'w') as file:
+			file.write(lines[0] + lines[1][:len(lines[1]) // 2])
+		self.assertEqual(journal.load(), { 'resources' : { '1' : { 'ri' : 'r1' } } })
+
+
+	def test_journalReplayOnSnapshot(self):
+		journal = Journal('%s/test.json' % self.path, '%s/test.journal' % self.path)
+		journal.snapshot({ 'resources' : { '1' : { 'ri' : 'r1' }, '2' : { 'ri' : 'r2' } } })
+		journal.open()
+		journal.append('resources', 1)
+		journal.appendTruncate('statistics')
+		journal.close()
+		self.assertEqual(journal.load(), { 'resources' : { '2' : { 'ri' : 'r2' } }, 'statistics' : {} })
+
+
+class TestCodec(StorageTestCase):
+
+	def test_migrateCodec(self):
+		basename = '%s/test' % self.path
+		data = { 'resources' : { '1' : { 'ri' : 'r1', 'lbl' : [ 'tag:test' ] } } }
+		Codec().write(basename + '.json', data)
+		codec = Codec('json', 'zlib')
+		self.assertEqual(migrate(basename, codec), basename + '.json')
+		self.assertFalse(os.path.exists(basename + '.json'))
+		self.assertEqual(codec.read(basename + '.json.z'), data)
+		self.assertIsNone(migrate(basename, codec))		# nothing left to convert
+
+
+	def test_migrateDatabaseFiles(self):
+		db = self.openBinding()
+		db.insertResource(newResource('r1'))
+		db.closeDB()
+
+		db = self.openBinding(compression='zlib')
+		try:
+			self.assertEqual(resourceIDs(db), [ 'r1' ])
+			self.assertFalse(os.path.exists('%s/resources-test.json' % self.path))
+			self.assertTrue(os.path.exists('%s/resources-test.json.z' % self.path))
+		finally:
+			db.closeDB()
+
+
+class TestBinding(StorageTestCase):
+
+	#
+	#	Child resources and discovery
+	#
+
+	def test_childResourcesOrderedByCreationTime(self):
+		db = self.openBinding()
+		try:
+			# Insert out of the order of creation; equal creation times are ordered by insertion
+			db.insertResource(newResource('c3', ct='20201026T120003,000000'))
+			db.insertResource(newResource('c1', ct='20201026T120001,000000', ty=4))
+			db.insertResource(newResource('c2b', ct='20201026T120002,000000'))
+			db.insertResource(newResource('c2a', ct='20201026T120002,000000', ty=4))
+			db.updateResource(newResource('c2b', ct='20201026T120002,000000', lbl=[ 'tag:updated' ]))
+			self.assertEqual(resourceIDs(db), [ 'c1', 'c2b', 'c2a', 'c3' ])
+			db.updateResource(newResource('c1', ct='20201026T120001,000000', ty=4, lbl=[ 'tag:updated' ]))
+			db.deleteResource(newResource('c2b'))
+			db.insertResource(newResource('c2b', ct='20201026T120002,000000'))
+			self.assertEqual(resourceIDs(db), [ 'c1', 'c2a', 'c2b', 'c3' ])
+			self.assertEqual([ doc['ri'] for doc in db.searchResources(pi='cse', ty=4) ], [ 'c1', 'c2a' ])
+			self.assertEqual(sorted(doc['ri'] for doc in db.discoverResources(lambda r: r.get('lbl') is not None)), [ 'c1' ])
+
+			# The order survives a restart, and the indexes are rebuilt in the order of insertion
+			db.insertResource(newResource('c2', ct='20201026T120002,000000'))
+			db = self.reopenBinding(db)
+			self.assertEqual(resourceIDs(db), [ 'c1', 'c2a', 'c2b', 'c2', 'c3' ])
+			self.assertEqual([ doc['ri'] for doc in db.iterateResources(lambda r: True) ], [ 'c3', 'c1', 'c2a', 'c2b', 'c2' ])
+		finally:
+			db.closeDB()
+
+
+	#
+	#	Transactions
+	#
+
+	def test_commitTransaction(self):
+		db = self.openBinding()
+		db.insertResource(newResource('r1'))
+		db.beginTransaction()
+		db.updateResource(newResource('r1', lbl=[ 'tag:updated' ]))
+		db.insertResource(newResource('r2'))
+		db.commitTransaction()
+		self.assertEqual(resourceIDs(db), [ 'r1', 'r2' ])
+		self.assertEqual(db.searchResources(ri='r1')[0]['lbl'], [ 'tag:updated' ])
+		db = self.reopenBinding(db)
+		try:
+			self.assertEqual(resourceIDs(db), [ 'r1', 'r2' ])
+		finally:
+			db.closeDB()
+
+
+	def test_rollbackTransaction(self):
+		db = self.openBinding()
+		db.insertResource(newResource('r1'))
+		db.insertResource(newResource('r2'))
+		db.beginTransaction()
+		db.updateResource(newResource('r1', lbl=[ 'tag:updated' ]))
+		db.deleteResource(newResource('r2'))
+		db.insertResource(newResource('r3'))
+		db.rollbackTransaction()
+		self.assertEqual(resourceIDs(db), [ 'r1', 'r2' ])
+		self.assertIsNone(db.searchResources(ri='r1')[0].get('lbl'))
+		self.assertFalse(db.hasResource(ri='r3'))
+
+		# Changes after the rollback are not affected
+		db.insertResource(newResource('r4'))
+		db = self.reopenBinding(db)
+		try:
+			self.assertEqual(resourceIDs(db), [ 'r1', 'r2', 'r4' ])
+			self.assertIsNone(db.searchResources(ri='r1')[0].get('lbl'))
+		finally:
+			db.closeDB()
+
+
+	#
+	#	Backup and restore
+	#
+
+	def test_backupAndRestore(self):
+		db = self.openBinding()
+		db.insertResource(newResource('r1'))
+		db.insertResource(newResource('r2'))
+		filename = db.writeBackup(db.copyDB(), '%s/backup-test' % self.path)
+		self.assertTrue(os.path.exists(filename))
+
+		db.deleteResource(newResource('r1'))
+		db.updateResource(newResource('r2', lbl=[ 'tag:updated' ]))
+		db.insertResource(newResource('r3'))
+		db.restoreBackup(filename)
+		self.assertEqual(resourceIDs(db), [ 'r1', 'r2' ])
+		self.assertIsNone(db.searchResources(ri='r2')[0].get('lbl'))
+		self.assertFalse(db.hasResource(ri='r3'))
+
+		# The restored content is persisted, with a journal even without closing the database
+		db = self.reopenBinding(db)
+		try:
+			self.assertEqual(resourceIDs(db), [ 'r1', 'r2' ])
+		finally:
+			db.closeDB()
+
+
+	def test_restoreInvalidBackup(self):
+		db = self.openBinding()
+		try:
+			filename = '%s/backup-test.txt' % self.path
+			with open(filename, 'w') as file:
+				file.write('no backup')
+			self.assertRaises(ValueError, db.restoreBackup, filename)
+
+			filename = '%s/backup-test.json' % self.path
+			Codec().write(filename, { 'resources' : {} })
+			self.assertRaises(ValueError, db.restoreBackup, filename)
+		finally:
+			db.closeDB()
+
+
+	#
+	#	Writes
+	#
+
+	def test_writesDontConvertTable(self):
+		db = self.openBinding()
+		try:
+			for i in range(1000):
+				db.insertResource(newResource('r%04d' % i))
+			# Only the changed documents may be accessed, but the table is never iterated
+			tables = db.dbResources.storage.read()
+			tables['resources'] = NotIterableDict(tables['resources'])
+			db.insertResource(newResource('r1000'))
+			db.updateResource(newResource('r0500', lbl=[ 'tag:updated' ]))
+			db.deleteResource(newResource('r0000'))
+			db.beginTransaction()
+			db.updateResource(newResource('r0001', lbl=[ 'tag:committed' ]))
+			db.commitTransaction()
+			tables['resources'] = tables['resources'].unwrap()
+			self.assertEqual(len(resourceIDs(db)), 1000)
+			self.assertEqual(db.searchResources(ri='r0500')[0]['lbl'], [ 'tag:updated' ])
+			self.assertEqual(db.searchResources(ri='r0001')[0]['lbl'], [ 'tag:committed' ])
+		finally:
+			db.closeDB()
+
+
+class TestCompaction(StorageTestCase):
+
+	def test_compactRenumbersDocuments(self):
+		db = self.openBinding()
+		try:
+			for i in range(20):
+				db.insertResource(newResource('r%02d' % i))
+			for i in range(15):
+				db.deleteResource(newResource('r%02d' % i))
+			self.assertGreater(db.compactDB(0.5), 0)
+			self.assertEqual(sorted(map(int, db._documents(db.tabResources))), [ 1, 2, 3, 4, 5 ])
+			# The indexes refer to the new doc_ids
+			self.assertEqual(resourceIDs(db), [ 'r15', 'r16', 'r17', 'r18', 'r19' ])
+			self.assertEqual(db.searchResources(ri='r17')[0]['ri'], 'r17')
+			db.deleteResource(newResource('r15'))
+			db.insertResource(newResource('r20'))
+			self.assertEqual(resourceIDs(db), [ 'r16', 'r17', 'r18', 'r19', 'r20' ])
+		finally:
+			db.closeDB()
+
+		db = self.openBinding()
+		try:
+			self.assertEqual(resourceIDs(db), [ 'r16', 'r17', 'r18', 'r19', 'r20' ])
+		finally:
+			db.closeDB()
+
+
+	def test_compactOnlyChangedTables(self):
+		db = self.openBinding()
+		try:
+			for i in range(20):
+				db.insertResource(newResource('r%02d' % i))
+			for i in range(15):
+				db.deleteResource(newResource('r%02d' % i))
+			self.assertGreater(db.compactDB(0.5), 0)
+			# The unchanged table is neither scanned nor written again
+			tables = db.dbResources.storage.read()
+			tables['resources'] = NotIterableDict(tables['resources'])
+			self.assertEqual(db.compactDB(0.5), 0)
+			tables['resources'] = tables['resources'].unwrap()
+			for i in range(15, 19):
+				db.deleteResource(newResource('r%02d' % i))
+			db.compactDB(0.5)
+			self.assertEqual(sorted(map(int, db._documents(db.tabResources))), [ 1 ])
+		finally:
+			db.closeDB()
+
+
+	def test_compactWithWriteBehind(self):
+		db = self.openBinding(writeBehindInterval=1.0, writeBehindOperations=1000)
+		try:
+			for i in range(20):
+				db.insertResource(newResource('r%02d' % i, con='x' * 100))
+			for i in range(15):
+				db.deleteResource(newResource('r%02d' % i))
+			# Nothing was written yet. The buffered changes are written before the files are
+			# measured, so only the compaction itself is counted.
+			self.assertFalse(os.path.exists('%s/resources-test.json' % self.path))
+			self.assertGreater(db.compactDB(0.5), 0)
+			self.assertEqual(sorted(map(int, db._documents(db.tabResources))), [ 1, 2, 3, 4, 5 ])
+		finally:
+			db.closeDB()
+
+
+	def test_compactBelowThreshold(self):
+		db = self.openBinding()
+		try:
+			for i in range(10):
+				db.insertResource(newResource('r%02d' % i))
+			db.deleteResource(newResource('r00'))
+			self.assertEqual(db.compactDB(0.5), 0)
+			self.assertEqual(sorted(map(int, db._documents(db.tabResources))), list(range(2, 11)))
+		finally:
+			db.closeDB()
+
+
+	def test_compactJournal(self):
+		db = self.openBinding()
+		journalFile = '%s/resources-test.journal' % self.path
+		for i in range(10):
+			db.insertResource(newResource('r%02d' % i))
+		for n in range(10):
+			db.updateResource(newResource('r05', lbl=[ 'tag:%d' % n ]))
+		self.assertGreater(os.path.getsize(journalFile), 0)
+		self.assertGreater(db.compactDB(0.5), 0)
+		self.assertEqual(os.path.getsize(journalFile), 0)
+		crashBinding(db)
+
+		db = self.openBinding()
+		try:
+			self.assertEqual(len(resourceIDs(db)), 10)
+			self.assertEqual(db.searchResources(ri='r05')[0]['lbl'], [ 'tag:9' ])
+		finally:
+			db.closeDB()
+
+
+	def test_compactSQLite(self):
+		db = self.openBinding()
+		try:
+			for i in range(200):
+				db.insertResource(newResource('r%03d' % i, con='x' * 1000))
+			for i in range(195):
+				db.deleteResource(newResource('r%03d' % i))
+
+			# Not in the middle of a transaction
+			db.beginTransaction()
+			self.assertEqual(db.compactDB(0.1), 0)
+			db.commitTransaction()
+
+			self.assertGreater(db.compactDB(0.1), 0)
+			self.assertEqual(db.conn.execute('PRAGMA freelist_count').fetchone()[0], 0)
+			self.assertEqual(resourceIDs(db), [ 'r195', 'r196', 'r197', 'r198', 'r199' ])
+		finally:
+			db.closeDB()
+
+
+	def test_compactInMemory(self):
+		db = self.openBinding()
+		try:
+			db.insertResource(newResource('r1'))
+			db.deleteResource(newResource('r1'))
+			self.assertEqual(db.compactDB(0.0), 0)
+		finally:
+			db.closeDB()
+
+
+class TestIndexes(unittest.TestCase):
+
+	def test_sortedIndex(self):
+		index = SortedIndex()
+		rnd = random.Random(42)
+		values = {}
+		for i in range(2000):
+			key = 'r%d' % rnd.randrange(500)
+			value = rnd.choice([ None, '%04d' % rnd.randrange(300) ])	# many equal values
+			index.put(key, value)
+			if value is None:
+				values.pop(key, None)
+			else:
+				values[key] = value
+		ordered = [ key for _, key in sorted((value, key) for key, value in values.items()) ]
+		self.assertEqual(len(index), len(values))
+		self.assertEqual(index.range(), ordered)
+		self.assertEqual(index.range(after='0100'), [ key for key in ordered if values[key] > '0100' ])
+		self.assertEqual(index.range(before='0100'), [ key for key in ordered if values[key] < '0100' ])
+		self.assertEqual(index.range(after='0100', before='0200'), [ key for key in ordered if '0100' < values[key] < '0200' ])
+		self.assertEqual(index.range(after='9999'), [])
+		for key in list(values):
+			self.assertEqual(index.get(key), values[key])
+			index.remove(key)
+		self.assertEqual(len(index), 0)
+		self.assertEqual(index.range(), [])
+
+
+class TestStorage(StorageTestCase):
+
+	#
+	#	Indexes and counters
+	#
+
+	def test_indexesAndCounters(self):
+		storage = self.openStorage()
+		ae = self.createResource({ 'm2m:ae' : { 'rn' : 'ae', 'api' : 'Ntest', 'rr' : False, 'srv' : [ '3' ], 'lbl' : [ 'tag:ae' ], 'acpi' : [ 'acp1' ] } }, ty=T.AE, pi=self.cse.ri)
+		cnt = self.createResource({ 'm2m:cnt' : { 'rn' : 'cnt', 'lbl' : [ 'tag:cnt' ] } }, ty=T.CNT, pi=ae.ri)
+		cins = [ self.createResource({ 'm2m:cin' : { 'rn' : 'cin%d' % i, 'con' : 'x' * (i + 1) } }, ty=T.CIN, pi=cnt.ri) for i in range(3) ]
+		grp = self.createResource({ 'm2m:grp' : { 'rn' : 'grp', 'mt' : 0, 'mnm' : 10, 'mid' : [ ae.ri ] } }, ty=T.GRP, pi=self.cse.ri)
+
+		def assertIndexes() -> None:
+			self.assertEqual(storage.countResources(), 7)
+			self.assertEqual(storage.countResources(T.CIN), 3)
+			self.assertEqual(storage.countResourcesByType(), { T.CSEBase : 1, T.AE : 1, T.CNT : 1, T.CIN : 3, T.GRP : 1 })
+			self.assertEqual(storage.countChildResources(self.cse.ri), 2)
+			self.assertEqual(storage.countDescendantResources(self.cse.ri), 6)
+			self.assertEqual(storage.countDescendantResources(ae.ri), 4)
+			self.assertEqual(storage.parentResourceID(cnt.ri), ae.ri)
+			self.assertEqual(storage.resourceIDsForTypes([ T.AE, T.CNT ]), { ae.ri, cnt.ri })
+			self.assertEqual(storage.resourceIDsForLabels([ 'tag:ae', 'tag:cnt' ]), { ae.ri, cnt.ri })
+			self.assertEqual([ r.ri for r in storage.searchByACPI('acp1') ], [ ae.ri ])
+			self.assertEqual([ r.ri for r in storage.searchGroupsForMember(ae.ri) ], [ grp.ri ])
+			self.assertEqual([ r.ri for r in storage.contentInstances(cnt.ri) ], [ cin.ri for cin in cins ])
+			self.assertEqual(storage.countContentInstances(cnt.ri), (3, 6))
+			self.assertEqual(storage.oldestContentInstance(cnt.ri).ri, cins[0].ri)
+			self.assertEqual(storage.latestContentInstance(cnt.ri).ri, cins[2].ri)
+			self.assertEqual(storage.resourceIDsForTimeRange('ct', after=cins[0].ct), { cins[1].ri, cins[2].ri, grp.ri })
+
+		assertIndexes()
+		storage = self.reopenStorage()		# the indexes are built from the database
+		assertIndexes()
+
+		# Updates and deletes change the indexes
+		ae = storage.retrieveResource(ri=ae.ri).resource
+		ae.setAttribute('lbl', [ 'tag:updated' ])
+		ae.setAttribute('acpi', [ 'acp2' ])
+		storage.updateResource(ae)
+		storage.deleteResource(cins[0])
+		self.assertEqual(storage.resourceIDsForLabels([ 'tag:ae' ]), set())
+		self.assertEqual(storage.resourceIDsForLabels([ 'tag:updated' ]), { ae.ri })
+		self.assertEqual(storage.searchByACPI('acp1'), [])
+		self.assertEqual([ r.ri for r in storage.searchByACPI('acp2') ], [ ae.ri ])
+		self.assertEqual(storage.countResources(), 6)
+		self.assertEqual(storage.countResources(T.CIN), 2)
+		self.assertEqual(storage.countDescendantResources(self.cse.ri), 5)
+		self.assertEqual(storage.countContentInstances(cnt.ri), (2, 5))
+		self.assertEqual(storage.oldestContentInstance(cnt.ri).ri, cins[1].ri)
+
+
+	def test_statistics(self):
+		from Statistics import Statistics, resourceCount, resourceTypeCounts, resourceCacheHits, resourceCacheMisses, dbReclaimedBytes
+		storage = self.openStorage()
+		ae = self.createResource({ 'm2m:ae' : { 'rn' : 'ae', 'api' : 'Ntest', 'rr' : False, 'srv' : [ '3' ] } }, ty=T.AE, pi=self.cse.ri)
+		storage.retrieveResource(ri=ae.ri)
+		storage.retrieveResource(ri=ae.ri)
+		storage.reclaimedBytes = 42
+
+		# Without the event handlers and the background worker of the statistics component
+		statistics = Statistics.__new__(Statistics)
+		statistics.statisticsEnabled = True
+		statistics.statLock = Lock()
+		statistics.stats = statistics.setupStats()
+		stats = statistics.getStats()
+		self.assertEqual(stats[resourceCount], 2)
+		self.assertEqual(stats[resourceTypeCounts], { str(int(T.AE)) : 1, str(int(T.CSEBase)) : 1 })
+		self.assertEqual(stats[resourceCacheHits], 1)
+		self.assertEqual(stats[resourceCacheMisses], 2)		# including the <CSEBase> resource when opening the storage
+		self.assertEqual(stats[dbReclaimedBytes], 42)
+
+
+	#
+	#	Resources from documents
+	#
+
+	def test_resourcesDontShareDocuments(self):
+		storage = self.openStorage(resourceCacheSize=0)
+		ae = self.createResource({ 'm2m:ae' : { 'rn' : 'ae', 'api' : 'Ntest', 'rr' : False, 'srv' : [ '3' ], 'lbl' : [ 'tag:ae' ] } }, ty=T.AE, pi=self.cse.ri)
+		Utils._documentTemplates.clear()
+		for _ in range(2):	# the first resource of a class is created from scratch, the others from its attributes
+			resource = storage.retrieveResource(ri=ae.ri).resource
+			self.assertIsNot(resource._originalJson, resource.json)
+			resource['lbl'].append('tag:changed')
+			resource.setAttribute('acpi', [ 'acp1' ])
+			self.assertEqual(storage.retrieveResource(ri=ae.ri).resource.lbl, [ 'tag:ae' ])
+			self.assertIsNone(storage.retrieveResource(ri=ae.ri).resource.acpi)
+			self.assertEqual(storage.db.searchResources(ri=ae.ri)[0]['lbl'], [ 'tag:ae' ])
+			self.assertNotIn('acpi', storage.db.searchResources(ri=ae.ri)[0])
+
+
+	def test_cloneResource(self):
+		self.openStorage()
+		ae = self.createResource({ 'm2m:ae' : { 'rn' : 'ae', 'api' : 'Ntest', 'rr' : False, 'srv' : [ '3' ], 'lbl' : [ 'tag:ae' ] } }, ty=T.AE, pi=self.cse.ri)
+		for copyOnWrite in [ False, True ]:
+			resource = ae.clone(copyOnWrite=copyOnWrite)
+			self.assertIsNot(resource.json, ae.json)
+			resource['lbl'].append('tag:changed')
+			resource.setAttribute('srv', [ '4' ])
+			resource.setAttribute('rn', 'changed')
+			self.assertEqual(resource.lbl, [ 'tag:ae', 'tag:changed' ])
+			self.assertEqual(ae.lbl, [ 'tag:ae' ])
+			self.assertEqual(ae.srv, [ '3' ])
+			self.assertEqual(ae.rn, 'ae')
+			self.assertIs(resource.attributePolicies, ae.attributePolicies)
+		self.assertIsNot(ae.clone()._originalJson, ae._originalJson)
+
+
+	#
+	#	Resource cache
+	#
+
+	def test_resourceCache(self):
+		storage = self.openStorage(resourceCacheSize=10)
+		cache = storage.resourceCache
+		ae = self.createResource({ 'm2m:ae' : { 'rn' : 'ae', 'api' : 'Ntest', 'rr' : False, 'srv' : [ '3' ], 'lbl' : [ 'tag:ae' ] } }, ty=T.AE, pi=self.cse.ri)
+		hits, misses = cache.hits, cache.misses
+
+		# The first retrieval is a miss, the following are hits
+		resource = storage.retrieveResource(ri=ae.ri).resource
+		self.assertEqual((cache.hits, cache.misses), (hits, misses + 1))
+		self.assertIn(ae.ri, cache.entries)
+		self.assertIsNot(resource, cache.entries[ae.ri])
+		resource['lbl'].append('tag:changed')		# doesn't change the cached resource
+		resource.setAttribute('rn', 'changed')
+		resource = storage.retrieveResource(ri=ae.ri).resource
+		self.assertEqual((cache.hits, cache.misses), (hits + 1, misses + 1))
+		self.assertEqual(resource.lbl, [ 'tag:ae' ])
+		self.assertEqual(resource.rn, 'ae')
+
+		# Updates invalidate the cached resource
+		generation = cache.generation
+		resource.setAttribute('lbl', [ 'tag:updated' ])
+		storage.updateResource(resource)
+		self.assertNotIn(ae.ri, cache.entries)
+		self.assertGreater(cache.generation, generation)
+		self.assertEqual(storage.retrieveResource(ri=ae.ri).resource.lbl, [ 'tag:updated' ])
+		self.assertEqual(cache.misses, misses + 2)
+
+		# A resource that was read before an invalidation is not cached
+		generation = cache.generation
+		cache.remove(ae.ri)
+		cache.put(ae.ri, resource, generation)
+		self.assertNotIn(ae.ri, cache.entries)
+
+		# Deletes invalidate the cached resource
+		storage.retrieveResource(ri=ae.ri)
+		self.assertIn(ae.ri, cache.entries)
+		storage.deleteResource(resource)
+		self.assertNotIn(ae.ri, cache.entries)
+		self.assertIsNone(storage.retrieveResource(ri=ae.ri).resource)
+
+
+	def test_resourceCacheEviction(self):
+		cache = LRUCache(2)
+		cache.put('r1', 1)
+		cache.put('r2', 2)
+		self.assertEqual(cache.get('r1'), 1)		# r2 is now the least recently used entry
+		cache.put('r3', 3)
+		self.assertIsNone(cache.get('r2'))
+		self.assertEqual((cache.get('r1'), cache.get('r3')), (1, 3))
+		self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+		cache = LRUCache(0)		# disabled
+		cache.put('r1', 1)
+		self.assertEqual(len(cache), 0)
+
+
+	def test_rollbackAndBackupChangedListAttribute(self):
+		storage = self.openStorage()
+		ae = self.createResource({ 'm2m:ae' : { 'rn' : 'ae', 'api' : 'Ntest', 'rr' : False, 'srv' : [ '3' ], 'lbl' : [ 'tag:ae' ] } }, ty=T.AE, pi=self.cse.ri)
+		filename = storage.backup('%s/backup-test' % self.path)
+
+		# Change the list in place and roll back
+		with self.assertRaises(RuntimeError):
+			with storage.transaction():
+				resource = storage.retrieveResource(ri=ae.ri).resource
+				resource['lbl'].append('tag:rolledBack')
+				storage.updateResource(resource)
+				raise RuntimeError('rollback')
+		self.assertEqual(storage.retrieveResource(ri=ae.ri).resource.lbl, [ 'tag:ae' ])
+		self.assertEqual(storage.resourceIDsForLabels([ 'tag:rolledBack' ]), set())
+
+		# Change the list in place after the backup was written, and restore the backup
+		resource = storage.retrieveResource(ri=ae.ri).resource
+		resource['lbl'].append('tag:updated')
+		storage.updateResource(resource)
+		self.assertEqual(storage.retrieveResource(ri=ae.ri).resource.lbl, [ 'tag:ae', 'tag:updated' ])
+		storage.restore(filename)
+		storage._buildIndexes()		# like when restoring at startup
+		self.assertEqual(storage.retrieveResource(ri=ae.ri).resource.lbl, [ 'tag:ae' ])
+
+
+	def test_rollbackOnlyReindexesChangedResources(self):
+		storage = self.openStorage()
+		ae = self.createResource({ 'm2m:ae' : { 'rn' : 'ae', 'api' : 'Ntest', 'rr' : False, 'srv' : [ '3' ], 'lbl' : [ 'tag:ae' ] } }, ty=T.AE, pi=self.cse.ri)
+		cnt1 = self.createResource({ 'm2m:cnt' : { 'rn' : 'cnt1', 'lbl' : [ 'tag:cnt' ] } }, ty=T.CNT, pi=ae.ri)
+		cnt2 = self.createResource({ 'm2m:cnt' : { 'rn' : 'cnt2' } }, ty=T.CNT, pi=ae.ri)
+		sub = self.createResource({ 'm2m:sub' : { 'rn' : 'sub', 'nu' : [ 'http://localhost:9990' ], 'enc' : { 'net' : [ 1, 3 ] } } }, ty=T.SUB, pi=cnt2.ri)
+		self.assertTrue(storage.addSubscription(sub))
+
+		# The indexes and caches must not be built again from the whole database
+		def rebuild() -> None:
+			raise AssertionError('indexes are rebuilt')
+		storage._buildIndexes = rebuild				# type: ignore
+		storage._buildSubscriptionCache = rebuild	# type: ignore
+		if isinstance(storage.db, TinyDBBinding):
+			storage.db._rebuildIndexes = rebuild	# type: ignore
+
+		with self.assertRaises(RuntimeError):
+			with storage.transaction():
+				cnt3 = self.createResource({ 'm2m:cnt' : { 'rn' : 'cnt3', 'lbl' : [ 'tag:cnt' ] } }, ty=T.CNT, pi=ae.ri)
+				storage.deleteResource(cnt1)
+				resource = storage.retrieveResource(ri=ae.ri).resource
+				resource['lbl'] = [ 'tag:rolledBack' ]
+				storage.updateResource(resource)
+				storage.removeSubscription(sub)
+				raise RuntimeError('rollback')
+
+		self.assertEqual(resourceIDs(storage.db, ae.ri), [ cnt1.ri, cnt2.ri ])
+		self.assertIsNone(storage.retrieveResource(ri=cnt3.ri).resource)
+		self.assertEqual(storage.retrieveResource(srn=cnt1.__srn__).resource.ri, cnt1.ri)
+		self.assertEqual(storage.retrieveResource(ri=ae.ri).resource.lbl, [ 'tag:ae' ])
+		self.assertEqual(storage.resourceIDsForLabels([ 'tag:cnt' ]), { cnt1.ri })
+		self.assertEqual(storage.resourceIDsForLabels([ 'tag:rolledBack' ]), set())
+		self.assertEqual(storage.countResources(T.CNT), 2)
+		self.assertEqual(storage.countDescendantResources(self.cse.ri), 4)
+		self.assertEqual(storage.getSubscription(sub.ri)['ri'], sub.ri)
+
+
+	#
+	#	Concurrent writes
+	#
+
+	def test_writesDontWaitForTransactionsOfOtherTables(self):
+		storage = self.openStorage()
+		ae = self.createResource({ 'm2m:ae' : { 'rn' : 'ae', 'api' : 'Ntest', 'rr' : False, 'srv' : [ '3' ], 'lbl' : [ 'tag:ae' ] } }, ty=T.AE, pi=self.cse.ri)
+		inTransaction = Event()
+		finishTransaction = Event()
+
+		def transaction() -> None:
+			with self.assertRaises(RuntimeError):
+				with storage.transaction():
+					resource = storage.retrieveResource(ri=ae.ri).resource
+					resource['lbl'] = [ 'tag:rolledBack' ]
+					storage.updateResource(resource)
+					inTransaction.set()
+					finishTransaction.wait(10)
+					raise RuntimeError('rollback')
+
+		def updateResource() -> None:
+			resource = storage.retrieveResource(ri=ae.ri).resource
+			resource['lbl'] = [ 'tag:updated' ]
+			storage.updateResource(resource)
+
+		def writeOtherTables() -> None:
+			storage.updateStatistics({ 'test' : 1 })
+			storage.addBatchNotification(ae.ri, 'http://nu', { 'test' : 1 })
+			storage.updateAppData({ 'id' : 'test', 'value' : 1 })
+
+		transactionThread = Thread(target=transaction)
+		transactionThread.start()
+		self.assertTrue(inTransaction.wait(10))
+		try:
+			# Other tables are written while the transaction is open, but resources wait for it
+			otherTablesThread = Thread(target=writeOtherTables)
+			otherTablesThread.start()
+			otherTablesThread.join(10)
+			self.assertFalse(otherTablesThread.is_alive())
+			resourceThread = Thread(target=updateResource)
+			resourceThread.start()
+			resourceThread.join(0.2)
+			self.assertTrue(resourceThread.is_alive())
+		finally:
+			finishTransaction.set()
+			transactionThread.join(10)
+		resourceThread.join(10)
+		self.assertFalse(resourceThread.is_alive())
+
+		# The rollback only restored the resource, and the waiting update was written after it
+		self.assertEqual(storage.retrieveResource(ri=ae.ri).resource.lbl, [ 'tag:updated' ])
+		self.assertEqual(storage.getStatistics()['test'], 1)
+		self.assertEqual(storage.countBatchNotifications(ae.ri, 'http://nu'), 1)
+		self.assertEqual(storage.getAppData('test')['value'], 1)
+
+
+	#
+	#	Subscription cache
+	#
+
+	def test_subscriptionCache(self):
+		storage = self.openStorage()
+		ae = self.createResource({ 'm2m:ae' : { 'rn' : 'ae', 'api' : 'Ntest', 'rr' : False, 'srv' : [ '3' ] } }, ty=T.AE, pi=self.cse.ri)
+		sub = self.createResource({ 'm2m:sub' : { 'rn' : 'sub', 'nu' : [ 'http://localhost:9990' ], 'enc' : { 'net' : [ 1, 3 ] } } }, ty=T.SUB, pi=ae.ri)
+		self.assertTrue(storage.addSubscription(sub))
+		self.assertEqual([ s['ri'] for s in storage.getSubscriptionsForParent(ae.ri) ], [ sub.ri ])
+		self.assertEqual(storage.getSubscription(sub.ri)['pi'], ae.ri)
+		self.assertEqual(storage.getSubscriptionsForParent(self.cse.ri), [])
+
+		sub.setAttribute('nu', [ 'http://localhost:9991' ])
+		self.assertTrue(storage.updateSubscription(sub))
+		self.assertEqual(storage.getSubscription(sub.ri)['nus'], [ 'http://localhost:9991' ])
+
+		storage = self.reopenStorage()		# the cache is built from the database
+		self.assertEqual([ s['ri'] for s in storage.getSubscriptionsForParent(ae.ri) ], [ sub.ri ])
+		self.assertEqual(storage.getSubscription(sub.ri)['nus'], [ 'http://localhost:9991' ])
+
+		self.assertTrue(storage.removeSubscription(sub))
+		self.assertIsNone(storage.getSubscription(sub.ri))
+		self.assertEqual(storage.getSubscriptionsForParent(ae.ri), [])
+		self.assertNotIn(ae.ri, storage.subscriptionsByParent)
+
+
+def run():
+	suite = unittest.TestSuite()
+	suite.addTest(TestJournal('test_journalReplayAfterCrash', 'journal'))
+	suite.addTest(TestJournal('test_journalIgnoreIncompleteEntry'))
+	suite.addTest(TestJournal('test_journalReplayTransactionCompletelyOrNot'))
+	suite.addTest(TestJournal('test_journalReplayOnSnapshot'))
+	suite.addTest(TestCodec('test_migrateCodec'))
+	suite.addTest(TestCodec('test_migrateDatabaseFiles', 'tinydb'))
+	suite.addTest(TestCodec('test_migrateDatabaseFiles', 'journal'))
+	for binding in StorageTestCase.bindings:
+		suite.addTest(TestBinding('test_childResourcesOrderedByCreationTime', binding))
+		suite.addTest(TestBinding('test_commitTransaction', binding))
+		suite.addTest(TestBinding('test_rollbackTransaction', binding))
+		suite.addTest(TestBinding('test_backupAndRestore', binding))
+	suite.addTest(TestBinding('test_restoreInvalidBackup', 'tinydb'))
+	suite.addTest(TestBinding('test_writesDontConvertTable', 'memory'))
+	suite.addTest(TestBinding('test_writesDontConvertTable', 'journal'))
+	suite.addTest(TestCompaction('test_compactRenumbersDocuments', 'tinydb'))
+	suite.addTest(TestCompaction('test_compactOnlyChangedTables', 'tinydb'))
+	suite.addTest(TestCompaction('test_compactWithWriteBehind', 'tinydb'))
+	suite.addTest(TestCompaction('test_compactBelowThreshold', 'tinydb'))
+	suite.addTest(TestCompaction('test_compactJournal', 'journal'))
+	suite.addTest(TestCompaction('test_compactSQLite', 'sqlite'))
+	suite.addTest(TestCompaction('test_compactInMemory', 'memory'))
+	suite.addTest(TestCompaction('test_compactInMemory', 'sqlite-memory'))
+	suite.addTest(TestIndexes('test_sortedIndex'))
+	suite.addTest(TestStorage('test_cloneResource'))
+	suite.addTest(TestStorage('test_resourceCacheEviction'))
+	for binding in StorageTestCase.bindings:
+		suite.addTest(TestStorage('test_indexesAndCounters', binding))
+		suite.addTest(TestStorage('test_statistics', binding))
+		suite.addTest(TestStorage('test_resourcesDontShareDocuments', binding))
+		suite.addTest(TestStorage('test_rollbackAndBackupChangedListAttribute', binding))
+		suite.addTest(TestStorage('test_rollbackOnlyReindexesChangedResources', binding))
+		suite.addTest(TestStorage('test_resourceCache', binding))
+		suite.addTest(TestStorage('test_subscriptionCache', binding))
+		suite.addTest(TestStorage('test_writesDontWaitForTransactionsOfOtherTables', binding))
+	result = unittest.TextTestRunner(verbosity=testVerbosity, failfast=True).run(suite)
+	return result.testsRun, len(result.errors + result.failures), len(result.skipped)
+
+
+if __name__ == '__main__':
+	_, errors, _ = run()
+	sys.exit(errors)
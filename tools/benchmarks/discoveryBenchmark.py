@@ -0,0 +1,114 @@
+#
+#	discoveryBenchmark.py
+#
+#	(c) 2020 by Andreas Kraft
+#	License: BSD 3-Clause License. See the LICENSE file for further details.
+#
+#	Micro-benchmark for the filter criteria of discovery requests.
+#
+#	The benchmark creates a synthetic resource tree (CSEBase, AEs, containers
+#	and contentInstances) of real resource objects in memory and matches a
+#	couple of typical filters against every resource of the tree, like a
+#	discovery that walks the whole tree. The database is not involved.
+#
+
+import argparse, copy, datetime, os, shutil, sys, tempfile, time
+from typing import Any, Dict, List, Tuple
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../acme'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../apps'))
+
+from rich.console import Console
+from rich.table import Table
+import CSE	# import first to resolve the import order of the CSE's modules
+from Configuration import Configuration
+from Dispatcher import DiscoveryFilter
+from Types import FilterOperation
+from Types import ResourceTypes as T
+from resources.Resource import Resource
+from storageBenchmark import BenchmarkStorage, openBinding, populateResources
+import Utils
+
+
+# name -> (fo, conditions, attributes)
+filters:Dict[str, Tuple[int, dict, dict]] = {
+	'ty'					: (FilterOperation.AND, { 'ty' : [ '4' ] }, None),
+	'ty, lbl'				: (FilterOperation.AND, { 'ty' : [ '3' ], 'lbl' : [ 'tag:odd' ] }, None),
+	'cra, crb'				: (FilterOperation.AND, { 'cra' : '20201026T120001,000000', 'crb' : '20201026T120002,000000' }, None),
+	'sza, cty'				: (FilterOperation.AND, { 'sza' : '5', 'cty' : [ 'text/plain:0' ] }, None),
+	'attribute'				: (FilterOperation.AND, None, { 'con' : 'value 7' }),
+	'attribute wildcard'	: (FilterOperation.AND, None, { 'con' : 'value 7*' }),
+	'ty, lbl, attribute'	: (FilterOperation.AND, { 'ty' : [ '4' ], 'lbl' : [ 'tag:odd' ] }, { 'rn' : 'cin*' }),
+	'ty or lbl (OR)'		: (FilterOperation.OR,  { 'ty' : [ '2', '3' ], 'lbl' : [ 'tag:odd' ] }, None),
+}
+
+
+def resourceTree(numberAEs:int, numberCINs:int) -> List[Resource]:
+	"""	Return the resources of a synthetic resource tree, in the order of a tree walk.
+		The documents of one real resource of each type are used as templates.
+	"""
+	path = tempfile.mkdtemp(prefix='acme-benchmark-')
+	db = openBinding('tinydb', True, path)
+	Configuration._configuration['cse.expirationDelta'] = 60*60*24*365
+	CSE.storage = BenchmarkStorage(db)
+	try:
+		populateResources(db, 1, 1)
+		templates = { doc['ty'] : doc for doc in db.iterateResources(lambda r: True) }
+		start = datetime.datetime(2020, 10, 26, 12).timestamp()
+		sequence = 0
+
+		def resource(ty:T, rn:str, parent:dict, **kwargs:Any) -> dict:
+			nonlocal sequence
+			sequence += 1
+			doc = copy.deepcopy(templates[ty])
+			ts = Utils.toISO8601Date(start + sequence / 1000)	# one resource per millisecond
+			doc.update({ 'ri' : '%s%d' % (rn, sequence), 'rn' : rn, 'pi' : parent['ri'], 'ct' : ts, 'lt' : ts, Resource._srn : '%s/%s' % (parent[Resource._srn], rn) })
+			doc.update(kwargs)
+			documents.append(doc)
+			return doc
+
+		documents:List[dict] = [ (cse := templates[T.CSEBase]) ]
+		for a in range(numberAEs):
+			ae = resource(T.AE, 'ae%d' % a, cse)
+			cnt = resource(T.CNT, 'cnt', ae, lbl=[ 'tag:benchmark', 'tag:odd' if a % 2 else 'tag:even' ])
+			for c in range(numberCINs):
+				con = 'value %d' % c
+				resource(T.CIN, 'cin%d' % c, cnt, con=con, cs=len(con), lbl=[ 'tag:odd' if c % 2 else 'tag:even' ])
+		return [ Utils.resourceFromDocument(doc).resource for doc in documents ]
+	finally:
+		CSE.storage = None
+		db.closeDB()
+		shutil.rmtree(path, ignore_errors=True)
+
+
+def benchmarkFilters(resources:List[Resource], runs:int=5) -> Dict[str, Tuple[float, int]]:
+	"""	Compile each filter and match it against all resources. Return the average time
+		and the number of matching resources for each filter.
+	"""
+	results:Dict[str, Tuple[float, int]] = {}
+	for name, (fo, conditions, attributes) in filters.items():
+		total = 0.0
+		for _ in range(runs):
+			start = time.perf_counter()
+			discoveryFilter = DiscoveryFilter(fo, conditions, attributes)
+			matches = sum(1 for r in resources if discoveryFilter.match(r))
+			total += time.perf_counter() - start
+		results[name] = (total / runs, matches)
+	return results
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark the filter criteria of discovery requests')
+	parser.add_argument('--aes', action='store', dest='aes', type=int, default=1000, help='number of AEs (default: 1000)')
+	parser.add_argument('--cins', action='store', dest='cins', type=int, default=98, help='number of contentInstances per AE (default: 98)')
+	parser.add_argument('--runs', action='store', dest='runs', type=int, default=5, help='number of runs per filter (default: 5)')
+	args = parser.parse_args()
+
+	resources = resourceTree(args.aes, args.cins)
+	table = Table(title='[ACME] - Discovery Filter Benchmark (%d resources)' % len(resources))
+	table.add_column('Filter')
+	table.add_column('Matches', justify='right')
+	table.add_column('Time (s)', justify='right')
+	table.add_column('Resources/s', justify='right')
+	for name, (t, matches) in benchmarkFilters(resources, args.runs).items():
+		table.add_row(name, str(matches), '%.4f' % t, '%.0f' % (len(resources) / t))
+	Console().print(table)
@@ -0,0 +1,380 @@
+#
+#	storageBenchmark.py
+#
+#	(c) 2020 by Andreas Kraft
+#	License: BSD 3-Clause License. See the LICENSE file for further details.
+#
+#	Benchmark for the database bindings of the CSE's storage component.
+#
+#	The benchmark replays the sequence of storage operations that the CSE
+#	performs while running the unit tests (create AE and containers, add
+#	contentInstances, retrieve, discover, update and delete resources) 
+#	directly against each database binding, both in memory and on disk.
+#	Optionally, it measures the throughput of retrieve requests that are
+#	performed concurrently by several request threads, the size and the
+#	write and read times of the database files in the supported formats, or
+#	the time for creating resource objects from the stored documents.
+#
+
+import argparse, copy, cProfile, io, os, pstats, random, shutil, sys, tempfile, threading, time
+from typing import Any, Callable, Dict, List, Tuple
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../acme'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../apps'))
+
+from rich.console import Console
+from rich.table import Table
+import CSE	# import first to resolve the import order of the CSE's modules
+from Configuration import Configuration
+from Storage import StorageBinding, TinyDBBinding, SQLiteBinding
+from tinydb import TinyDB						# type: ignore
+from tinydb.middlewares import CachingMiddleware	# type: ignore
+from tinydb.storages import JSONStorage			# type: ignore
+from Types import ResourceTypes as T
+from helpers import Codecs
+import Utils
+
+
+class BenchmarkResource(object):
+	"""	Minimal stand-in for a Resource. The bindings only access the resource's
+		JSON and some of its attributes.
+	"""
+	def __init__(self, jsn:dict) -> None:
+		self.json = jsn
+
+	def __getattr__(self, key:str) -> Any:
+		return self.json.get(key)
+
+	def __getitem__(self, key:str) -> Any:
+		return self.json.get(key)
+
+
+def newResource(ty:int, rn:str, pi:str, srn:str, **kwargs:Any) -> BenchmarkResource:
+	ri = '%s%d' % (rn, random.randint(1, sys.maxsize))
+	jsn = {	'ty' : ty, 'ri' : ri, 'rn' : rn, 'pi' : pi, 'ct' : '20201026T120000,000000', 'lt' : '20201026T120000,000000',
+			'et' : '20211026T120000,000000', 'acpi' : [ 'acpAdmin' ], '__srn__' : srn }
+	jsn.update(kwargs)
+	return BenchmarkResource(jsn)
+
+
+def create(db:StorageBinding, resource:BenchmarkResource) -> None:
+	"""	Storage calls for a CREATE request: check existence, insert, update after activation, parent reload & update. """
+	db.hasResource(ri=resource.ri)
+	db.hasResource(srn=resource.__srn__)
+	db.insertResource(resource)
+	db.updateResource(resource)
+	if len(parents := db.searchResources(ri=resource.pi)) == 1:
+		db.updateResource(BenchmarkResource(parents[0]))
+
+
+def retrieve(db:StorageBinding, srn:str) -> None:
+	"""	Storage calls for a RETRIEVE request by structured name. """
+	db.searchResources(srn=srn)
+
+
+def runWorkload(db:StorageBinding, numberAEs:int, numberCINs:int) -> Dict[str, float]:
+	timings:Dict[str, float] = {}
+
+	def measure(name:str, func:Callable) -> Any:
+		start = time.perf_counter()
+		result = func()
+		timings[name] = timings.get(name, 0.0) + (time.perf_counter() - start)
+		return result
+
+	cse = newResource(5, 'cse-in', '', 'cse-in', csi='/id-in')
+	measure('create', lambda: create(db, cse))
+	aes:List[BenchmarkResource] = []
+	cnts:List[BenchmarkResource] = []
+	cins:List[BenchmarkResource] = []
+	for a in range(numberAEs):
+		ae = newResource(2, 'ae%d' % a, cse.ri, 'cse-in/ae%d' % a, aei='Cae%d' % a, api='NbenchmarkAE', rr=True)
+		measure('create', lambda: create(db, ae))
+		aes.append(ae)
+		cnt = newResource(3, 'cnt', ae.ri, '%s/cnt' % ae.__srn__, mni=numberCINs, mbs=10000, cni=0, cbs=0, st=0)
+		measure('create', lambda: create(db, cnt))
+		cnts.append(cnt)
+		for c in range(numberCINs):
+			cin = newResource(4, 'cin%d' % c, cnt.ri, '%s/cin%d' % (cnt.__srn__, c), cnf='text/plain:0', con='value %d' % c, cs=8, st=0)
+			measure('create', lambda: create(db, cin))
+			cins.append(cin)
+
+	for resource in aes + cnts + cins:
+		measure('retrieve', lambda: retrieve(db, resource.__srn__))
+	for cnt in cnts:
+		measure('children', lambda: db.searchResources(pi=cnt.ri, ty=4))
+	for ae in aes:
+		measure('update', lambda: db.updateResource(ae))
+	measure('discover', lambda: db.discoverResources(lambda r: r.get('ty') == 4 and r.get('cs', 0) > 4))
+	measure('acpi', lambda: db.searchByValueInField('acpi', 'acpAdmin'))
+	for resource in cins + cnts + aes:
+		measure('delete', lambda: db.deleteResource(resource))
+	return timings
+
+
+def populate(db:StorageBinding, numberAEs:int, numberCINs:int) -> List[str]:
+	"""	Create the AEs, containers and contentInstances. Return their structured names. """
+	srns:List[str] = []
+	cse = newResource(5, 'cse-in', '', 'cse-in', csi='/id-in')
+	create(db, cse)
+	for a in range(numberAEs):
+		ae = newResource(2, 'ae%d' % a, cse.ri, 'cse-in/ae%d' % a, aei='Cae%d' % a, api='NbenchmarkAE', rr=True)
+		create(db, ae)
+		cnt = newResource(3, 'cnt', ae.ri, '%s/cnt' % ae.__srn__, mni=numberCINs, mbs=10000, cni=0, cbs=0, st=0)
+		create(db, cnt)
+		srns.extend([ ae.__srn__, cnt.__srn__ ])
+		for c in range(numberCINs):
+			cin = newResource(4, 'cin%d' % c, cnt.ri, '%s/cin%d' % (cnt.__srn__, c), cnf='text/plain:0', con='value %d' % c, cs=8, st=0)
+			create(db, cin)
+			srns.append(cin.__srn__)
+	return srns
+
+
+def runConcurrentRetrieves(db:StorageBinding, numberAEs:int, numberCINs:int, numberThreads:int, numberRetrieves:int) -> float:
+	"""	Retrieve resources by their structured names from several threads at the same time.
+		Return the number of retrieves per second.
+	"""
+	srns = populate(db, numberAEs, numberCINs)
+	barrier = threading.Barrier(numberThreads + 1)
+	def retrieveWorker(offset:int) -> None:
+		barrier.wait()
+		for i in range(numberRetrieves // numberThreads):
+			retrieve(db, srns[(offset + i) % len(srns)])
+
+	threads = [ threading.Thread(target=retrieveWorker, args=(t * len(srns) // numberThreads,)) for t in range(numberThreads) ]
+	for thread in threads:
+		thread.start()
+	barrier.wait()
+	start = time.perf_counter()
+	for thread in threads:
+		thread.join()
+	return (numberRetrieves // numberThreads * numberThreads) / (time.perf_counter() - start)
+
+
+class JSONStorageBinding(TinyDBBinding):
+	"""	TinyDB binding with TinyDB's own JSONStorage for the database files, like before
+		the database codecs were added. Every write is synchronized to the disk.
+	"""
+	def _openFileDB(self, filename:str) -> TinyDB:
+		db = TinyDB(filename + '.json', storage=CachingMiddleware(JSONStorage))
+		db.storage.WRITE_CACHE_SIZE = self.writeBufferSize
+		return db
+
+
+def openBinding(binding:str, inMemory:bool, path:str, writeBehindInterval:float=0.0, fsync:bool=False) -> StorageBinding:
+	Configuration._configuration = {	'db.inMemory' : inMemory, 
+										'db.cacheSize' : 0, 
+										'db.path' : path,
+										'db.journal' : False,
+										'db.codec' : 'json',
+										'db.compression' : 'none',
+										'db.fsync' : fsync,
+										'db.writeBehindInterval' : writeBehindInterval,
+										'db.writeBehindOperations' : 100 }
+	db:StorageBinding = { 'sqlite' : SQLiteBinding, 'jsonstorage' : JSONStorageBinding }.get(binding, TinyDBBinding)(path)
+	db.openDB('-benchmark')
+	db.purgeDB()
+	random.seed(1)
+	return db
+
+
+def benchmark(binding:str, inMemory:bool, numberAEs:int, numberCINs:int, writeBehindInterval:float=0.0, fsync:bool=False) -> Dict[str, float]:
+	path = tempfile.mkdtemp(prefix='acme-benchmark-')
+	db = openBinding(binding, inMemory, path, writeBehindInterval, fsync)
+	try:
+		return runWorkload(db, numberAEs, numberCINs)
+	finally:
+		db.closeDB()
+		shutil.rmtree(path, ignore_errors=True)
+
+
+def benchmarkThreads(binding:str, numberAEs:int, numberCINs:int, numberThreads:int, numberRetrieves:int) -> float:
+	path = tempfile.mkdtemp(prefix='acme-benchmark-')
+	db = openBinding(binding, True, path)
+	try:
+		return runConcurrentRetrieves(db, numberAEs, numberCINs, numberThreads, numberRetrieves)
+	finally:
+		db.closeDB()
+		shutil.rmtree(path, ignore_errors=True)
+
+
+class BenchmarkStorage(object):
+	"""	Minimal stand-in for the Storage component. Creating resources only looks up
+		the identifiers of their parents.
+	"""
+	def __init__(self, db:StorageBinding) -> None:
+		self.db = db
+
+	def identifier(self, ri:str) -> List[dict]:
+		return self.db.searchIdentifiers(ri=ri)
+
+
+def populateResources(db:StorageBinding, numberAEs:int, numberCINs:int) -> None:
+	"""	Create and store real resource objects, so that the stored documents are complete. """
+	def store(jsn:dict, pi:str=None, ty:T=None) -> str:
+		resource = Utils.resourceFromJSON(jsn, pi=pi, ty=ty, create=True).resource
+		db.insertResource(resource)
+		return resource.ri
+
+	cse = store({ 'm2m:cb' : { 'ri' : 'id-in', 'rn' : 'cse-in', 'csi' : '/id-in' } }, ty=T.CSEBase)
+	for a in range(numberAEs):
+		ae = store({ 'm2m:ae' : { 'rn' : 'ae%d' % a, 'api' : 'NbenchmarkAE', 'rr' : True, 'srv' : [ '3' ], 'acpi' : [ 'acpAdmin' ] } }, pi=cse)
+		cnt = store({ 'm2m:cnt' : { 'rn' : 'cnt', 'mni' : numberCINs, 'lbl' : [ 'tag:benchmark' ] } }, pi=ae)
+		store({ 'm2m:sub' : { 'rn' : 'sub', 'nu' : [ 'http://localhost:9990' ], 'enc' : { 'net' : [ 1, 3 ] } } }, pi=cnt)
+		for c in range(numberCINs):
+			store({ 'm2m:cin' : { 'rn' : 'cin%d' % c, 'cnf' : 'text/plain:0', 'con' : 'value %d' % c } }, pi=cnt)
+
+
+def benchmarkDocuments(numberAEs:int, numberCINs:int, runs:int=5, profile:bool=False) -> Dict[str, Tuple[float, str]]:
+	"""	Create resource objects from the stored documents with Utils.resourceFromJSON() 
+		and with Utils.resourceFromDocument(). Return the average time for all documents 
+		and, optionally, the top entries of a profile of each function.
+	"""
+	path = tempfile.mkdtemp(prefix='acme-benchmark-')
+	db = openBinding('tinydb', True, path)
+	Configuration._configuration['cse.expirationDelta'] = 60*60*24*365
+	CSE.storage = BenchmarkStorage(db)
+	results:Dict[str, Tuple[float, str]] = {}
+	try:
+		populateResources(db, numberAEs, numberCINs)
+		documents = list(db.iterateResources(lambda r: True))
+		for name, func in [ ('resourceFromJSON', Utils.resourceFromJSON), ('resourceFromDocument', Utils.resourceFromDocument) ]:
+			func(copy.deepcopy(documents[0]))	# warm up, e.g. resourceFromDocument()'s templates
+			total = 0.0
+			profiler = cProfile.Profile() if profile else None
+			for _ in range(runs):
+				copies = copy.deepcopy(documents)	# resourceFromDocument() takes over the documents
+				if profiler:
+					profiler.enable()
+				start = time.perf_counter()
+				for document in copies:
+					func(document)
+				total += time.perf_counter() - start
+				if profiler:
+					profiler.disable()
+			stats = ''
+			if profiler:
+				stream = io.StringIO()
+				pstats.Stats(profiler, stream=stream).sort_stats('tottime').print_stats(8)
+				stats = stream.getvalue()
+			results[name] = (total / runs, stats)
+	finally:
+		CSE.storage = None
+		db.closeDB()
+		shutil.rmtree(path, ignore_errors=True)
+	return results
+
+
+def benchmarkCodecs(numberAEs:int, numberCINs:int, runs:int=5) -> Dict[str, Tuple[int, float, float]]:
+	"""	Write and read the resources database in each available format. Return the
+		file size and the average write and read times for each format.
+	"""
+	path = tempfile.mkdtemp(prefix='acme-benchmark-')
+	db = openBinding('tinydb', True, path)
+	results:Dict[str, Tuple[int, float, float]] = {}
+	try:
+		populate(db, numberAEs, numberCINs)
+		tables = db.dbResources.storage.read()
+		for format in Codecs.formats:
+			if not Codecs.isAvailable(format):
+				continue
+			for compression in Codecs.compressions:
+				codec = Codecs.Codec(format, compression)
+				filename = '%s/resources%s' % (path, codec.extension)
+				start = time.perf_counter()
+				for _ in range(runs):
+					codec.write(filename, tables)
+				writeTime = (time.perf_counter() - start) / runs
+				start = time.perf_counter()
+				for _ in range(runs):
+					codec.read(filename)
+				readTime = (time.perf_counter() - start) / runs
+				results[str(codec)] = (os.path.getsize(filename), writeTime, readTime)
+	finally:
+		db.closeDB()
+		shutil.rmtree(path, ignore_errors=True)
+	return results
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark the CSE\'s database bindings')
+	parser.add_argument('--aes', action='store', dest='aes', type=int, default=20, help='number of AEs (default: 20)')
+	parser.add_argument('--cins', action='store', dest='cins', type=int, default=50, help='number of contentInstances per AE (default: 50)')
+	parser.add_argument('--memory-only', action='store_true', dest='memoryOnly', default=False, help='only benchmark the in-memory mode')
+	parser.add_argument('--write-behind', action='store_true', dest='writeBehind', default=False, help='buffer database changes (write-behind)')
+	parser.add_argument('--threads', action='store', dest='threads', type=int, default=0, help='measure concurrent retrieves with up to this number of threads instead')
+	parser.add_argument('--retrieves', action='store', dest='retrieves', type=int, default=100000, help='number of concurrent retrieves (default: 100000)')
+	parser.add_argument('--codecs', action='store_true', dest='codecs', default=False, help='measure the database file formats instead')
+	parser.add_argument('--file-writes', action='store_true', dest='fileWrites', default=False, help='compare the TinyDB file storages with and without fsync instead')
+	parser.add_argument('--documents', action='store_true', dest='documents', default=False, help='measure creating resources from stored documents instead')
+	parser.add_argument('--profile', action='store_true', dest='profile', default=False, help='print a profile for --documents')
+	args = parser.parse_args()
+
+	if args.documents:
+		results = benchmarkDocuments(args.aes, args.cins, profile=args.profile)
+		table = Table(title='[ACME] - Resource Creation Benchmark (%d AEs, %d CINs each)' % (args.aes, args.cins))
+		table.add_column('Function')
+		table.add_column('Time (s)', justify='right')
+		table.add_column('Speedup', justify='right')
+		base = results['resourceFromJSON'][0]
+		for name, (t, _) in results.items():
+			table.add_row(name, '%.4f' % t, '%.1fx' % (base / t))
+		Console().print(table)
+		for name, (_, stats) in results.items():
+			if stats:
+				Console().print('[bold]Profile: %s' % name)
+				print(stats)
+		sys.exit(0)
+
+	if args.codecs:
+		table = Table(title='[ACME] - Database File Format Benchmark (%d AEs, %d CINs each)' % (args.aes, args.cins))
+		table.add_column('Format')
+		table.add_column('Size (bytes)', justify='right')
+		table.add_column('Write (s)', justify='right')
+		table.add_column('Read (s)', justify='right')
+		for name, (size, writeTime, readTime) in benchmarkCodecs(args.aes, args.cins).items():
+			table.add_row(name, str(size), '%.4f' % writeTime, '%.4f' % readTime)
+		Console().print(table)
+		sys.exit(0)
+
+	if args.fileWrites:
+		variants = {	'JSONStorage (baseline)'	: ('jsonstorage', False),
+						'CodecStorage, fsync'		: ('tinydb', True),
+						'CodecStorage'				: ('tinydb', False) }
+		results = { name : benchmark(binding, False, args.aes, args.cins, 0.05 if args.writeBehind else 0.0, fsync) for name, (binding, fsync) in variants.items() }
+		table = Table(title='[ACME] - TinyDB File Storage Benchmark (%d AEs, %d CINs each, on disk)' % (args.aes, args.cins))
+		table.add_column('Operation')
+		for name in results:
+			table.add_column(name, justify='right')
+		for operation in [ 'create', 'update', 'delete' ]:
+			table.add_row(operation, *[ '%.4f' % timings.get(operation, 0.0) for timings in results.values() ])
+		table.add_row('Total', *[ '%.4f' % sum(timings.values()) for timings in results.values() ], style='bold')
+		Console().print(table)
+		Console().print('All times in seconds')
+		sys.exit(0)
+
+	if args.threads > 0:
+		threadCounts = sorted({ 1 } | { 2**i for i in range(args.threads.bit_length()) if 2**i <= args.threads } | { args.threads })
+		table = Table(title='[ACME] - Concurrent Retrieve Benchmark (%d AEs, %d CINs each, in memory)' % (args.aes, args.cins))
+		table.add_column('Threads', justify='right')
+		for binding in [ 'tinydb', 'sqlite' ]:
+			table.add_column(binding, justify='right')
+		for threadCount in threadCounts:
+			table.add_row(str(threadCount), *[ '%.0f' % benchmarkThreads(binding, args.aes, args.cins, threadCount, args.retrieves) for binding in [ 'tinydb', 'sqlite' ] ])
+		Console().print(table)
+		Console().print('Retrieves per second')
+		sys.exit(0)
+
+	operations = [ 'create', 'retrieve', 'children', 'update', 'discover', 'acpi', 'delete' ]
+	results:Dict[str, Dict[str, float]] = {}
+	for inMemory in ([ True ] if args.memoryOnly else [ True, False ]):
+		for binding in [ 'tinydb', 'sqlite' ]:
+			results['%s (%s)' % (binding, 'memory' if inMemory else 'disk')] = benchmark(binding, inMemory, args.aes, args.cins, 0.05 if args.writeBehind else 0.0)
+
+	table = Table(title='[ACME] - Storage Benchmark (%d AEs, %d CINs each)' % (args.aes, args.cins))
+	table.add_column('Operation')
+	for name in results:
+		table.add_column(name, justify='right')
+	for operation in operations:
+		table.add_row(operation, *[ '%.4f' % timings.get(operation, 0.0) for timings in results.values() ])
+	table.add_row('Total', *[ '%.4f' % sum(timings.values()) for timings in results.values() ], style='bold')
+	Console().print(table)
+	Console().print('All times in seconds')
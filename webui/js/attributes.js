@@ -210,6 +210,10 @@ const shortNames = {
   "cseSU" : { "ln" : "cseStartUpTime", "type": "custom" },
   "cseUT" : { "ln" : "cseUptime", "type": "custom" },
   "ctRes" : { "ln" : "resourceCount", "type": "custom" },
+  "ctTyp" : { "ln" : "resourceTypeCounts", "type": "custom" },
+  "rcHit" : { "ln" : "resourceCacheHits", "type": "custom" },
+  "rcMis" : { "ln" : "resourceCacheMisses", "type": "custom" },
+  "dbRcl" : { "ln" : "dbReclaimedBytes", "type": "custom" },
   "htCre" : { "ln" : "httpCreates", "type": "custom" },
   "htDel" : { "ln" : "httpDeletes", "type": "custom" },
   "htRet" : { "ln" : "httpRetrieves", "type": "custom" },